@@ -20,6 +20,7 @@ sys.path.insert(1, ci_dir)
 import clean      # noqa: E402
 import glci.util  # noqa: E402
 import glci.model # noqa: E402
+import glci.release_index # noqa: E402
 import paths      # noqa: E402
 
 
@@ -73,30 +74,75 @@ def clean_build_result_repository():
         action='store_true',
         help=('only print information about objects to be deleted'),
     )
+    parser.add_argument(
+        '--use-release-index',
+        action='store_true',
+        help=('use (and refresh) the local release index to determine referenced objects'),
+    )
+    parser.add_argument(
+        '--age-from-listing',
+        action='store_true',
+        help=('determine manifest age from S3 listing (LastModified) instead of retrieving '
+              'all manifests'),
+    )
+    parser.add_argument(
+        '--verify-margin-days',
+        default=1,
+        help=('with --age-from-listing: verify manifests modified within this amount of days '
+              'after the cut-off date using their build timestamp, default: %(default)s'),
+        type=float,
+    )
 
     parsed = parser.parse_args()
 
     cicd_cfg = glci.util.cicd_cfg(parsed.cicd_cfg)
 
-    print('purging outdated build snapshot manifests')
-    clean.clean_single_release_manifests(
-        max_age_days=parsed.snapshot_max_age_days,
-        cicd_cfg=cicd_cfg,
-        dry_run=parsed.dry_run,
-    )
+    purged_manifest_keys = []
+    if parsed.age_from_listing:
+        for description, prefix in (
+            ('build snapshot manifests', glci.model.ReleaseManifest.manifest_key_prefix),
+            (
+                'build result snapshot sets (release-candidates)',
+                os.path.join(
+                    glci.model.ReleaseManifestSet.release_manifest_set_prefix,
+                    glci.model.PipelineFlavour.SNAPSHOT.value,
+                ),
+            ),
+        ):
+            print(f'purging outdated {description}')
+            summary = clean.clean_outdated_manifests(
+                max_age_days=parsed.snapshot_max_age_days,
+                cicd_cfg=cicd_cfg,
+                prefix=prefix,
+                dry_run=parsed.dry_run,
+                verify_margin_days=parsed.verify_margin_days,
+            )
+            print(f'{summary.keys} manifests ({summary.bytes} octets), {summary.failed} failed')
+            purged_manifest_keys.extend(summary.deleted_keys)
+    else:
+        print('purging outdated build snapshot manifests')
+        clean.clean_single_release_manifests(
+            max_age_days=parsed.snapshot_max_age_days,
+            cicd_cfg=cicd_cfg,
+            dry_run=parsed.dry_run,
+        )
 
-    print('purging outdated build result snapshot sets (release-candidates)')
-    clean.clean_release_manifest_sets(
-        max_age_days=parsed.snapshot_max_age_days,
-        cicd_cfg=cicd_cfg,
-        dry_run=parsed.dry_run,
-    )
+        print('purging outdated build result snapshot sets (release-candidates)')
+        clean.clean_release_manifest_sets(
+            max_age_days=parsed.snapshot_max_age_days,
+            cicd_cfg=cicd_cfg,
+            dry_run=parsed.dry_run,
+        )
 
     print('purging loose objects')
-    clean.clean_orphaned_objects(
+    summary = clean.clean_orphaned_objects(
         cicd_cfg=cicd_cfg,
         dry_run=parsed.dry_run,
+        release_index=glci.release_index.default_index() if parsed.use_release_index else None,
+        # in dry-run mode, manifests were not actually purged
+        ignored_manifest_keys=purged_manifest_keys,
     )
+    print(f'{summary.keys} objects ({summary.bytes} octets), {summary.failed} failed')
 
 
 def gardenlinux_epoch():
@@ -397,6 +443,69 @@ def retrieve_release_set():
         )
 
 
+def list_releases():
+    parser = argparse.ArgumentParser(
+        description='List release manifests from the build artifact repository, using the local '
+        'release index (see glci.release_index)',
+        epilog='Example: list-releases --gardenlinux-epoch=318 --platform=aws',
+    )
+    parser.add_argument(
+        '--cicd-cfg',
+        default='default',
+        help='configuration key for ci, default: \'%(default)s\'',
+    )
+    parser.add_argument('--gardenlinux-epoch', type=int)
+    parser.add_argument('--committish', help='commit hash (may be abbreviated)')
+    parser.add_argument('--version')
+    parser.add_argument(
+        '--architecture',
+        type=glci.model.Architecture,
+        action=EnumAction,
+    )
+    parser.add_argument(
+        '--platform',
+        choices=[p.name for p in glci.model.platforms()],
+    )
+    parser.add_argument(
+        '--published',
+        action='store_true',
+        default=None,
+        help='only list releases with published images',
+    )
+    parser.add_argument(
+        '--no-refresh',
+        action='store_true',
+        help='do not refresh the index from the build artifact repository',
+    )
+
+    parsed = parser.parse_args()
+
+    if not (release_index := glci.release_index.default_index()):
+        print(f'ERROR: release index is disabled (see {glci.release_index.index_path_env_var})')
+        sys.exit(1)
+
+    cicd_cfg = glci.util.cicd_cfg(parsed.cicd_cfg)
+    bucket_name = cicd_cfg.build.s3_bucket_name
+
+    if not parsed.no_refresh:
+        s3_client = ccc.aws.session(cicd_cfg.build.aws_cfg_name).client('s3')
+        release_index.refresh(s3_client=s3_client, bucket_name=bucket_name)
+
+    for release in release_index.releases(
+        bucket_name=bucket_name,
+        gardenlinux_epoch=parsed.gardenlinux_epoch,
+        build_committish=parsed.committish,
+        version=parsed.version,
+        architecture=parsed.architecture,
+        platform=parsed.platform,
+        published=parsed.published,
+    ):
+        print(
+            f'{release.s3_key} {release.gardenlinux_epoch} {release.build_committish[:6]} '
+            f'{release.build_timestamp}{" (published)" if release.published else ""}'
+        )
+
+
 def main():
     cmd_name = os.path.basename(sys.argv[0]).replace('-', '_')
 
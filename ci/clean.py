@@ -1,11 +1,20 @@
 import concurrent.futures
+import dataclasses
 import datetime
 import itertools
 import logging
 import os
+import sqlite3
+import threading
 import typing
 
+import botocore.client
+import dateutil.parser
+
+import glci.manifest_cache
+import glci.manifest_codec
 import glci.model
+import glci.release_index
 import glci.s3
 import glci.util
 
@@ -104,21 +113,58 @@ def clean_single_release_manifests(
         pass
 
 
+def _release_manifest_set_objects(
+    release_manifest_set: glci.model.OnlineReleaseManifestSet,
+) -> typing.Generator[glci.model.S3_ReleaseFile, None, None]:
+    for release_manifest in release_manifest_set.manifests:
+        yield from glci.release_index._referenced_objects(release_manifest)
+    if release_manifest_set.logs:
+        yield from release_manifest_set.logs
+
+
+def _document_objects(
+    document: dict,
+    s3_key: str,
+    s3_bucket: str,
+) -> typing.Generator[glci.model.S3_ReleaseFile, None, None]:
+    '''
+    yields the objects referenced from the given (raw) single release manifest or release manifest
+    set document
+    '''
+    if 'manifests' in document:
+        yield from _release_manifest_set_objects(glci.manifest_codec.release_manifest_set_from_dict(
+            document,
+            s3_key=s3_key,
+            s3_bucket=s3_bucket,
+        ))
+    else:
+        release_manifest = glci.manifest_codec.release_manifest_from_dict(
+            document,
+            s3_key=s3_key,
+            s3_bucket=s3_bucket,
+        )
+        yield from glci.release_index._referenced_objects(release_manifest)
+
+
 def _enumerate_objects_from_single_release_manifests(
     cicd_cfg: glci.model.CicdCfg=glci.util.cicd_cfg(),
     prefix: str=glci.model.ReleaseManifest.manifest_key_prefix,
+    ignored_manifest_keys: typing.Collection[str]=frozenset(),
 ) -> typing.Generator[glci.model.S3_ReleaseFile, None, None]:
     enumerate_releases = glci.util.preconfigured(
         glci.util.enumerate_releases,
         cicd_cfg=cicd_cfg,
     )
     for release_manifest in enumerate_releases(prefix=prefix):
-        yield from release_manifest.paths
+        if release_manifest.s3_key in ignored_manifest_keys:
+            continue
+        yield from glci.release_index._referenced_objects(release_manifest)
 
 
 def _enumerate_objects_from_release_manifest_sets(
     cicd_cfg: glci.model.CicdCfg=glci.util.cicd_cfg(),
     prefix: str=glci.model.ReleaseManifestSet.release_manifest_set_prefix,
+    ignored_manifest_keys: typing.Collection[str]=frozenset(),
 ) -> typing.Generator[glci.model.S3_ReleaseFile, None, None]:
     enumerate_release_sets = glci.util.preconfigured(
         glci.util.enumerate_release_sets,
@@ -126,75 +172,517 @@ def _enumerate_objects_from_release_manifest_sets(
     )
 
     for release_manifest_set in enumerate_release_sets(prefix=prefix):
-        for release_manifest in release_manifest_set.manifests:
-            yield from release_manifest.paths
-        if release_manifest_set.logs:
-            yield from release_manifest_set.logs
+        if release_manifest_set.s3_key in ignored_manifest_keys:
+            continue
+        yield from _release_manifest_set_objects(release_manifest_set)
+
+
+@dataclasses.dataclass
+class DeletionSummary:
+    keys: int = 0
+    bytes: int = 0
+    failed: int = 0
+    # only filled if requested (see `_BatchDeleter`)
+    deleted_keys: typing.List[str] = dataclasses.field(default_factory=list)
+
+
+class _BatchDeleter:
+    '''
+    deletes objects from one bucket using `delete_objects` calls of up to 1000 keys each. Batches
+    are deleted asynchronously (bounded amount of batches in flight). In dry-run mode, the keys to
+    be deleted are only logged.
+    '''
+    max_batch_size = 1000 # limit imposed by DeleteObjects
+
+    def __init__(
+        self,
+        s3_client: 'botocore.client.S3',
+        bucket_name: str,
+        dry_run: bool=False,
+        max_workers: int=4,
+        record_keys: bool=False,
+    ):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.dry_run = dry_run
+        self.record_keys = record_keys
+        self.summary = DeletionSummary()
+        self._batch = {} # {key: size}
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._in_flight = threading.BoundedSemaphore(max_workers * 2)
+        self._futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self._batch = {} # do not delete any more objects if there was an error
+        self.close()
+
+    def add(self, key: str, size: int=0):
+        self._batch[key] = size
+        if len(self._batch) >= self.max_batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, {}
+
+        if self.dry_run:
+            for key in batch:
+                logger.info(f'would delete {self.bucket_name}/{key}')
+            self._account(batch=batch, failed_keys=())
+            return
+
+        self._in_flight.acquire()
+        self._futures.append(self._executor.submit(self._delete, batch))
+        # fail early (and do not accumulate futures)
+        while self._futures and self._futures[0].done():
+            self._futures.pop(0).result()
+
+    def _delete(self, batch: typing.Dict[str, int]):
+        try:
+            res = self.s3_client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={
+                    'Objects': [{'Key': key} for key in batch],
+                    'Quiet': True,
+                },
+            )
+            failed_keys = {error['Key'] for error in res.get('Errors', ())}
+            for error in res.get('Errors', ()):
+                logger.warning(f'failed to delete {error["Key"]}: {error.get("Message")}')
+            self._account(batch=batch, failed_keys=failed_keys)
+            logger.info(f'purged {len(batch) - len(failed_keys)} objects')
+        finally:
+            self._in_flight.release()
+
+    def _account(self, batch: typing.Dict[str, int], failed_keys: typing.Collection[str]):
+        with self._lock:
+            for key, size in batch.items():
+                if key in failed_keys:
+                    self.summary.failed += 1
+                else:
+                    self.summary.keys += 1
+                    self.summary.bytes += size
+                    if self.record_keys:
+                        self.summary.deleted_keys.append(key)
+
+    def close(self) -> DeletionSummary:
+        self._flush()
+        try:
+            for future in self._futures:
+                future.result()
+        finally:
+            self._futures = []
+            self._executor.shutdown()
+        return self.summary
+
+
+class _SortedKeySet:
+    '''
+    a set of S3 keys, stored (sorted) in a temporary on-disk sqlite database, so memory consumption
+    does not grow w/ the amount of keys. Instances may be shared between threads.
+    '''
+    def __init__(self):
+        # empty path: private temporary database (removed when closed)
+        self._conn = sqlite3.connect('', check_same_thread=False)
+        self._conn.execute('CREATE TABLE keys (key TEXT PRIMARY KEY) WITHOUT ROWID')
+        self._lock = threading.Lock()
+
+    def add_all(self, keys: typing.Iterable[str], chunk_size: int=10000):
+        keys = iter(keys)
+        while (chunk := list(itertools.islice(keys, chunk_size))):
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO keys (key) VALUES (?)',
+                    ((key,) for key in chunk),
+                )
+
+    def range(self, first_key: str, last_key: str) -> typing.List[str]:
+        '''
+        returns the (sorted) contained keys from `first_key` to `last_key` (both inclusive)
+        '''
+        with self._lock:
+            return [
+                key for (key,) in self._conn.execute(
+                    'SELECT key FROM keys WHERE key>=? AND key<=? ORDER BY key',
+                    (first_key, last_key),
+                )
+            ]
+
+    def chunks(self, chunk_size: int=1000) -> typing.Generator[typing.List[str], None, None]:
+        '''
+        yields all contained keys (sorted), in chunks of up to `chunk_size` keys
+        '''
+        last_key = ''
+        while True:
+            with self._lock:
+                chunk = [
+                    key for (key,) in self._conn.execute(
+                        'SELECT key FROM keys WHERE key>? ORDER BY key LIMIT ?',
+                        (last_key, chunk_size),
+                    )
+                ]
+            if not chunk:
+                return
+            yield chunk
+            last_key = chunk[-1]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM keys').fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+
+def _unreferenced(
+    obj_dicts: typing.Sequence[dict],
+    referenced_keys: typing.Sequence[str],
+) -> typing.Generator[dict, None, None]:
+    '''
+    merge-joins the given (sorted) listing page against the (sorted) referenced keys from the same
+    key-range, yielding the object-dicts of unreferenced objects
+    '''
+    referenced = iter(referenced_keys)
+    referenced_key = next(referenced, None)
+    for obj_dict in obj_dicts:
+        key = obj_dict['Key']
+        while referenced_key is not None and referenced_key < key:
+            referenced_key = next(referenced, None)
+        if key != referenced_key:
+            yield obj_dict
 
 
 def clean_orphaned_objects(
     cicd_cfg: glci.model.CicdCfg=glci.util.cicd_cfg(),
     prefix='objects',
     dry_run: bool=False,
-):
-    all_objects = {
-        object_descriptor for object_descriptor in
-        itertools.chain(
-            _enumerate_objects_from_release_manifest_sets(
-                cicd_cfg=cicd_cfg,
-            ),
-            _enumerate_objects_from_single_release_manifests(
-                cicd_cfg=cicd_cfg,
-            )
-        )
-    }
-
+    release_index: typing.Optional[glci.release_index.ReleaseIndex]=None,
+    ignored_manifest_keys: typing.Collection[str]=frozenset(),
+) -> DeletionSummary:
+    '''
+    purges objects that are no longer referenced by any (single) release manifest or release
+    manifest set.
+
+    Referenced keys are streamed (concurrently from both kinds of manifests) into a sorted, on-disk
+    key set. The (sorted) listing of the given prefix is then merge-joined against it, page by
+    page, and unreferenced objects are deleted in batches (while listing continues).
+
+    If a release index is passed, it is refreshed and used to determine the objects referenced
+    from single release manifests (instead of retrieving all of them).
+
+    Manifests w/ keys contained in `ignored_manifest_keys` are treated as if they were already
+    deleted (useful for dry-runs of cascading manifest cleanups). As the release index has no
+    notion of this, it is not used in that case.
+    '''
     # XXX assume for now that we only use one bucket
     s3_bucket_name = cicd_cfg.build.s3_bucket_name
-    all_object_keys = {
-        o.s3_key for o in all_objects if o.s3_bucket_name == s3_bucket_name
-    }
+    s3_client = glci.s3.s3_client(cicd_cfg=cicd_cfg)
+
+    referenced_keys = _referenced_key_set(
+        cicd_cfg=cicd_cfg,
+        s3_client=s3_client,
+        release_index=release_index,
+        ignored_manifest_keys=ignored_manifest_keys,
+    )
+    try:
+        listed = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as list_executor, \
+            _BatchDeleter(
+                s3_client=s3_client,
+                bucket_name=s3_bucket_name,
+                dry_run=dry_run,
+            ) as deleter:
+            for res in glci.util._list_object_pages(
+                s3_client=s3_client,
+                bucket_name=s3_bucket_name,
+                prefix=prefix,
+                executor=list_executor,
+            ):
+                obj_dicts = res['Contents']
+                listed += len(obj_dicts)
+
+                for obj_dict in _unreferenced(
+                    obj_dicts=obj_dicts,
+                    referenced_keys=referenced_keys.range(
+                        first_key=obj_dicts[0]['Key'],
+                        last_key=obj_dicts[-1]['Key'],
+                    ),
+                ):
+                    deleter.add(key=obj_dict['Key'], size=obj_dict.get('Size', 0))
+    finally:
+        referenced_keys.close()
+
+    summary = deleter.summary
+    logger.info(
+        f'{"would have purged" if dry_run else "purged"} {summary.keys} of {listed} objects '
+        f'({summary.bytes} octets) below {prefix=}; {summary.failed} deletions failed'
+    )
+    return summary
+
+
+def _referenced_key_set(
+    cicd_cfg: glci.model.CicdCfg,
+    s3_client: 'botocore.client.S3',
+    release_index: typing.Optional[glci.release_index.ReleaseIndex]=None,
+    ignored_manifest_keys: typing.Collection[str]=frozenset(),
+) -> _SortedKeySet:
+    '''
+    returns the keys of all objects from the build-result bucket that are referenced by any (single)
+    release manifest or release manifest set (see `clean_orphaned_objects`). The caller is
+    responsible for closing the returned key set.
+    '''
+    ignored_manifest_keys = frozenset(ignored_manifest_keys)
+    if ignored_manifest_keys:
+        release_index = None
+
+    s3_bucket_name = cicd_cfg.build.s3_bucket_name
 
-    logger.debug(f'{len(all_objects)=}')
-    logger.debug(f'{len(all_object_keys)=}')
+    def own_keys(objects: typing.Iterable[glci.model.S3_ReleaseFile]):
+        return (o.s3_key for o in objects if o.s3_bucket_name == s3_bucket_name)
 
+    def single_release_keys():
+        if release_index:
+            release_index.refresh(
+                s3_client=s3_client,
+                bucket_name=s3_bucket_name,
+            )
+            return release_index.referenced_object_keys(bucket_name=s3_bucket_name)
+
+        return own_keys(_enumerate_objects_from_single_release_manifests(
+            cicd_cfg=cicd_cfg,
+            ignored_manifest_keys=ignored_manifest_keys,
+        ))
+
+    referenced_keys = _SortedKeySet()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            for future in (
+                executor.submit(
+                    lambda: referenced_keys.add_all(own_keys(
+                        _enumerate_objects_from_release_manifest_sets(
+                            cicd_cfg=cicd_cfg,
+                            ignored_manifest_keys=ignored_manifest_keys,
+                        )
+                    ))
+                ),
+                executor.submit(lambda: referenced_keys.add_all(single_release_keys())),
+            ):
+                future.result()
+
+        logger.info(f'{len(referenced_keys)} objects are referenced from manifests')
+    except BaseException:
+        referenced_keys.close()
+        raise
+
+    return referenced_keys
+
+
+def _clean_unreferenced_keys(
+    cicd_cfg: glci.model.CicdCfg,
+    candidate_keys: _SortedKeySet,
+    prefix: str='objects',
+    dry_run: bool=False,
+    ignored_manifest_keys: typing.Collection[str]=frozenset(),
+) -> DeletionSummary:
+    '''
+    purges those of the given candidate keys (below the given prefix) that are not referenced by
+    any (single) release manifest or release manifest set. Unlike `clean_orphaned_objects`, the
+    bucket is not listed; the (sorted) candidates are merge-joined against the referenced keys
+    instead. As object sizes are not known, no octets are accounted for.
+    '''
+    s3_bucket_name = cicd_cfg.build.s3_bucket_name
     s3_client = glci.s3.s3_client(cicd_cfg=cicd_cfg)
 
-    continuation_token = None
-    while True:
-        ctoken_args = {'ContinuationToken': continuation_token} \
-                if continuation_token \
-                else {}
+    referenced_keys = _referenced_key_set(
+        cicd_cfg=cicd_cfg,
+        s3_client=s3_client,
+        ignored_manifest_keys=ignored_manifest_keys,
+    )
+    try:
+        candidates = 0
+        with _BatchDeleter(
+            s3_client=s3_client,
+            bucket_name=s3_bucket_name,
+            dry_run=dry_run,
+        ) as deleter:
+            for keys in candidate_keys.chunks():
+                obj_dicts = [{'Key': key} for key in keys if key.startswith(prefix)]
+                if not obj_dicts:
+                    continue
+                candidates += len(obj_dicts)
+
+                for obj_dict in _unreferenced(
+                    obj_dicts=obj_dicts,
+                    referenced_keys=referenced_keys.range(
+                        first_key=obj_dicts[0]['Key'],
+                        last_key=obj_dicts[-1]['Key'],
+                    ),
+                ):
+                    deleter.add(key=obj_dict['Key'])
+    finally:
+        referenced_keys.close()
+
+    summary = deleter.summary
+    logger.info(
+        f'{"would have purged" if dry_run else "purged"} {summary.keys} of {candidates} objects '
+        f'referenced by purged manifests below {prefix=}; {summary.failed} deletions failed'
+    )
+    return summary
 
-        res = s3_client.list_objects_v2(
-            Bucket=s3_bucket_name,
-            Prefix=prefix,
-            **ctoken_args,
-        )
-        if res['KeyCount'] == 0:
-            break
 
-        continuation_token = res.get('NextContinuationToken')
+def _build_date(document: dict) -> typing.Optional[datetime.datetime]:
+    '''
+    returns the build date from the given (raw) single release manifest or release manifest set
+    document (as a timezone-aware datetime; naive timestamps are interpreted as UTC)
+    '''
+    if 'manifests' in document:
+        # manifest set - all timestamps should usually be pretty close to each other
+        if not document['manifests']:
+            return None
+        document = document['manifests'][0]
 
-        object_keys = {obj_dict['Key'] for obj_dict in res['Contents']}
+    build_date = dateutil.parser.isoparse(document['build_timestamp'])
+    if not build_date.tzinfo:
+        build_date = build_date.replace(tzinfo=datetime.timezone.utc)
+    return build_date
 
-        # determine those keys that are no longer referenced by any manifest
-        loose_object_keys = object_keys - all_object_keys
 
-        if dry_run:
-            logger.info(f'would delete {len(loose_object_keys)=} unreferenced objs:')
+def clean_outdated_manifests(
+    max_age_days: int=14,
+    cicd_cfg: glci.model.CicdCfg=glci.util.cicd_cfg(),
+    prefix: str=glci.model.ReleaseManifest.manifest_key_prefix,
+    dry_run: bool=False,
+    verify_margin_days: float=0,
+    cascade: bool=False,
+    max_workers: int=16,
+) -> DeletionSummary:
+    '''
+    purges manifests (single release manifests or release manifest sets) below the given prefix
+    that are older than `max_age_days`, deciding from listing data (instead of retrieving all
+    manifests).
+
+    A manifest's `LastModified` timestamp is never earlier than its build timestamp (manifests are
+    uploaded after the build, and only ever updated later on, e.g. when publishing). Thus, manifests
+    w/ outdated `LastModified` timestamps are outdated. Manifests last modified within
+    `verify_margin_days` before the cut-off date may still have been built before it - those (and
+    only those) are retrieved, and checked using their build timestamp.
+
+    If `cascade` is set, the objects referenced by purged manifests are collected while purging
+    them, and those no longer referenced by any remaining manifest are purged afterwards (see
+    `_clean_unreferenced_keys`).
+    '''
+    bucket_name = cicd_cfg.build.s3_bucket_name
+    s3_client = glci.s3.s3_client(cicd_cfg=cicd_cfg)
 
-        else:
-            if loose_object_keys:
-                s3_client.delete_objects(
-                    Bucket=s3_bucket_name,
-                    Delete={
-                    'Objects': [
-                        {'Key': key} for key in loose_object_keys
-                    ],
-                    },
+    oldest_allowed_date = datetime.datetime.now(tz=datetime.timezone.utc) \
+        - datetime.timedelta(days=max_age_days)
+    verify_after_date = oldest_allowed_date + datetime.timedelta(days=verify_margin_days)
+    logger.debug(f'{oldest_allowed_date=} {verify_after_date=}')
+
+    def is_outdated(obj_dict: dict) -> bool:
+        if obj_dict['LastModified'] < oldest_allowed_date:
+            return True
+
+        document = glci.util._manifest_document(
+            s3_client=s3_client,
+            bucket_name=bucket_name,
+            key=obj_dict['Key'],
+            etag=obj_dict['ETag'],
+            absent_ok=True,
+            manifest_cache=glci.manifest_cache.default_cache(),
+        )
+        if not document:
+            return False
+        if not (build_date := _build_date(document)):
+            logger.warning(f'{obj_dict["Key"]=} did not contain any manifests')
+            return False
+        return build_date < oldest_allowed_date
+
+    def referenced_keys(obj_dict: dict) -> typing.List[str]:
+        document = glci.util._manifest_document(
+            s3_client=s3_client,
+            bucket_name=bucket_name,
+            key=obj_dict['Key'],
+            etag=obj_dict['ETag'],
+            absent_ok=True,
+            manifest_cache=glci.manifest_cache.default_cache(),
+        )
+        if not document:
+            return []
+        return [
+            o.s3_key for o in _document_objects(
+                document,
+                s3_key=obj_dict['Key'],
+                s3_bucket=bucket_name,
+            )
+            if o.s3_bucket_name == bucket_name
+        ]
+
+    listed = verified = 0
+    # objects referenced by purged manifests (only collected if cascading)
+    purged_object_keys = _SortedKeySet() if cascade else None
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            _BatchDeleter(
+                s3_client=s3_client,
+                bucket_name=bucket_name,
+                dry_run=dry_run,
+                record_keys=dry_run or cascade,
+            ) as deleter:
+            for res in glci.util._list_object_pages(
+                s3_client=s3_client,
+                bucket_name=bucket_name,
+                prefix=prefix,
+                executor=executor,
+            ):
+                candidates = []
+                for obj_dict in res['Contents']:
+                    if obj_dict['Key'].endswith('/'):
+                        continue # directory marker
+                    listed += 1
+                    if obj_dict['LastModified'] < verify_after_date:
+                        candidates.append(obj_dict)
+
+                verified += sum(
+                    1 for obj_dict in candidates if obj_dict['LastModified'] >= oldest_allowed_date
                 )
-                logger.info(f'purged {len(loose_object_keys)=} unreferenced objs')
 
-        if not continuation_token:
-          break
+                outdated = [
+                    obj_dict for obj_dict, purge in
+                    zip(candidates, executor.map(is_outdated, candidates))
+                    if purge
+                ]
+                if cascade:
+                    # must be done before the manifests are purged
+                    for keys in executor.map(referenced_keys, outdated):
+                        purged_object_keys.add_all(keys)
+
+                for obj_dict in outdated:
+                    deleter.add(key=obj_dict['Key'], size=obj_dict['Size'])
+
+        summary = deleter.summary
+        logger.info(
+            f'{"would have purged" if dry_run else "purged"} {summary.keys} of {listed} manifests '
+            f'({summary.bytes} octets) below {prefix=} ({verified} verified using build timestamp); '
+            f'{summary.failed} deletions failed'
+        )
+
+        if cascade and summary.keys:
+            _clean_unreferenced_keys(
+                cicd_cfg=cicd_cfg,
+                candidate_keys=purged_object_keys,
+                dry_run=dry_run,
+                # in dry-run mode, manifests were not actually purged
+                ignored_manifest_keys=summary.deleted_keys,
+            )
+    finally:
+        if purged_object_keys is not None:
+            purged_object_keys.close()
+
+    return summary
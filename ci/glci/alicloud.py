@@ -1,10 +1,12 @@
+import collections
+import concurrent.futures
+import copy
 import dataclasses
-import datetime
 import enum
+import hashlib
 import json
 import logging
-import tempfile
-import time
+import threading
 
 from aliyunsdkcore.client import AcsClient
 from aliyunsdkecs.request.v20140526 import CopyImageRequest
@@ -16,6 +18,9 @@ from aliyunsdkecs.request.v20140526 import ModifyImageSharePermissionRequest
 import oss2
 
 import glci.model
+import glci.s3
+import glci.util
+import glci.waiter
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -51,57 +56,139 @@ class AlicloudImageMaker:
         self.region = build_cfg.alicloud_region
         self.image_oss_key = f"gardenlinux-{self.release.version}.qcow2"
         self.image_name = f"gardenlinux-{self.release.canonical_release_manifest_key_suffix()}"
-
-    # copy image from S3 to OSS
-    def cp_image_from_s3(self, s3_client):
-
+        self._acs_clients = {}
+        self._acs_clients_lock = threading.Lock()
+
+    # returns an acs client bound to the given region. Clients are (shallow) copies of the passed
+    # acs_client (thus sharing credentials and configuration), so region-specific requests may be
+    # issued concurrently, w/o switching the region of a shared client back and forth
+    def _acs_client(self, region: str) -> AcsClient:
+        with self._acs_clients_lock:
+            if not (client := self._acs_clients.get(region)):
+                client = copy.copy(self.acs_client)
+                client.set_region_id(region)
+                self._acs_clients[region] = client
+            return client
+
+    # copy image from S3 to OSS (streamed as multipart upload, w/o using local disk)
+    #
+    # S3 byte ranges are read concurrently, and uploaded as OSS multipart upload parts. If a
+    # previous (failed) upload for the same OSS key exists, it is resumed: parts that were already
+    # uploaded with matching size and md5 (which OSS returns as part ETag) are not uploaded again.
+    # Finally, the crc64 of the whole object is verified.
+    def cp_image_from_s3(
+        self,
+        s3_client,
+        part_size: int=16 * 1024 * 1024,
+        max_workers: int=8,
+        max_attempts: int=3,
+    ):
         ali_release_artifact = glci.util.virtual_image_artifact_for_platform('ali')
         ali_release_artifact_path = self.release.path_by_suffix(ali_release_artifact)
 
         s3_bucket_key = ali_release_artifact_path.s3_key
         s3_bucket_name = ali_release_artifact_path.s3_bucket_name
 
-        with tempfile.TemporaryFile() as tfh:
-            # TODO: use streaming
-            s3_client.download_fileobj(
-                Bucket=s3_bucket_name,
-                Key=s3_bucket_key,
-                Fileobj=tfh,
-            )
-            tfh.seek(0)
-            logger.info(
-                f"downloaded image from s3 {s3_bucket_name}/{s3_bucket_key}"
+        bucket = oss2.Bucket(
+            self.oss2_auth,
+            f"https://oss-{self.region}.aliyuncs.com",
+            self.bucket_name,
+        )
+        upload_id, uploaded_parts = self._init_or_resume_multipart_upload(bucket)
+
+        def upload_part(part_number: int, data: bytes) -> oss2.models.PartInfo:
+            if (part := uploaded_parts.get(part_number)) \
+                and part.size == len(data) \
+                and part.etag.lower() == hashlib.md5(data).hexdigest():
+                logger.debug(f"{part_number=} was already uploaded - skipping")
+                return part
+
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    res = bucket.upload_part(self.image_oss_key, upload_id, part_number, data)
+                    return oss2.models.PartInfo(
+                        part_number, res.etag, size=len(data), part_crc=res.crc,
+                    )
+                except (oss2.exceptions.OssError, oss2.exceptions.ClientError):
+                    if attempt == max_attempts:
+                        raise
+                    logger.warning(f"failed to upload {part_number=} - will retry")
+
+        crc64 = oss2.utils.Crc64()
+        object_crc = 0
+        parts = []
+        pending = collections.deque()
+
+        logger.info(
+            f"streaming image from s3 {s3_bucket_name}/{s3_bucket_key} to oss "
+            f"{self.bucket_name} {self.image_oss_key} in region {self.region}"
+        )
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            glci.s3.ParallelRangeReader(
+                s3_client=s3_client,
+                bucket_name=s3_bucket_name,
+                key=s3_bucket_key,
+                part_size=part_size,
+                max_buffer_bytes=part_size * max_workers,
+            ) as image_stream:
+            part_number = 1
+            while (data := image_stream.read(part_size)):
+                part_crc = oss2.utils.Crc64()
+                part_crc.update(data)
+                object_crc = crc64.combine(object_crc, part_crc.crc, len(data))
+
+                # bound memory consumption by limiting amount of parts in flight
+                if len(pending) >= max_workers:
+                    parts.append(pending.popleft().result())
+                pending.append(executor.submit(upload_part, part_number, data))
+                part_number += 1
+
+            parts.extend(future.result() for future in pending)
+
+        bucket.complete_multipart_upload(self.image_oss_key, upload_id, parts)
+
+        server_crc = bucket.head_object(self.image_oss_key).server_crc
+        if server_crc != object_crc:
+            bucket.delete_object(self.image_oss_key)
+            raise RuntimeError(
+                f"checksum mismatch for {self.image_oss_key=}: {object_crc=} {server_crc=}"
             )
 
+        logger.info(
+            f"uploaded image to oss {self.bucket_name} {self.image_oss_key=} ({len(parts)} parts)"
+        )
+
+    # returns upload_id and already uploaded parts ({part_number: PartInfo}) of a pending
+    # multipart upload for the image, or initiates a new multipart upload
+    def _init_or_resume_multipart_upload(self, bucket: oss2.Bucket) -> (str, dict):
+        for upload in oss2.MultipartUploadIterator(bucket, prefix=self.image_oss_key):
+            if upload.key != self.image_oss_key:
+                continue
+            parts = {
+                part.part_number: part for part in
+                oss2.PartIterator(bucket, self.image_oss_key, upload.upload_id)
+            }
             logger.info(
-                f"uploading to oss {self.bucket_name} {self.image_oss_key} in region {self.region}"
-            )
-            bucket = oss2.Bucket(
-                self.oss2_auth,
-                f"https://oss-{self.region}.aliyuncs.com",
-                self.bucket_name,
-            )
-            bucket.put_object(self.image_oss_key, tfh)
-            logger.info(
-                f"uploaded image to oss {self.bucket_name} {self.image_oss_key=}"
+                f"resuming multipart upload {upload.upload_id=} ({len(parts)} parts uploaded)"
             )
+            return upload.upload_id, parts
 
-    # Import image from OSS and then copy it to other regions
-    def make_image(self) -> glci.model.OnlineReleaseManifest:
+        return bucket.init_multipart_upload(self.image_oss_key).upload_id, {}
+
+    # Import image from OSS and then copy it to other regions (all regions are processed
+    # concurrently)
+    def make_image(self, max_workers: int=16) -> glci.model.OnlineReleaseManifest:
         image_id = self.import_image()
         other_regions = self._list_regions()
         logger.info(f"begin to copy image to {other_regions=}")
-        region_image_map = {}
-        for region in other_regions:
-            region_image_map[region] = self.copy_image(image_id, region)
+        region_image_map = self.copy_images(image_id, other_regions, max_workers=max_workers)
 
-        for image, region in region_image_map.items():
-            self._wait_for_image(image, region)
-            logger.info(f"finished copying {image=} to {region=}")
+        self._wait_for_images(region_image_map)
+        logger.info(f"finished copying {image_id=} to {len(region_image_map)} regions")
 
         region_image_map[self.region] = image_id
 
-        self._share_images(region_image_map)
+        self._share_images(region_image_map, max_workers=max_workers)
 
         # make release manifest
         published_images = tuple((glci.model.AlicloudPublishedImage(
@@ -116,45 +203,44 @@ class AlicloudImageMaker:
             self.release, published_image_metadata=published_image_set)
 
     # Share image as a community image. The account should apply for whitelist
-    def _share_images(self, region_image_map: dict):
-        for region, image_id in region_image_map.items():
-            self.acs_client.set_region_id(region)
+    def _share_images(self, region_image_map: dict, max_workers: int=16):
+        def share_image(region, image_id):
             logger.info(
                 f"share image ({region}/{image_id}) as a community image"
             )
             req = ModifyImageSharePermissionRequest.ModifyImageSharePermissionRequest()
             req.set_ImageId(image_id)
             req.set_IsPublic(True)
-            self.acs_client.do_action_with_exception(req)
+            self._acs_client(region).do_action_with_exception(req)
 
-        self.acs_client.set_region_id(self.region)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # consume results to re-raise errors
+            tuple(executor.map(share_image, region_image_map.keys(), region_image_map.values()))
 
     def _del_image(self, region, image_id):
         logger.warning(f"Delete image {self.image_name}/{image_id} in region {region}")
-        self.acs_client.set_region_id(region)
+        acs_client = self._acs_client(region)
         req = ModifyImageSharePermissionRequest.ModifyImageSharePermissionRequest()
         req.set_ImageId(image_id)
         req.set_IsPublic(False)
-        self.acs_client.do_action_with_exception(req)
+        acs_client.do_action_with_exception(req)
         req = DeleteImageRequest.DeleteImageRequest()
         req.set_ImageId(image_id)
-        self.acs_client.do_action_with_exception(req)
+        acs_client.do_action_with_exception(req)
 
     # delete images
     def delete_images(self, keep_going=True):
         did_raise = False
         regions = self._list_regions()
         regions.append(self.region)
-        for region in regions:
-            exist, image_id = self._check_image_existance(region, self.image_name)
-            if exist:
-                try:
-                    self._del_image(region, image_id)
-                except:
-                    if keep_going:
-                        did_raise = True
-                        continue
-                    raise
+        for region, image_id in self._find_images(regions, self.image_name).items():
+            try:
+                self._del_image(region, image_id)
+            except:
+                if keep_going:
+                    did_raise = True
+                    continue
+                raise
 
         if did_raise:
             raise
@@ -184,7 +270,7 @@ class AlicloudImageMaker:
             req.set_DiskDeviceMappings(devMap)
             logger.info(f"dev: {devMap}")
             response = parse_response(
-                self.acs_client.do_action_with_exception(req))
+                self._acs_client(self.region).do_action_with_exception(req))
             image_id = response.get("ImageId")
             logger.info(
                 f"importing job {self.image_name}[{self.region}/{image_id}] is submitted. Waiting for processed"
@@ -203,48 +289,77 @@ class AlicloudImageMaker:
         req.set_ImageName(image_name)
         req.set_Status(",".join(AlicloudImageStatus.to_availbel_str_array()))
 
-        self.acs_client.set_region_id(region)
         response = parse_response(
-            self.acs_client.do_action_with_exception(req))
+            self._acs_client(region).do_action_with_exception(req))
         count = response.get("TotalCount")
-        self.acs_client.set_region_id(self.region)
 
         if count == 0:
             return False, ""
 
         return True, response.get("Images").get("Image")[0].get("ImageId")
 
-    ####
-    def _wait_for_image(self, region, image_id):
-        start_time = datetime.datetime.now()
-        req = DescribeImagesRequest.DescribeImagesRequest()
-        req.set_ImageId(image_id)
-        req.set_Status(",".join(AlicloudImageStatus.to_availbel_str_array()))
-        self.acs_client.set_region_id(region)
-        while True:
-            elapse = datetime.datetime.now() - start_time
-            if elapse.seconds > TIME_OUT:
-                raise Exception(f"Time out to wait image {image_id} be ready")
-            response = parse_response(
-                self.acs_client.do_action_with_exception(req))
+    # checks all given regions (concurrently) for images with the specified name.
+    # Returns {region: image_id} for all regions where an image was found
+    def _find_images(self, regions, image_name, max_workers: int=16) -> dict:
+        if not regions:
+            return {}
 
-            if response.get("Images").get("Image")[0].get("Status") == str(
-                    AlicloudImageStatus.AVAILABLE):
-                break
-
-            sleep_seconds = 30
-            logger.info(
-                f"Image {image_id=} ({region=}) is not ready, will check it {sleep_seconds=} later"
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                lambda region: self._check_image_existance(region, image_name),
+                regions,
             )
-            time.sleep(sleep_seconds)
+            return {
+                region: image_id for region, (exist, image_id) in zip(regions, results) if exist
+            }
+
+    # returns a status-fetcher for images in the given region. Status of multiple images is
+    # retrieved using one DescribeImages request
+    def _image_status_fetcher(self, region) -> glci.waiter.StatusFetcher:
+        def fetch(image_ids):
+            req = DescribeImagesRequest.DescribeImagesRequest()
+            req.set_ImageId(",".join(image_ids))
+            req.set_Status(",".join(AlicloudImageStatus.to_availbel_str_array()))
+            req.set_PageSize(100)
+            response = parse_response(
+                self._acs_client(region).do_action_with_exception(req))
+            return {
+                image.get("ImageId"): AlicloudImageStatus(image.get("Status"))
+                for image in response.get("Images").get("Image")
+            }
+
+        return glci.waiter.StatusFetcher(
+            name=f"alicloud-images/{region}",
+            fetch=fetch,
+            is_done=lambda status: status is AlicloudImageStatus.AVAILABLE,
+            is_failed=lambda status: status is AlicloudImageStatus.CREATEFAILED,
+            max_batch_size=100,
+        )
+
+    # waits (for all regions on one event loop) until all images are available
+    def _wait_for_images(self, region_image_map: dict):
+        try:
+            glci.waiter.wait(
+                operations=(
+                    glci.waiter.PendingOperation(
+                        key=image_id,
+                        fetcher=self._image_status_fetcher(region),
+                        timeout_seconds=TIME_OUT,
+                        backoff=glci.waiter.Backoff(initial_seconds=10, max_seconds=60),
+                    ) for region, image_id in region_image_map.items()
+                ),
+            )
+        except glci.waiter.WaitTimeoutError as e:
+            raise Exception(f"Time out to wait image {e.key} be ready")
 
-        self.acs_client.set_region_id(self.region)
+    def _wait_for_image(self, region, image_id):
+        self._wait_for_images({region: image_id})
 
     #####
     def _list_regions(self) -> []:
         req = DescribeRegionsRequest.DescribeRegionsRequest()
         response = parse_response(
-            self.acs_client.do_action_with_exception(req))
+            self._acs_client(self.region).do_action_with_exception(req))
         region_ids = []
 
         for region in response.get("Regions").get("Region"):
@@ -262,20 +377,46 @@ class AlicloudImageMaker:
             logger.warn(
                 f"found {self.image_name=} already exists in {dest_region=}, {image_id=} skip copying"
             )
-        else:
-            req = CopyImageRequest.CopyImageRequest()
-            req.set_DestinationDescription(self.image_name)
-            req.set_DestinationImageName(self.image_name)
-            req.set_ImageId(src_image_id)
-            req.set_DestinationRegionId(dest_region)
-            logger.info(
-                f"start to copy {src_image_id=} to {dest_region=}")
-            response = parse_response(
-                self.acs_client.do_action_with_exception(req))
-            image_id = response.get("ImageId")
-            logger.info(
-                f"copying {self.image_name=} in {dest_region=} is in process, waiting for success"
+            return image_id
+
+        return self._submit_copy(src_image_id, dest_region)
+
+    # copies the image to all given regions (concurrently). Existence checks are done for all
+    # regions upfront. Returns {region: image_id}
+    def copy_images(self, src_image_id: str, dest_regions, max_workers: int=16) -> dict:
+        region_image_map = self._find_images(dest_regions, self.image_name, max_workers)
+        for region, image_id in region_image_map.items():
+            logger.warn(
+                f"found {self.image_name=} already exists in {region=}, {image_id=} skip copying"
             )
+
+        missing_regions = [r for r in dest_regions if r not in region_image_map]
+        if not missing_regions:
+            return region_image_map
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            image_ids = executor.map(
+                lambda region: self._submit_copy(src_image_id, region),
+                missing_regions,
+            )
+            region_image_map.update(zip(missing_regions, image_ids))
+
+        return {region: region_image_map[region] for region in dest_regions}
+
+    def _submit_copy(self, src_image_id: str, dest_region: str) -> str:
+        req = CopyImageRequest.CopyImageRequest()
+        req.set_DestinationDescription(self.image_name)
+        req.set_DestinationImageName(self.image_name)
+        req.set_ImageId(src_image_id)
+        req.set_DestinationRegionId(dest_region)
+        logger.info(
+            f"start to copy {src_image_id=} to {dest_region=}")
+        response = parse_response(
+            self._acs_client(self.region).do_action_with_exception(req))
+        image_id = response.get("ImageId")
+        logger.info(
+            f"copying {self.image_name=} in {dest_region=} is in process, waiting for success"
+        )
         return image_id
 
 
@@ -3,13 +3,15 @@ import dataclasses
 import enum
 import logging
 import pprint
-import time
 import typing
 
 import botocore.client
 
+import glci.ebs
 import glci.model
+import glci.s3
 import glci.util
+import glci.waiter
 
 
 logger = logging.getLogger(__name__)
@@ -76,6 +78,31 @@ def import_snapshot(
     return import_task_id
 
 
+def snapshot_import_fetcher(
+    ec2_client: 'botocore.client.EC2',
+) -> glci.waiter.StatusFetcher:
+    '''
+    returns a status-fetcher for snapshot-import-tasks (keyed by import-task-id). Statuses are
+    the tasks' `SnapshotTaskDetail`s
+    '''
+    def fetch(snapshot_task_ids: typing.Sequence[str]):
+        tasks = ec2_client.describe_import_snapshot_tasks(
+            ImportTaskIds=list(snapshot_task_ids),
+        )['ImportSnapshotTasks']
+        return {task['ImportTaskId']: task['SnapshotTaskDetail'] for task in tasks}
+
+    def task_status(snapshot_task_detail: dict) -> TaskStatus:
+        return TaskStatus(snapshot_task_detail['Status'])
+
+    return glci.waiter.StatusFetcher(
+        name='ec2-snapshot-import',
+        fetch=fetch,
+        is_done=lambda detail: task_status(detail) is TaskStatus.COMPLETED,
+        is_failed=lambda detail: task_status(detail) is TaskStatus.DELETED,
+        max_batch_size=100,
+    )
+
+
 def wait_for_snapshot_import(
     ec2_client: 'botocore.client.EC2',
     snapshot_task_id: str,
@@ -84,30 +111,16 @@ def wait_for_snapshot_import(
     '''
     @return snapshot_id
     '''
-    def describe_import_snapshot_task():
-        status = ec2_client.describe_import_snapshot_tasks(
-            ImportTaskIds=[snapshot_task_id]
-        )['ImportSnapshotTasks'][0]
-        return status
-
-    def current_status() -> TaskStatus:
-        status = describe_import_snapshot_task()
-        status = TaskStatus(status['SnapshotTaskDetail']['Status'])
-        return status
-
-    def snapshot_id():
-        status = describe_import_snapshot_task()
-        task_id = status['SnapshotTaskDetail']['SnapshotId']
-        return task_id
-
-    while not (status := current_status()) is TaskStatus.COMPLETED:
-        logger.info(f'{snapshot_task_id=}: {status=}')
-
-        if status is TaskStatus.DELETED:
-            raise RuntimeError(f'image uploaded by {snapshot_task_id=} was rejected')
-        time.sleep(polling_interval_seconds)
+    try:
+        result = glci.waiter.wait_for(
+            key=snapshot_task_id,
+            fetcher=snapshot_import_fetcher(ec2_client=ec2_client),
+            backoff=glci.waiter.Backoff(initial_seconds=polling_interval_seconds),
+        )
+    except glci.waiter.WaitFailedError:
+        raise RuntimeError(f'image uploaded by {snapshot_task_id=} was rejected')
 
-    return snapshot_id()
+    return result.status['SnapshotId']
 
 
 def register_image(
@@ -163,52 +176,132 @@ def enumerate_region_names(
         yield region['RegionName']
 
 
+def ec2_clients_by_region(
+    mk_session: callable,
+    region_names: typing.Iterable[str],
+) -> typing.Dict[str, 'botocore.client.EC2']:
+    '''
+    creates one ec2-client per region (concurrently), so they may be reused for all subsequent
+    region-specific operations.
+
+    @param mk_session: callable accepting `region_name`, returning authenticated boto3-session
+    '''
+    region_names = tuple(region_names)
+    if not region_names:
+        return {}
+
+    def ec2_client(region_name: str):
+        return region_name, mk_session(region_name=region_name).client('ec2')
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(region_names)) as executor:
+        return dict(executor.map(ec2_client, region_names))
+
+
+@dataclasses.dataclass(frozen=True)
+class RegionImageStatus:
+    '''
+    the state an image reached in a region (returned by region-level operations as progress report)
+    '''
+    region_name: str
+    image_id: str
+    image_state: ImageState
+    elapsed_seconds: float
+
+
+def image_state_fetcher(
+    ec2_client: 'botocore.client.EC2',
+    target_state=ImageState.AVAILABLE,
+) -> glci.waiter.StatusFetcher:
+    '''
+    returns a status-fetcher for images in the ec2_client's region (keyed by image-id). Polls for
+    multiple images are combined into one `describe_images` request.
+    '''
+    def fetch(image_ids: typing.Sequence[str]):
+        images = ec2_client.describe_images(ImageIds=list(image_ids))['Images']
+        return {image['ImageId']: ImageState(image['State']) for image in images}
+
+    return glci.waiter.StatusFetcher(
+        name=f'ec2-images/{ec2_client.meta.region_name}',
+        fetch=fetch,
+        is_done=lambda image_state: image_state is target_state,
+        is_failed=ImageState.is_erroneous,
+        max_batch_size=100,
+    )
+
+
 def wait_for_image_state(
     ec2_client: 'botocore.client.EC2',
     image_id: str,
     target_state=ImageState.AVAILABLE,
     polling_interval_seconds: int=15,
 ):
-    def current_image_state():
-        image_details = ec2_client.describe_images(ImageIds=[image_id])['Images'][0]
-        image_state = ImageState(image_details['State'])
-        return image_state
-
-    while not (image_state := current_image_state()) is target_state:
-        if image_state.is_erroneous():
-            raise RuntimeError(f'{image_id=}: {image_state=}')
-        time.sleep(polling_interval_seconds)
-
-    return image_state
+    try:
+        return glci.waiter.wait_for(
+            key=image_id,
+            fetcher=image_state_fetcher(ec2_client=ec2_client, target_state=target_state),
+            backoff=glci.waiter.Backoff(initial_seconds=polling_interval_seconds),
+        ).status
+    except glci.waiter.WaitFailedError as e:
+        raise RuntimeError(f'{image_id=}: image_state={e.status}')
 
 
 def wait_for_images(
     mk_session: callable,
     region_img_map: typing.Dict[str, str], # {region_name: ami_id}
     target_state=ImageState.AVAILABLE,
-):
+    ec2_clients: typing.Dict[str, 'botocore.client.EC2']=None,
+) -> typing.Tuple[RegionImageStatus, ...]:
+    '''
+    waits until all images reached the target state. All regions are polled from one event-loop
+    (see `glci.waiter`)
+
+    @param ec2_clients: optional {region_name: ec2_client} (see `ec2_clients_by_region`)
+    '''
+    if not ec2_clients:
+        ec2_clients = ec2_clients_by_region(mk_session=mk_session, region_names=region_img_map)
+    if not region_img_map:
+        return ()
+
     logger.info(f'will wait for {len(region_img_map)} image(s) to reach {target_state=}')
-    for region_name, image_id in region_img_map.items():
-        logger.info(f'waiting for {image_id=}')
-        # as we want to wait for _all_ images, it should be OK not to parallelise polling
-        image_state = wait_for_image_state(
-            ec2_client=mk_session(region_name=region_name).client('ec2'),
-            image_id=image_id,
+
+    fetchers = {
+        region_name: image_state_fetcher(
+            ec2_client=ec2_clients[region_name],
             target_state=target_state,
-        )
-        logger.info(f'{image_id=} reached state {image_state=}')
+        ) for region_name in region_img_map
+    }
+    results = glci.waiter.wait(
+        operations=(
+            glci.waiter.PendingOperation(
+                key=image_id,
+                fetcher=fetchers[region_name],
+            ) for region_name, image_id in region_img_map.items()
+        ),
+    )
+
     logger.info('all images reached target-state')
+    return tuple(
+        RegionImageStatus(
+            region_name=region_name,
+            image_id=result.key,
+            image_state=result.status,
+            elapsed_seconds=result.elapsed_seconds,
+        ) for region_name, result in zip(region_img_map, results)
+    )
 
 
 def set_images_public(
     mk_session: callable,
     region_img_map: typing.Dict[str, str], # {region_name: ami_id}
+    ec2_clients: typing.Dict[str, 'botocore.client.EC2']=None,
 ):
-    for region_name, image_id in region_img_map.items():
-        session = mk_session(region_name=region_name)
-        ec2_client = session.client('ec2')
+    if not ec2_clients:
+        ec2_clients = ec2_clients_by_region(mk_session=mk_session, region_names=region_img_map)
+    if not region_img_map:
+        return
 
-        res = ec2_client.modify_image_attribute(
+    def set_image_public(region_name: str, image_id: str):
+        res = ec2_clients[region_name].modify_image_attribute(
             Attribute='launchPermission',
             ImageId=image_id,
             LaunchPermission={
@@ -221,6 +314,10 @@ def set_images_public(
         )
         response_ok(res)
 
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(region_img_map)) as executor:
+        # consume results to re-raise errors
+        tuple(executor.map(set_image_public, region_img_map.keys(), region_img_map.values()))
+
 
 def copy_image(
     mk_session: callable,
@@ -228,25 +325,37 @@ def copy_image(
     image_name: str,
     src_region_name: str,
     target_regions: typing.Sequence[str],
+    ec2_clients: typing.Dict[str, 'botocore.client.EC2']=None,
 ):
     '''
+    copies the given image to all target regions (concurrently); yields (region_name, ami_id)
+    as copies are submitted
+
     @param mk_session: callable accepting `region_name`, returning authenticated boto3-session
+    @param ec2_clients: optional {region_name: ec2_client} (see `ec2_clients_by_region`)
     '''
-    for target_region in target_regions:
-        if target_region == src_region_name:
-            continue
+    target_regions = tuple(r for r in target_regions if r != src_region_name)
+    if not target_regions:
+        return
 
-        session = mk_session(region_name=target_region)
-        ec2_client = session.client('ec2')
+    if not ec2_clients:
+        ec2_clients = ec2_clients_by_region(mk_session=mk_session, region_names=target_regions)
 
-        res = ec2_client.copy_image(
+    def copy_to_region(target_region: str):
+        res = ec2_clients[target_region].copy_image(
             SourceImageId=ami_image_id,
             SourceRegion=src_region_name,
             Name=image_name,
         )
-        # XXX: return (new) image-AMI
         response_ok(res)
-        yield target_region, res['ImageId']
+        return target_region, res['ImageId']
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(target_regions)) as executor:
+        futures = [executor.submit(copy_to_region, region) for region in target_regions]
+        for future in concurrent.futures.as_completed(futures):
+            target_region, image_id = future.result()
+            logger.info(f'started copying {ami_image_id=} to {target_region=}: {image_id=}')
+            yield target_region, image_id
 
 
 def image_ids_by_name(
@@ -327,6 +436,30 @@ def import_image(
     return import_task_id
 
 
+def upload_snapshot_from_s3(
+    session,
+    s3_bucket_name: str,
+    image_key: str,
+) -> str:
+    '''
+    writes the given raw image directly into a new EBS snapshot (w/o using VM Import service);
+    see `glci.ebs.upload_snapshot`
+
+    @return snapshot_id
+    '''
+    with glci.s3.ParallelRangeReader(
+        s3_client=session.client('s3'),
+        bucket_name=s3_bucket_name,
+        key=image_key,
+    ) as reader:
+        return glci.ebs.upload_snapshot(
+            ebs_client=session.client('ebs'),
+            ec2_client=session.client('ec2'),
+            fileobj=reader,
+            size=reader.size,
+        )
+
+
 def target_image_name_for_release(release: glci.model.OnlineReleaseManifest):
     target_image_name = f'gardenlinux-{release.canonical_release_manifest_key_suffix()}'
     return target_image_name
@@ -336,7 +469,14 @@ def upload_and_register_gardenlinux_image(
     mk_session: callable,
     build_cfg: glci.model.BuildCfg,
     release: glci.model.OnlineReleaseManifest,
+    snapshot_upload_method: glci.model.AwsSnapshotUploadMethod=None,
 ) -> glci.model.OnlineReleaseManifest:
+    '''
+    @param snapshot_upload_method: overwrites `build_cfg.aws_snapshot_upload_method`
+    '''
+    if not snapshot_upload_method:
+        snapshot_upload_method = build_cfg.aws_snapshot_upload_method
+
     session = mk_session(region_name=build_cfg.aws_region)
     ec2_client = session.client('ec2')
 
@@ -349,18 +489,26 @@ def upload_and_register_gardenlinux_image(
     raw_image_key = aws_release_artifact_path.s3_key
     bucket_name = aws_release_artifact_path.s3_bucket_name
 
-    snapshot_task_id = import_snapshot(
-        ec2_client=ec2_client,
-        s3_bucket_name=bucket_name,
-        image_key=raw_image_key,
-    )
-    logger.info(f'started import {snapshot_task_id=}')
+    if snapshot_upload_method is glci.model.AwsSnapshotUploadMethod.EBS_DIRECT:
+        snapshot_id = upload_snapshot_from_s3(
+            session=session,
+            s3_bucket_name=bucket_name,
+            image_key=raw_image_key,
+        )
+        logger.info(f'direct upload finished {snapshot_id=}')
+    else:
+        snapshot_task_id = import_snapshot(
+            ec2_client=ec2_client,
+            s3_bucket_name=bucket_name,
+            image_key=raw_image_key,
+        )
+        logger.info(f'started import {snapshot_task_id=}')
 
-    snapshot_id = wait_for_snapshot_import(
-        ec2_client=ec2_client,
-        snapshot_task_id=snapshot_task_id,
-    )
-    logger.info(f'import task finished {snapshot_id=}')
+        snapshot_id = wait_for_snapshot_import(
+            ec2_client=ec2_client,
+            snapshot_task_id=snapshot_task_id,
+        )
+        logger.info(f'import task finished {snapshot_id=}')
 
     initial_ami_id = register_image(
         ec2_client=ec2_client,
@@ -370,6 +518,11 @@ def upload_and_register_gardenlinux_image(
     logger.info(f'registered {initial_ami_id=}')
 
     region_names = tuple(enumerate_region_names(ec2_client=ec2_client))
+    ec2_clients = ec2_clients_by_region(
+        mk_session=mk_session,
+        region_names=(r for r in region_names if r != build_cfg.aws_region),
+    )
+    ec2_clients[build_cfg.aws_region] = ec2_client
 
     try:
         image_map = dict(
@@ -379,6 +532,7 @@ def upload_and_register_gardenlinux_image(
                 image_name=target_image_name,
                 src_region_name=build_cfg.aws_region,
                 target_regions=region_names,
+                ec2_clients=ec2_clients,
             )
         )
     except:
@@ -407,15 +561,21 @@ def upload_and_register_gardenlinux_image(
     image_map_pretty = pprint.pformat(image_map)
     logger.info(f'copied images: {image_map_pretty}')
 
-    wait_for_images(
+    region_statuses = wait_for_images(
         mk_session=mk_session,
         region_img_map=image_map,
+        ec2_clients=ec2_clients,
+    )
+    slowest = max(region_statuses, key=lambda status: status.elapsed_seconds)
+    logger.info(
+        f'all {len(image_map)} images became "ready" (slowest: {slowest.region_name=} '
+        f'after {slowest.elapsed_seconds:.0f}s)'
     )
-    logger.info(f'all {len(image_map)} images became "ready"')
 
     set_images_public(
         mk_session=mk_session,
         region_img_map=image_map,
+        ec2_clients=ec2_clients,
     )
     logger.info(f'all {len(image_map)} images were set to "public"')
 
@@ -1,3 +1,4 @@
+import concurrent.futures
 import dataclasses
 from datetime import (
     datetime,
@@ -5,8 +6,11 @@ from datetime import (
 )
 from enum import Enum
 import logging
+import threading
+import time
 import typing
 
+import botocore.exceptions
 import requests
 from glci import util
 import version
@@ -40,6 +44,7 @@ from azure.mgmt.compute.models import (
 )
 
 from azure.core.exceptions import (
+    AzureError,
     ResourceExistsError,
     ResourceNotFoundError,
 )
@@ -69,6 +74,38 @@ It need to be called multiple times until the entire process has been completed.
 '''
 
 
+# page blob ranges that are uploaded in one go are at most 4 MiB
+_zero_page = bytes(4 * 1024 * 1024)
+
+
+@dataclasses.dataclass
+class PageCopyStats:
+    '''progress and throughput of a page blob copy'''
+    total_bytes: int
+    copied_bytes: int = 0
+    skipped_bytes: int = 0
+    started: float = dataclasses.field(default_factory=time.monotonic)
+    last_logged: float = 0
+
+    def done_bytes(self) -> int:
+        return self.copied_bytes + self.skipped_bytes
+
+    def throughput(self) -> float:
+        '''processed bytes per second (including skipped ranges)'''
+        return self.done_bytes() / max(time.monotonic() - self.started, 1e-6)
+
+    def log_progress(self, force: bool=False, interval_seconds: int=10):
+        if not force and time.monotonic() - self.last_logged < interval_seconds:
+            return
+        self.last_logged = time.monotonic()
+        percentage = 100 * self.done_bytes() / self.total_bytes if self.total_bytes else 100
+        logger.info(
+            f'processed {self.done_bytes()}/{self.total_bytes} bytes ({percentage:.1f}%), '
+            f'{self.skipped_bytes} bytes skipped (empty), '
+            f'{self.throughput() / (1024 * 1024):.1f} MiB/s'
+        )
+
+
 class AzureImageStore:
     '''Azure Image Store backed by an container in an Azure Storage Account.'''
 
@@ -87,11 +124,19 @@ class AzureImageStore:
         s3_client,
         s3_bucket_name: str,
         s3_object_key: str,
-        target_blob_name: str
-    ):
+        target_blob_name: str,
+        max_workers: int=16,
+        max_attempts: int=3,
+        skip_empty_ranges: bool=True,
+    ) -> 'PageCopyStats':
         '''Copy an object from Amazon S3 to an Azure Storage Account
 
         This will overwrite the contents of the target file if it already exists.
+
+        Page ranges are copied using `max_workers` concurrent requests; failed ranges are retried.
+        If `skip_empty_ranges` is set, each range is read from S3, and only uploaded if it contains
+        non-zero data (VHDs typically consist mostly of empty ranges). Otherwise, ranges are
+        copied server-side.
         '''
         connection_string = (
             f"DefaultEndpointsProtocol=https;"
@@ -118,18 +163,69 @@ class AzureImageStore:
         # max size we can copy in one go is 4 mebibytes. Split the upload in steps with max size of
         # 4 MiB
         copy_step_length = 4 * 1024 * 1024
-        offset = 0
-        while offset < file_size:
-            remaining = file_size - offset
-            actual_cp_bytes = min(copy_step_length, remaining)
-
-            image_blob.upload_pages_from_url(
-                source_url=url,
-                offset=offset,
-                length=actual_cp_bytes,
-                source_offset=offset,
-            )
-            offset += actual_cp_bytes
+        ranges = [
+            (offset, min(copy_step_length, file_size - offset))
+            for offset in range(0, file_size, copy_step_length)
+        ]
+
+        stats = PageCopyStats(total_bytes=file_size)
+        stats_lock = threading.Lock()
+
+        def read_source_range(offset: int, length: int) -> bytes:
+            return s3_client.get_object(
+                Bucket=s3_bucket_name,
+                Key=s3_object_key,
+                Range=f'bytes={offset}-{offset + length - 1}',
+            )['Body'].read()
+
+        def copy_range(offset: int, length: int):
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    if skip_empty_ranges:
+                        # the range is read anyway, so upload the read data (instead of having
+                        # it transferred again by a server-side copy)
+                        data = read_source_range(offset, length)
+                        # pages of newly created page blobs are zeroed - no need to upload
+                        # empty ranges
+                        if data == _zero_page[:length]:
+                            copied = False
+                        else:
+                            image_blob.upload_page(data, offset=offset, length=length)
+                            copied = True
+                    else:
+                        image_blob.upload_pages_from_url(
+                            source_url=url,
+                            offset=offset,
+                            length=length,
+                            source_offset=offset,
+                        )
+                        copied = True
+                    break
+                except (
+                    AzureError,
+                    botocore.exceptions.BotoCoreError,
+                    botocore.exceptions.ClientError,
+                ) as e:
+                    if attempt == max_attempts:
+                        raise
+                    logger.warning(f'failed to copy {offset=} {length=} ({e}) - will retry')
+
+            with stats_lock:
+                if copied:
+                    stats.copied_bytes += length
+                else:
+                    stats.skipped_bytes += length
+                stats.log_progress()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(copy_range, offset, length) for offset, length in ranges
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()  # re-raise errors
+
+        stats.log_progress(force=True)
+        return stats
 
     def get_image_url(self, image_name: str, with_sas_token: bool):
         '''Generate an url optionally including sas token to access image in the store.'''
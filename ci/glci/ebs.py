@@ -0,0 +1,185 @@
+'''
+direct upload of raw disk images into EBS snapshots (using the EBS direct APIs)
+
+This is an alternative to importing snapshots using the VM Import service (see
+`glci.aws.import_snapshot`), which typically takes several minutes, even for small images.
+'''
+import base64
+import concurrent.futures
+import hashlib
+import logging
+import threading
+import time
+import typing
+import uuid
+
+import botocore.client
+import botocore.exceptions
+
+import glci.waiter
+
+logger = logging.getLogger(__name__)
+
+_gib = 1024 ** 3
+
+
+def _read_block(fileobj: typing.BinaryIO, block_size: int) -> bytes:
+    block = bytearray()
+    while len(block) < block_size:
+        if not (chunk := fileobj.read(block_size - len(block))):
+            break
+        block += chunk
+    return bytes(block)
+
+
+def _blocks(
+    fileobj: typing.BinaryIO,
+    block_size: int,
+) -> typing.Generator[typing.Tuple[int, bytes], None, None]:
+    '''
+    yields (block_index, block) for the given file object. The last block is zero-padded
+    '''
+    block_index = 0
+    while (block := _read_block(fileobj, block_size)):
+        if len(block) < block_size:
+            block += bytes(block_size - len(block))
+        yield block_index, block
+        block_index += 1
+
+
+def snapshot_completion_fetcher(
+    ec2_client: 'botocore.client.EC2',
+) -> glci.waiter.StatusFetcher:
+    '''
+    returns a status-fetcher for snapshots (keyed by snapshot-id)
+    '''
+    def fetch(snapshot_ids: typing.Sequence[str]):
+        snapshots = ec2_client.describe_snapshots(SnapshotIds=list(snapshot_ids))['Snapshots']
+        return {snapshot['SnapshotId']: snapshot['State'] for snapshot in snapshots}
+
+    return glci.waiter.StatusFetcher(
+        name=f'ebs-snapshots/{ec2_client.meta.region_name}',
+        fetch=fetch,
+        is_done=lambda state: state == 'completed',
+        is_failed=lambda state: state in ('error', 'recoverable'),
+        max_batch_size=100,
+    )
+
+
+def upload_snapshot(
+    ebs_client: 'botocore.client.EBS',
+    ec2_client: 'botocore.client.EC2',
+    fileobj: typing.BinaryIO,
+    size: int,
+    description: str='uploaded by gardenlinux-cicd',
+    tags: typing.Sequence[dict]=(),
+    max_workers: int=32,
+    max_attempts: int=3,
+    wait_for_completion: bool=True,
+) -> str:
+    '''
+    writes the raw disk image read from `fileobj` (of `size` octets) into a new EBS snapshot.
+
+    Blocks are uploaded concurrently (each with its sha256 checksum, which is verified by EBS).
+    All-zero blocks are skipped (new snapshots read as zeroes). Upon completion, the aggregated
+    (linear) checksum of all uploaded blocks is passed, so EBS verifies the snapshot as a whole.
+
+    @return snapshot_id
+    '''
+    volume_size_gib = max(1, -(-size // _gib))
+    snapshot = ebs_client.start_snapshot(
+        VolumeSize=volume_size_gib,
+        Description=description,
+        Tags=list(tags),
+        ClientToken=str(uuid.uuid4()),
+    )
+    snapshot_id = snapshot['SnapshotId']
+    block_size = snapshot['BlockSize'] # currently always 512 KiB
+    zero_block = bytes(block_size)
+
+    logger.info(f'started direct upload to {snapshot_id=} ({size=}, {volume_size_gib=})')
+    started = time.monotonic()
+
+    checksums = {} # {block_index: sha256-digest}
+    in_flight = threading.BoundedSemaphore(max_workers * 2)
+
+    def put_block(block_index: int, block: bytes):
+        try:
+            checksum = hashlib.sha256(block).digest()
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    ebs_client.put_snapshot_block(
+                        SnapshotId=snapshot_id,
+                        BlockIndex=block_index,
+                        BlockData=block,
+                        DataLength=block_size,
+                        Checksum=base64.b64encode(checksum).decode('ascii'),
+                        ChecksumAlgorithm='SHA256',
+                    )
+                    break
+                except botocore.exceptions.BotoCoreError as e:
+                    if attempt == max_attempts:
+                        raise
+                    logger.warning(f'{snapshot_id=}: {block_index=} failed ({attempt=}): {e}')
+            checksums[block_index] = checksum
+        finally:
+            in_flight.release()
+
+    skipped_blocks = 0
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = []
+            try:
+                for block_index, block in _blocks(fileobj=fileobj, block_size=block_size):
+                    if block == zero_block:
+                        skipped_blocks += 1
+                        continue
+
+                    # bound memory consumption (reading is typically faster than uploading)
+                    in_flight.acquire()
+                    futures.append(executor.submit(put_block, block_index, block))
+
+                    if futures[0].done():
+                        futures.pop(0).result() # fail early
+
+                for future in futures:
+                    future.result()
+            except:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        aggregated_checksum = hashlib.sha256(
+            b''.join(checksums[block_index] for block_index in sorted(checksums))
+        ).digest()
+
+        ebs_client.complete_snapshot(
+            SnapshotId=snapshot_id,
+            ChangedBlocksCount=len(checksums),
+            Checksum=base64.b64encode(aggregated_checksum).decode('ascii'),
+            ChecksumAlgorithm='SHA256',
+            ChecksumAggregationMethod='LINEAR',
+        )
+    except:
+        # do not leave the (incomplete) snapshot behind in pending state
+        logger.warning(f'upload to {snapshot_id=} failed - deleting snapshot')
+        try:
+            ec2_client.delete_snapshot(SnapshotId=snapshot_id)
+        except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+            logger.warning(f'failed to delete {snapshot_id=}: {e}')
+        raise
+
+    elapsed_seconds = time.monotonic() - started
+    logger.info(
+        f'uploaded {len(checksums)} blocks to {snapshot_id=} ({skipped_blocks=}) in '
+        f'{elapsed_seconds:.0f}s'
+    )
+
+    if wait_for_completion:
+        glci.waiter.wait_for(
+            key=snapshot_id,
+            fetcher=snapshot_completion_fetcher(ec2_client=ec2_client),
+            backoff=glci.waiter.Backoff(initial_seconds=2, max_seconds=15),
+        )
+
+    return snapshot_id
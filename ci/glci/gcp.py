@@ -1,11 +1,11 @@
 import dataclasses
-import tempfile
 import time
 import logging
 
 import google.cloud.storage.blob
 import google.cloud.storage.client
 import glci.model
+import glci.s3
 import glci.util
 
 
@@ -17,8 +17,15 @@ def upload_image_to_gcp_store(
     s3_client,
     release: glci.model.OnlineReleaseManifest,
     build_cfg: glci.model.BuildCfg,
+    max_buffer_bytes: int=128 * 1024 * 1024,
+    upload_chunk_bytes: int=32 * 1024 * 1024,
 ) -> google.cloud.storage.blob.Blob:
+    '''
+    streams the gcp image from S3 to a (resumable) GCP storage upload, w/o using local disk.
 
+    S3 is read using parallel ranged GETs; peak memory usage is roughly `max_buffer_bytes` plus
+    two times `upload_chunk_bytes` (which must be a multiple of 256 KiB).
+    '''
     gcp_release_artifact = glci.util.virtual_image_artifact_for_platform('gcp')
     gcp_release_artifact_path = release.path_by_suffix(gcp_release_artifact)
     raw_image_key = gcp_release_artifact_path.s3_key
@@ -26,23 +33,23 @@ def upload_image_to_gcp_store(
 
     image_blob_name = f'gardenlinux-{release.version}.tar.gz'
 
-    # XXX: rather do streaming
-    with tempfile.TemporaryFile() as tfh:
-        logger().info(f'downloading image from {build_cfg.s3_bucket_name=}')
-        s3_client.download_fileobj(
-            Bucket=s3_bucket_name,
-            Key=raw_image_key,
-            Fileobj=tfh,
+    with glci.s3.ParallelRangeReader(
+        s3_client=s3_client,
+        bucket_name=s3_bucket_name,
+        key=raw_image_key,
+        max_buffer_bytes=max_buffer_bytes,
+        # resumable uploads may need to re-send the last chunk
+        rewind_bytes=upload_chunk_bytes,
+    ) as image_stream:
+        logger().info(
+            f'streaming image from {s3_bucket_name=} to gcp {build_cfg.gcp_bucket_name=} '
+            f'{image_blob_name=} ({image_stream.size} bytes)'
         )
-        logger().info(f'downloaded image from {build_cfg.s3_bucket_name=}')
-
-        tfh.seek(0)
-
-        logger().info(f're-uploading image to gcp {build_cfg.gcp_bucket_name=} {image_blob_name=}')
         gcp_bucket = storage_client.get_bucket(build_cfg.gcp_bucket_name)
-        image_blob = gcp_bucket.blob(image_blob_name)
+        image_blob = gcp_bucket.blob(image_blob_name, chunk_size=upload_chunk_bytes)
         image_blob.upload_from_file(
-            tfh,
+            image_stream,
+            size=image_stream.size,
             content_type='application/x-xz',
         )
         logger().info(f'uploaded image {raw_image_key=} to {image_blob_name=}')
@@ -0,0 +1,138 @@
+import dataclasses
+import functools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import typing
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# set to an empty value to disable caching altogether
+cache_path_env_var = 'GLCI_MANIFEST_CACHE'
+default_cache_path = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+    'gardenlinux',
+    'release-manifests.sqlite3',
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class CachedManifest:
+    etag: str
+    document: dict
+
+
+class ManifestCache:
+    '''
+    a local, persistent cache of (raw) release manifest documents retrieved from S3.
+
+    Manifests are effectively immutable once written. Entries are keyed by bucket name and
+    S3 key, and are only considered valid as long as the remote object's ETag matches the cached
+    one. Documents are stored as zlib-compressed JSON (which is a lot cheaper to load than YAML).
+
+    Instances may be shared between threads.
+    '''
+    def __init__(self, path: str=default_cache_path):
+        if (dirname := os.path.dirname(path)):
+            os.makedirs(dirname, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        # this is a cache - trade durability for speed
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=OFF')
+        self._conn.execute(
+            '''CREATE TABLE IF NOT EXISTS manifests (
+                bucket TEXT NOT NULL,
+                key TEXT NOT NULL,
+                etag TEXT NOT NULL,
+                document BLOB NOT NULL,
+                PRIMARY KEY (bucket, key)
+            )'''
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _decode(document: bytes) -> dict:
+        return json.loads(zlib.decompress(document))
+
+    def get(
+        self,
+        bucket_name: str,
+        key: str,
+        etag: str=None,
+    ) -> typing.Optional[CachedManifest]:
+        '''
+        returns the cached manifest for the given key, or `None` if there is no entry.
+        If `etag` is passed, entries with a different ETag are ignored.
+        '''
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT etag, document FROM manifests WHERE bucket=? AND key=?',
+                (bucket_name, key),
+            ).fetchone()
+
+        if not row:
+            return None
+
+        cached_etag, document = row
+        if etag and etag != cached_etag:
+            return None
+
+        return CachedManifest(etag=cached_etag, document=self._decode(document))
+
+    def put(
+        self,
+        bucket_name: str,
+        key: str,
+        etag: str,
+        document: dict,
+    ):
+        try:
+            serialised = zlib.compress(json.dumps(document, separators=(',', ':')).encode('utf-8'))
+        except (TypeError, ValueError) as e:
+            # e.g. timestamps that were parsed as datetime by yaml - do not cache those
+            logger.debug(f'will not cache {key=}: {e}')
+            return
+
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO manifests (bucket, key, etag, document) VALUES (?,?,?,?)',
+                (bucket_name, key, etag, serialised),
+            )
+            self._conn.commit()
+
+    def remove(
+        self,
+        bucket_name: str,
+        key: str,
+    ):
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM manifests WHERE bucket=? AND key=?',
+                (bucket_name, key),
+            )
+            self._conn.commit()
+
+
+@functools.lru_cache
+def default_cache() -> typing.Optional[ManifestCache]:
+    '''
+    returns the process-wide manifest cache (or `None` if caching is disabled or unavailable).
+
+    The cache location may be overwritten using the `GLCI_MANIFEST_CACHE` env var. Setting it to an
+    empty value disables caching.
+    '''
+    path = os.environ.get(cache_path_env_var, default_cache_path)
+    if not path:
+        return None
+
+    try:
+        return ManifestCache(path=path)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f'manifest cache at {path=} is unavailable - will not cache: {e}')
+        return None
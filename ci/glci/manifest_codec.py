@@ -0,0 +1,304 @@
+'''
+(de-)serialisation of release manifests and release manifest sets
+
+Manifests are read and written very frequently (e.g. when enumerating all releases from the
+build-result bucket). Thus, instead of generic (reflection-based) dacite/dataclasses.asdict
+conversion, this module uses hand-written conversion functions, and libyaml-based YAML loader and
+dumper (if available).
+
+Manifests may be written either as YAML (default) or as JSON. Readers detect the format from the
+document's contents.
+'''
+import enum
+import json
+import typing
+
+import yaml
+
+import glci.model
+
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_YamlDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+class ManifestFormat(enum.Enum):
+    YAML = 'yaml'
+    JSON = 'json'
+
+    def content_type(self) -> str:
+        if self is ManifestFormat.YAML:
+            return 'text/yaml'
+        return 'application/json'
+
+
+def parse_document(raw: typing.Union[bytes, str]) -> typing.Any:
+    '''
+    parses the given (YAML or JSON) document
+    '''
+    if isinstance(raw, bytes):
+        stripped = raw.lstrip()[:1]
+        is_json = stripped == b'{'
+    else:
+        stripped = raw.lstrip()[:1]
+        is_json = stripped == '{'
+
+    if is_json:
+        try:
+            return json.loads(raw)
+        except ValueError:
+            pass # might still be a YAML flow-mapping
+
+    return yaml.load(raw, Loader=_YamlLoader)
+
+
+def dump_document(
+    document: typing.Any,
+    manifest_format: ManifestFormat=ManifestFormat.YAML,
+) -> bytes:
+    if manifest_format is ManifestFormat.JSON:
+        return json.dumps(document, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+    return yaml.dump(document, Dumper=_YamlDumper).encode('utf-8')
+
+
+def _s3_release_file(raw: dict) -> glci.model.S3_ReleaseFile:
+    return glci.model.S3_ReleaseFile(
+        name=raw['name'],
+        suffix=raw['suffix'],
+        s3_key=raw['s3_key'],
+        s3_bucket_name=raw['s3_bucket_name'],
+    )
+
+
+def _s3_release_file_dict(release_file: glci.model.S3_ReleaseFile) -> dict:
+    return {
+        'name': release_file.name,
+        'suffix': release_file.suffix,
+        's3_key': release_file.s3_key,
+        's3_bucket_name': release_file.s3_bucket_name,
+    }
+
+
+def _published_image_metadata(raw: typing.Optional[dict]):
+    if raw is None:
+        return None
+
+    if 'published_alicloud_images' in raw:
+        return glci.model.AlicloudPublishedImageSet(
+            published_alicloud_images=tuple(
+                glci.model.AlicloudPublishedImage(
+                    image_id=image['image_id'],
+                    region_id=image['region_id'],
+                    image_name=image['image_name'],
+                ) for image in raw['published_alicloud_images']
+            ),
+        )
+    if 'published_aws_images' in raw:
+        return glci.model.AwsPublishedImageSet(
+            published_aws_images=tuple(
+                glci.model.AwsPublishedImage(
+                    ami_id=image['ami_id'],
+                    aws_region_id=image['aws_region_id'],
+                    image_name=image['image_name'],
+                ) for image in raw['published_aws_images']
+            ),
+        )
+    if 'transport_state' in raw:
+        return glci.model.AzurePublishedImage(
+            transport_state=glci.model.AzureTransportState(raw['transport_state']),
+            urn=raw['urn'],
+            publish_operation_id=raw['publish_operation_id'],
+            golive_operation_id=raw['golive_operation_id'],
+        )
+    if 'gcp_image_name' in raw:
+        return glci.model.GcpPublishedImage(
+            gcp_image_name=raw['gcp_image_name'],
+            gcp_project_name=raw['gcp_project_name'],
+        )
+    if 'image_reference' in raw:
+        return glci.model.OciPublishedImage(
+            image_reference=raw['image_reference'],
+        )
+    if 'published_openstack_images' in raw:
+        return glci.model.OpenstackPublishedImageSet(
+            published_openstack_images=tuple(
+                glci.model.OpenstackPublishedImage(
+                    region_name=image['region_name'],
+                    image_id=image['image_id'],
+                    image_name=image['image_name'],
+                ) for image in raw['published_openstack_images']
+            ),
+        )
+
+    raise ValueError(f'unknown published image metadata: {raw=}')
+
+
+def _published_image_metadata_dict(published_image_metadata) -> typing.Optional[dict]:
+    if published_image_metadata is None:
+        return None
+
+    M = glci.model
+    if isinstance(published_image_metadata, M.AlicloudPublishedImageSet):
+        return {
+            'published_alicloud_images': [
+                {
+                    'image_id': image.image_id,
+                    'region_id': image.region_id,
+                    'image_name': image.image_name,
+                } for image in published_image_metadata.published_alicloud_images
+            ],
+        }
+    if isinstance(published_image_metadata, M.AwsPublishedImageSet):
+        return {
+            'published_aws_images': [
+                {
+                    'ami_id': image.ami_id,
+                    'aws_region_id': image.aws_region_id,
+                    'image_name': image.image_name,
+                } for image in published_image_metadata.published_aws_images
+            ],
+        }
+    if isinstance(published_image_metadata, M.AzurePublishedImage):
+        return {
+            'transport_state': published_image_metadata.transport_state.value,
+            'urn': published_image_metadata.urn,
+            'publish_operation_id': published_image_metadata.publish_operation_id,
+            'golive_operation_id': published_image_metadata.golive_operation_id,
+        }
+    if isinstance(published_image_metadata, M.GcpPublishedImage):
+        return {
+            'gcp_image_name': published_image_metadata.gcp_image_name,
+            'gcp_project_name': published_image_metadata.gcp_project_name,
+        }
+    if isinstance(published_image_metadata, M.OciPublishedImage):
+        return {
+            'image_reference': published_image_metadata.image_reference,
+        }
+    if isinstance(published_image_metadata, M.OpenstackPublishedImageSet):
+        return {
+            'published_openstack_images': [
+                {
+                    'region_name': image.region_name,
+                    'image_id': image.image_id,
+                    'image_name': image.image_name,
+                } for image in published_image_metadata.published_openstack_images
+            ],
+        }
+
+    raise TypeError(f'unknown published image metadata: {published_image_metadata=}')
+
+
+def _test_result(raw: typing.Optional[dict]) -> typing.Optional[glci.model.ReleaseTestResult]:
+    if raw is None:
+        return None
+
+    return glci.model.ReleaseTestResult(
+        test_suite_cfg_name=raw['test_suite_cfg_name'],
+        test_result=glci.model.TestResultCode(raw['test_result']),
+        test_timestamp=raw['test_timestamp'],
+    )
+
+
+def _logs(raw: typing.Union[dict, str, None]):
+    if raw is None or isinstance(raw, str):
+        return raw
+    return _s3_release_file(raw)
+
+
+def release_manifest_from_dict(
+    raw: dict,
+    s3_key: str=None,
+    s3_bucket: str=None,
+) -> glci.model.OnlineReleaseManifest:
+    '''
+    converts a parsed release manifest document into an `OnlineReleaseManifest`. If passed,
+    `s3_key` and `s3_bucket` overwrite the respective attributes from the document.
+    '''
+    return glci.model.OnlineReleaseManifest(
+        build_committish=raw['build_committish'],
+        version=raw['version'],
+        gardenlinux_epoch=int(raw['gardenlinux_epoch']),
+        architecture=glci.model.Architecture(raw['architecture']),
+        platform=raw['platform'],
+        modifiers=tuple(raw['modifiers']),
+        build_timestamp=raw['build_timestamp'],
+        paths=tuple(_s3_release_file(path) for path in raw['paths']),
+        base_image=raw.get('base_image'),
+        published_image_metadata=_published_image_metadata(raw.get('published_image_metadata')),
+        s3_key=s3_key if s3_key is not None else raw['s3_key'],
+        s3_bucket=s3_bucket if s3_bucket is not None else raw['s3_bucket'],
+        test_result=_test_result(raw.get('test_result')),
+        logs=_logs(raw.get('logs')),
+    )
+
+
+def release_manifest_dict(manifest: glci.model.ReleaseManifest) -> dict:
+    '''
+    converts the given (online) release manifest into a serialisable dict (w/ the same structure
+    `dataclasses.asdict` would yield, but w/ enums replaced by their values)
+    '''
+    raw = {
+        'build_committish': manifest.build_committish,
+        'version': manifest.version,
+        'gardenlinux_epoch': manifest.gardenlinux_epoch,
+        'architecture': glci.model.Architecture(manifest.architecture).value,
+        'platform': manifest.platform,
+        'modifiers': list(manifest.modifiers),
+        'build_timestamp': manifest.build_timestamp,
+        'paths': [_s3_release_file_dict(path) for path in manifest.paths],
+        'base_image': manifest.base_image,
+        'published_image_metadata': _published_image_metadata_dict(
+            manifest.published_image_metadata
+        ),
+    }
+
+    if isinstance(manifest, glci.model.OnlineReleaseManifest):
+        test_result = manifest.test_result
+        logs = manifest.logs
+        raw.update({
+            's3_key': manifest.s3_key,
+            's3_bucket': manifest.s3_bucket,
+            'test_result': {
+                'test_suite_cfg_name': test_result.test_suite_cfg_name,
+                'test_result': glci.model.TestResultCode(test_result.test_result).value,
+                'test_timestamp': test_result.test_timestamp,
+            } if test_result else None,
+            'logs': _s3_release_file_dict(logs)
+                if isinstance(logs, glci.model.S3_ReleaseFile) else logs,
+        })
+
+    return raw
+
+
+def release_manifest_set_from_dict(
+    raw: dict,
+    s3_key: str=None,
+    s3_bucket: str=None,
+) -> glci.model.OnlineReleaseManifestSet:
+    logs = raw.get('logs')
+    return glci.model.OnlineReleaseManifestSet(
+        manifests=tuple(
+            release_manifest_from_dict(manifest) for manifest in raw['manifests']
+        ),
+        flavour_set_name=raw['flavour_set_name'],
+        s3_key=s3_key if s3_key is not None else raw['s3_key'],
+        s3_bucket=s3_bucket if s3_bucket is not None else raw['s3_bucket'],
+        logs=tuple(_s3_release_file(log) for log in logs) if logs is not None else None,
+    )
+
+
+def release_manifest_set_dict(manifest_set: glci.model.ReleaseManifestSet) -> dict:
+    raw = {
+        'manifests': [release_manifest_dict(manifest) for manifest in manifest_set.manifests],
+        'flavour_set_name': manifest_set.flavour_set_name,
+    }
+
+    if isinstance(manifest_set, glci.model.OnlineReleaseManifestSet):
+        logs = manifest_set.logs
+        raw.update({
+            's3_key': manifest_set.s3_key,
+            's3_bucket': manifest_set.s3_bucket,
+            'logs': [_s3_release_file_dict(log) for log in logs] if logs is not None else None,
+        })
+
+    return raw
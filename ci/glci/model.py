@@ -124,13 +124,11 @@ class FeatureDescriptor:
         '''
         returns the tuple of features (transtively) included by this feature
         '''
-        included_features = (feature_by_name(name)
-                             for name in self.included_feature_names())
+        if not transitive:
+            yield from (feature_by_name(name) for name in self.included_feature_names())
+            return
 
-        for included_feature in included_features:
-            if transitive:
-                yield from included_feature.included_features()
-            yield included_feature
+        yield from feature_graph().included_features(self.name)
 
 
 class Architecture(enum.Enum):
@@ -169,13 +167,13 @@ class GardenlinuxFlavour:
 
     def __post_init__(self):
         # validate platform and modifiers
-        platform_names = {platform.name for platform in platforms()}
+        platform_names = feature_graph().feature_names(FeatureType.PLATFORM)
         if not self.platform in platform_names:
             raise ValueError(
                 f'unknown platform: {self.platform}. known: {platform_names}'
             )
 
-        modifier_names = {modifier.name for modifier in modifiers()}
+        modifier_names = feature_graph().feature_names(FeatureType.MODIFIER)
         unknown_mods = set(self.modifiers) - modifier_names
         if unknown_mods:
             raise ValueError(
@@ -439,19 +437,7 @@ def normalised_modifiers(platform: Platform, modifiers) -> typing.Tuple[str, ...
     and returns the (ASCII-upper-case-sorted) result as a `tuple` of str of all modifiers,
     except for the platform
     '''
-    platform = feature_by_name(platform)
-    modifiers = {feature_by_name(f) for f in modifiers}
-
-    all_modifiers = set((m.name for m in modifiers))
-    for m in modifiers:
-        all_modifiers |= set((m.name for m in m.included_features()))
-
-    for f in platform.included_features():
-        all_modifiers.add(f.name)
-
-    normalised_features = tuple(sorted(all_modifiers, key=str.upper))
-
-    return normalised_features
+    return feature_graph().normalised_modifiers(platform=platform, modifiers=modifiers)
 
 
 def normalised_release_identifier(release_identifier: ReleaseIdentifier):
@@ -472,20 +458,7 @@ def canonicalised_features(platform: Platform, modifiers) -> typing.Tuple[Featur
     The minimal featureset is determined by removing all transitive dependencies (which are thus
     implied by the retained features).
     '''
-    platform = feature_by_name(platform)
-    minimal_modifiers = set((feature_by_name(m) for m in modifiers))
-
-    # rm all transitive dependencies from platform
-    minimal_modifiers -= set((platform.included_features(), *modifiers))
-
-    # rm all transitive dependencies from modifiers
-    for modifier in (feature_by_name(m) for m in modifiers):
-        minimal_modifiers -= set(modifier.included_features())
-
-    # canonical name: <platform>-<ordered-features> (UPPER-cased-sort, so _ is after alpha)
-    minimal_modifiers = sorted(minimal_modifiers, key=lambda m: m.name.upper())
-
-    return tuple((platform, *minimal_modifiers))
+    return feature_graph().canonicalised_features(platform=platform, modifiers=modifiers)
 
 
 @dataclasses.dataclass(frozen=True)
@@ -562,6 +535,11 @@ class BuildType(enum.Enum):
     RELEASE = 'release'
 
 
+class AwsSnapshotUploadMethod(enum.Enum):
+    IMPORT = 'import' # EC2 VM Import service (import_snapshot)
+    EBS_DIRECT = 'ebs-direct' # EBS direct APIs (see glci.ebs)
+
+
 @dataclasses.dataclass(frozen=True)
 class BuildCfg:
     aws_cfg_name: str
@@ -575,6 +553,7 @@ class BuildCfg:
     oss_bucket_name: str
     alicloud_region: str
     alicloud_cfg_name: str
+    aws_snapshot_upload_method: AwsSnapshotUploadMethod = AwsSnapshotUploadMethod.IMPORT
 
 
 @dataclasses.dataclass(frozen=True)
@@ -837,12 +816,107 @@ def _deserialise_feature(feature_file):
     )
 
 
+class FeatureGraph:
+    '''
+    an index of gardenlinux features (see `features/*/info.yaml`), keyed by feature name.
+
+    Transitive closures of feature includes, as well as the results of `normalised_modifiers`
+    and `canonicalised_features`, are memoised per (platform, modifiers), as those are
+    calculated for each and every release manifest that is processed.
+    '''
+    def __init__(self, features: typing.Iterable[FeatureDescriptor]):
+        self._features_by_name = {feature.name: feature for feature in features}
+        self._features = frozenset(self._features_by_name.values())
+        self._feature_names_by_type = {
+            feature_type: frozenset(
+                f.name for f in self._features if f.type is feature_type
+            ) for feature_type in FeatureType
+        }
+        self._closures = {}
+        self._normalised_modifiers = {}
+        self._canonicalised_features = {}
+
+    def features(self) -> typing.FrozenSet[FeatureDescriptor]:
+        return self._features
+
+    def feature_names(self, feature_type: FeatureType) -> typing.FrozenSet[str]:
+        return self._feature_names_by_type[feature_type]
+
+    def feature_by_name(self, feature_name: str) -> FeatureDescriptor:
+        try:
+            return self._features_by_name[feature_name]
+        except KeyError:
+            raise ValueError(feature_name)
+
+    def included_features(self, feature_name: str) -> typing.FrozenSet[FeatureDescriptor]:
+        '''
+        returns the set of features transitively included by the given feature
+        '''
+        if (closure := self._closures.get(feature_name)) is not None:
+            return closure
+
+        closure = set()
+        for name in self.feature_by_name(feature_name).included_feature_names():
+            closure.add(self.feature_by_name(name))
+            closure |= self.included_features(name)
+
+        closure = frozenset(closure)
+        self._closures[feature_name] = closure
+        return closure
+
+    def normalised_modifiers(self, platform: Platform, modifiers) -> typing.Tuple[str, ...]:
+        cache_key = (platform, frozenset(modifiers))
+        if (normalised := self._normalised_modifiers.get(cache_key)) is not None:
+            return normalised
+
+        self.feature_by_name(platform)  # validate platform name
+        all_modifiers = set()
+        for name in itertools.chain((platform,), cache_key[1]):
+            all_modifiers |= {f.name for f in self.included_features(name)}
+        all_modifiers |= {self.feature_by_name(m).name for m in cache_key[1]}
+
+        normalised = tuple(sorted(all_modifiers, key=str.upper))
+        self._normalised_modifiers[cache_key] = normalised
+        return normalised
+
+    def canonicalised_features(
+        self,
+        platform: Platform,
+        modifiers,
+    ) -> typing.Tuple[FeatureDescriptor, ...]:
+        cache_key = (platform, frozenset(modifiers))
+        if (canonicalised := self._canonicalised_features.get(cache_key)) is not None:
+            return canonicalised
+
+        platform = self.feature_by_name(platform)
+        minimal_modifiers = {self.feature_by_name(m) for m in cache_key[1]}
+
+        # rm all transitive dependencies from modifiers
+        # note: features included by platform are deliberately _not_ removed, as canonical
+        # names of existing release manifests were calculated that way
+        for modifier in cache_key[1]:
+            minimal_modifiers -= self.included_features(modifier)
+
+        # canonical name: <platform>-<ordered-features> (UPPER-cased-sort, so _ is after alpha)
+        minimal_modifiers = sorted(minimal_modifiers, key=lambda m: m.name.upper())
+
+        canonicalised = (platform, *minimal_modifiers)
+        self._canonicalised_features[cache_key] = canonicalised
+        return canonicalised
+
+
 @functools.lru_cache
+def feature_graph() -> FeatureGraph:
+    return FeatureGraph(
+        features=(
+            _deserialise_feature(feature_file)
+            for feature_file in _enumerate_feature_files()
+        ),
+    )
+
+
 def features():
-    return {
-        _deserialise_feature(feature_file)
-        for feature_file in _enumerate_feature_files()
-    }
+    return feature_graph().features()
 
 
 def platforms():
@@ -852,7 +926,7 @@ def platforms():
 
 
 def platform_names():
-    return {p.name for p in platforms()}
+    return set(feature_graph().feature_names(FeatureType.PLATFORM))
 
 
 def modifiers():
@@ -862,7 +936,4 @@ def modifiers():
 
 
 def feature_by_name(feature_name: str):
-    for feature in features():
-        if feature.name == feature_name:
-            return feature
-    raise ValueError(feature_name)
+    return feature_graph().feature_by_name(feature_name)
@@ -1,4 +1,5 @@
 import collections
+import concurrent.futures
 import dataclasses
 import datetime
 import enum
@@ -7,16 +8,20 @@ import hashlib
 import json
 import logging
 import lzma
+import os
 import tempfile
 import typing
 import zlib
 
 import glci.model
+import glci.s3
 import oci.util as ou
 
 
 logger = logging.getLogger(__name__)
 
+_default_compress_workers = os.cpu_count() or 1
+
 
 DOCKER_IMAGE_MANIFEST_V2_S2_MEDIATYPE = 'application/vnd.docker.distribution.manifest.v2+json'
 DOCKER_IMAGE_LIST_MEDIATYPE = 'application/vnd.docker.distribution.manifest.list.v2+json'
@@ -126,65 +131,192 @@ class ImageConfig:
     config: typing.Optional[ContainerImageConfig] = None
 
 
-def publish_container_image_from_tarfile(
-    tar_file: typing.Union[str, typing.IO],
+@dataclasses.dataclass(frozen=True)
+class LayerBlob:
+    '''
+    a gzip-compressed image layer (as pushed to an OCI registry)
+    '''
+    digest: str  # digest of the compressed layer (blob digest)
+    size: int  # size of the compressed layer
+    diff_id: str  # digest of the uncompressed layer
+
+
+# layers built from release artefacts, keyed by (s3_bucket_name, s3_key, etag) of source tar.xz
+# allows re-tagging publishes (and retries) to skip recompression
+_layer_cache: typing.Dict[typing.Tuple[str, str, str], LayerBlob] = {}
+
+_read_chunk_size = 4 * 1024 * 1024
+
+
+def _gzip_blocks(
+    blocks: typing.Iterable[bytes],
+    compress_workers: int,
+) -> typing.Generator[bytes, None, None]:
+    '''
+    deflate-compresses the given blocks into one raw deflate stream (yielded in order).
+
+    Each block is compressed independently and terminated using a sync-flush, which allows the
+    results to be concatenated (similar to `pigz`). The stream is terminated using an empty final
+    block. If `compress_workers` > 1, blocks are compressed concurrently (zlib releases the GIL);
+    otherwise, inline. Either way, the output (and thus the layer digest) does not depend on the
+    amount of workers.
+    '''
+    def compress_block(block: bytes) -> bytes:
+        compressor = gziputil.zlib_compressobj()
+        return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    if compress_workers <= 1:
+        yield from map(compress_block, blocks)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=compress_workers) as executor:
+            pending = collections.deque()
+            for block in blocks:
+                # bound memory consumption by limiting amount of blocks in flight
+                if len(pending) >= 2 * compress_workers:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(compress_block, block))
+
+            while pending:
+                yield pending.popleft().result()
+
+    yield gziputil.zlib_compressobj().flush()
+
+
+def _gzip_layer_from_tar_xz(
+    tar_xz: typing.IO,
+    out: typing.IO,
+    compress_workers: int=_default_compress_workers,
+) -> LayerBlob:
+    '''
+    converts the given (xz-compressed) tarfile into a gzip-compressed layer, written to `out`.
+
+    This is done in one pass; digests of both the uncompressed and the compressed layer are
+    calculated on the fly.
+    '''
+    uncompressed_hash = hashlib.sha256()
+    compressed_hash = hashlib.sha256()
+    crc = 0
+    src_length = 0
+    length = 0
+
+    def write(chunk: bytes):
+        nonlocal length
+        compressed_hash.update(chunk)
+        length += len(chunk)
+        out.write(chunk)
+
+    def uncompressed_blocks():
+        nonlocal crc, src_length
+        with lzma.open(tar_xz) as f:
+            while chunk := f.read(_read_chunk_size):
+                uncompressed_hash.update(chunk)
+                crc = zlib.crc32(chunk, crc)
+                src_length += len(chunk)
+                yield chunk
+
+    write(gziputil.gzip_header(fname=b'layer.tar'))
+
+    for chunk in _gzip_blocks(uncompressed_blocks(), compress_workers=compress_workers):
+        write(chunk)
+
+    write(gziputil.gzip_footer(
+        crc32=crc,
+        uncompressed_size=src_length,
+    ))
+
+    return LayerBlob(
+        digest=f'sha256:{compressed_hash.hexdigest()}',
+        size=length,
+        diff_id=f'sha256:{uncompressed_hash.hexdigest()}',
+    )
+
+
+def _blob_exists(
     oci_client,
     image_reference: str,
-    architecture: Architecture,
-    os: OperatingSystem = OperatingSystem.LINUX,
-    additional_tags: typing.List[str] = [],
-):
-    image_reference = ou.normalise_image_reference(image_reference=image_reference)
-    image_name = image_reference.rsplit(':', 1)[0]
-    image_references = (image_reference,) + tuple([f'{image_name}:{tag}' for tag in additional_tags])
+    digest: str,
+) -> bool:
+    return oci_client.head_blob(
+        image_reference=image_reference,
+        digest=digest,
+        absent_ok=True,
+    ).ok
 
-    uncompressed_hash = hashlib.sha256()
 
+def _push_layer_from_tar_xz(
+    tar_xz: typing.Union[str, typing.IO],
+    oci_client,
+    image_reference: str,
+    compress_workers: int=_default_compress_workers,
+) -> LayerBlob:
     with tempfile.TemporaryFile() as gzip_file:
+        layer_blob = _gzip_layer_from_tar_xz(
+            tar_xz=tar_xz,
+            out=gzip_file,
+            compress_workers=compress_workers,
+        )
+        gzip_file.seek(0)
 
-        compressed_hash = hashlib.sha256()
-        length = 0
-        src_length = 0
-        crc = 0
+        oci_client.put_blob(
+            image_reference=image_reference,
+            digest=layer_blob.digest,
+            octets_count=layer_blob.size,
+            data=gzip_file,
+        )
 
-        with lzma.open(tar_file) as f:
-            gzip_file.write(gzip_header := gziputil.gzip_header(fname=b'layer.tar'))
-            compressed_hash.update(gzip_header)
-            length += len(gzip_header)
+    return layer_blob
 
-            compressor = gziputil.zlib_compressobj()
 
-            while chunk := f.read(1024):
-                uncompressed_hash.update(chunk)
-                crc = zlib.crc32(chunk, crc)
-                src_length += len(chunk)
+def publish_container_image_from_tarfile(
+    tar_file: typing.Union[str, typing.IO],
+    oci_client,
+    image_reference: str,
+    architecture: Architecture,
+    os: OperatingSystem = OperatingSystem.LINUX,
+    additional_tags: typing.List[str] = [],
+    compress_workers: int = _default_compress_workers,
+):
+    '''
+    builds a single-layer image from the given (xz-compressed) tarfile and publishes it.
 
-                chunk = compressor.compress(chunk)
-                compressed_hash.update(chunk)
-                length += len(chunk)
-                gzip_file.write(chunk)
+    The tarfile is read only once (and may thus be a non-seekable stream); only the resulting
+    gzip-compressed layer is spooled to a local temporary file (its digest must be known before
+    it can be pushed).
+    '''
+    image_reference = ou.normalise_image_reference(image_reference=image_reference)
 
-            gzip_file.write((remainder := compressor.flush()))
-            compressed_hash.update(remainder)
-            length += len(remainder)
+    logger.info(f"pushing blob created from tarfile '{tar_file}'")
+    layer_blob = _push_layer_from_tar_xz(
+        tar_xz=tar_file,
+        oci_client=oci_client,
+        image_reference=image_reference,
+        compress_workers=compress_workers,
+    )
 
-            gzip_footer = gziputil.gzip_footer(
-                crc32=crc,
-                uncompressed_size=src_length,
-            )
-            gzip_file.write(gzip_footer)
-            compressed_hash.update(gzip_footer)
-            length += len(gzip_footer)
+    return publish_container_image_from_layer(
+        layer_blob=layer_blob,
+        oci_client=oci_client,
+        image_reference=image_reference,
+        architecture=architecture,
+        os=os,
+        additional_tags=additional_tags,
+    )
 
-            gzip_file.seek(0)
 
-            logger.info(f"pushing blob created from tarfile '{tar_file}'")
-            oci_client.put_blob(
-                image_reference=image_reference,
-                digest=(compressed_digest := f'sha256:{compressed_hash.hexdigest()}'),
-                octets_count=length,
-                data=gzip_file,
-            )
+def publish_container_image_from_layer(
+    layer_blob: LayerBlob,
+    oci_client,
+    image_reference: str,
+    architecture: Architecture,
+    os: OperatingSystem = OperatingSystem.LINUX,
+    additional_tags: typing.List[str] = [],
+):
+    '''
+    publishes a single-layer image from the given layer (which must already have been pushed)
+    '''
+    image_reference = ou.normalise_image_reference(image_reference=image_reference)
+    image_name = image_reference.rsplit(':', 1)[0]
+    image_references = (image_reference,) + tuple([f'{image_name}:{tag}' for tag in additional_tags])
 
     image_config = ImageConfig(
         created=(timestamp :=  datetime.datetime.now().replace(microsecond=0).isoformat() + 'Z'),
@@ -197,7 +329,7 @@ def publish_container_image_from_tarfile(
         ),
         rootfs=RootfsConfig(
             type='layers',
-            diff_ids=[f'sha256:{uncompressed_hash.hexdigest()}'],
+            diff_ids=[layer_blob.diff_id],
         ),
         history=[HistoryConfig(created=timestamp)]
     )
@@ -219,8 +351,8 @@ def publish_container_image_from_tarfile(
         ),
         layers=[
             ImageManifestV2_2Layers(
-                digest=compressed_digest,
-                size=length,
+                digest=layer_blob.digest,
+                size=layer_blob.size,
             ),
         ],
     )
@@ -231,7 +363,7 @@ def publish_container_image_from_tarfile(
     for tgt_ref in image_references:
         logger.info(f'publishing manifest {tgt_ref=}')
         oci_client.put_manifest(
-        image_reference=image_reference,
+        image_reference=tgt_ref,
         manifest=image_manifest,
     )
 
@@ -292,25 +424,41 @@ def publish_from_release(
 ):
     rootfs_key = release.path_by_suffix('rootfs.tar.xz').s3_key
     rootfs_bucket_name = release.path_by_suffix('rootfs.tar.xz').s3_bucket_name
+    architecture = Architecture(release.architecture.value)
 
-    with tempfile.TemporaryFile() as tfh:
-        s3_client.download_fileobj(
-            Bucket=rootfs_bucket_name,
-            Key=rootfs_key,
-            Fileobj=tfh,
-        )
-        tfh.seek(0)
-        logger.info(f'retrieved raw image fs from {rootfs_bucket_name=}')
+    etag = s3_client.head_object(Bucket=rootfs_bucket_name, Key=rootfs_key)['ETag']
+    layer_cache_key = (rootfs_bucket_name, rootfs_key, etag)
 
-        image_manifest_digest, image_manifest_size = publish_container_image_from_tarfile(
-            tar_file=tfh,
-            oci_client=oci_client,
-            image_reference=image_reference,
-            architecture=Architecture(release.architecture),
-            additional_tags=additional_tags,
-        )
+    if (layer_blob := _layer_cache.get(layer_cache_key)) and _blob_exists(
+        oci_client=oci_client,
+        image_reference=image_reference,
+        digest=layer_blob.digest,
+    ):
+        logger.info(f'reusing existing layer {layer_blob.digest=} for {rootfs_key=}')
+    else:
+        with glci.s3.ParallelRangeReader(
+            s3_client=s3_client,
+            bucket_name=rootfs_bucket_name,
+            key=rootfs_key,
+        ) as rootfs_stream:
+            logger.info(f'streaming raw image fs from {rootfs_bucket_name=}')
+            layer_blob = _push_layer_from_tar_xz(
+                tar_xz=rootfs_stream,
+                oci_client=oci_client,
+                image_reference=image_reference,
+            )
+        logger.info(f'pushed layer {layer_blob.digest=} created from {rootfs_key=}')
+        _layer_cache[layer_cache_key] = layer_blob
+
+    image_manifest_digest, image_manifest_size = publish_container_image_from_layer(
+        layer_blob=layer_blob,
+        oci_client=oci_client,
+        image_reference=image_reference,
+        architecture=architecture,
+        additional_tags=additional_tags,
+    )
 
-        logger.info('publishing succeeded')
+    logger.info('publishing succeeded')
 
     return image_manifest_digest, image_manifest_size
 
@@ -320,7 +468,15 @@ def publish_from_release_set(
     publish_cfg: glci.model.OciPublishCfg,
     oci_client,
     s3_client,
+    max_workers: int=4,
 ):
+    '''
+    publishes a multi-arch image for each oci-flavour contained in the given release set.
+
+    Architecture variants of all images are published concurrently (using at most `max_workers`
+    threads). The manifest list of an image is pushed as soon as all of its variants were
+    published.
+    '''
     # version is only present in manifests, but should be the same in all
     version = release_set.manifests[0].version
     # we only care about oci-releases
@@ -336,41 +492,30 @@ def publish_from_release_set(
 
     logger.info(f'Publishing {len(sorted_release_manifests)} multi-arch images.')
 
-    # create a multiarch-image for each bucket
-    for image_tag in sorted_release_manifests:
-        image_reference = f'{publish_cfg.image_prefix}:{version}-{image_tag}'
-        logger.info(
-            f'Publishing multi-arch image {image_reference}. '
-            'Beginning to push architecture variants now...'
+    def publish_variant(
+        image_reference: str,
+        release_manifest: glci.model.OnlineReleaseManifest,
+    ) -> ManifestListEntry:
+        image_manifest_digest, image_manifest_size = publish_from_release(
+            release=release_manifest,
+            image_reference=image_reference,
+            oci_client=oci_client,
+            s3_client=s3_client,
         )
-        image_manifests = []
-        for release_manifest in sorted_release_manifests[image_tag]:
-            image_manifest_digest, image_manifest_size = publish_from_release(
-                release=release_manifest,
-                image_reference=image_reference,
-                oci_client=oci_client,
-                s3_client=s3_client,
-            )
 
-            published_image_reference = glci.model.OciPublishedImage(
-                image_reference=image_reference,
-            )
-            dataclasses.replace(release_manifest, published_image_metadata=published_image_reference)
-
-            architecture = Architecture(release_manifest.architecture.value)
-            os = OperatingSystem.LINUX  # currently not set in release-sets
-
-            image_manifests.append(
-                ManifestListEntry(
-                    digest=image_manifest_digest,
-                    size=image_manifest_size,
-                    platform=PlatformConfig(
-                        architecture=architecture.value,
-                        os=os.value,
-                    )
-                )
+        architecture = Architecture(release_manifest.architecture.value)
+        os = OperatingSystem.LINUX  # currently not set in release-sets
+
+        return ManifestListEntry(
+            digest=image_manifest_digest,
+            size=image_manifest_size,
+            platform=PlatformConfig(
+                architecture=architecture.value,
+                os=os.value,
             )
+        )
 
+    def publish_manifest_list(image_reference: str, image_manifests: typing.List[ManifestListEntry]):
         logger.info(
             f'Successfully pushed architecture variants for {image_reference}. '
             'Publishing manifest list...'
@@ -385,4 +530,28 @@ def publish_from_release_set(
         )
         logger.info(f'Publishing multi-arch image {image_reference} succeeded')
 
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # {future: (image_reference, variant_idx)}
+        variant_futures = {}
+        # {image_reference: [ManifestListEntry|None, ...]} (retains order of variants)
+        image_manifests = {}
+
+        for image_tag, release_manifests in sorted_release_manifests.items():
+            image_reference = f'{publish_cfg.image_prefix}:{version}-{image_tag}'
+            logger.info(
+                f'Publishing multi-arch image {image_reference}. '
+                'Beginning to push architecture variants now...'
+            )
+            image_manifests[image_reference] = [None] * len(release_manifests)
+            for idx, release_manifest in enumerate(release_manifests):
+                future = executor.submit(publish_variant, image_reference, release_manifest)
+                variant_futures[future] = (image_reference, idx)
+
+        for future in concurrent.futures.as_completed(variant_futures):
+            image_reference, idx = variant_futures[future]
+            image_manifests[image_reference][idx] = future.result()
+
+            if all(image_manifests[image_reference]):
+                publish_manifest_list(image_reference, image_manifests[image_reference])
+
     return release_set
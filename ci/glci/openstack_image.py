@@ -1,12 +1,16 @@
+import concurrent.futures
 import dataclasses
 import functools
+import logging
 import typing
-from datetime import datetime
-from time import sleep
 
 from openstack import connect
 
 import glci
+import glci.waiter
+
+logger = logging.getLogger(__name__)
+
 
 class OpenstackImageUploader:
     '''OpenstackImageUploader is a client to upload images to Openstack Glance.'''
@@ -56,21 +60,35 @@ class OpenstackImageUploader:
         conn.image.import_image(image, method="web-download", uri=url)
         return image['id']
 
+    def image_status_fetcher(self) -> glci.waiter.StatusFetcher:
+        '''Returns a status-fetcher for images (keyed by image id) in this environment.'''
+
+        conn = self._get_connection()
+
+        def fetch_status(image_id: str) -> str:
+            return conn.image.get_image(image_id)['status']
+
+        return glci.waiter.StatusFetcher(
+            name=f'openstack-images/{self.openstack_env.region}',
+            fetch=glci.waiter.single_fetch(fetch_status),
+            is_done=lambda status: status == 'active',
+            is_failed=lambda status: status not in ('queued', 'saving', 'importing', 'active'),
+        )
+
     def wait_image_ready(self, image_id: str, wait_interval_seconds=10, timeout=3600):
         '''Wait until an image get in ready state.'''
 
-        conn = self._get_connection()
-        start_time = datetime.now()
-        while True:
-            if (datetime.now()-start_time).total_seconds() > timeout:
-                raise RuntimeError('Timeout for waiting image to get ready reached.')
-            image = conn.image.get_image(image_id)
-            if image['status'] == 'queued' or image['status'] == 'saving' or image['status'] == 'importing':
-                sleep(wait_interval_seconds)
-                continue
-            if image['status'] == 'active':
-                return
-            raise RuntimeError(f"image upload to Glance failed due to image status {image['status']}")
+        try:
+            glci.waiter.wait_for(
+                key=image_id,
+                fetcher=self.image_status_fetcher(),
+                timeout_seconds=timeout,
+                backoff=glci.waiter.Backoff(initial_seconds=wait_interval_seconds),
+            )
+        except glci.waiter.WaitTimeoutError:
+            raise RuntimeError('Timeout for waiting image to get ready reached.')
+        except glci.waiter.WaitFailedError as e:
+            raise RuntimeError(f"image upload to Glance failed due to image status {e.status}")
 
 
 def upload_and_publish_image(
@@ -92,24 +110,75 @@ def upload_and_publish_image(
 
     s3_image_url = s3_client.generate_presigned_url(
         'get_object',
-        ExpiresIn=1200*len(openstack_environments_cfgs), # 20min validity for each openstack enviroment/region
+        ExpiresIn=1200, # 20min validity (all environments/regions import concurrently)
         Params={
             'Bucket': openstack_release_artifact_path.s3_bucket_name,
             'Key': openstack_release_artifact_path.s3_key,
         },
     )
 
+    # one uploader (and thus connection) per environment
+    uploaders = [OpenstackImageUploader(env_cfg) for env_cfg in openstack_environments_cfgs]
+
+    def start_import(uploader: OpenstackImageUploader) -> str:
+        return uploader.upload_image_from_url(image_name, s3_image_url, image_meta)
+
+    def env_name(uploader: OpenstackImageUploader) -> str:
+        env = uploader.openstack_env
+        return f'{env.region}/{env.project_name}@{env.auth_url}'
+
+    # keyed by uploader, as several environments may share one region
+    errors = {} # {uploader: error}
+    image_ids = {} # {uploader: image_id}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(uploaders))) as executor:
+        futures = {
+            executor.submit(start_import, uploader): uploader for uploader in uploaders
+        }
+        for future in concurrent.futures.as_completed(futures):
+            uploader = futures[future]
+            try:
+                image_ids[uploader] = future.result()
+            except Exception as e:
+                logger.warning(f'failed to start image import in {env_name(uploader)}: {e}')
+                errors[uploader] = e
+
+    importing_uploaders = [u for u in uploaders if u in image_ids]
+    results = glci.waiter.wait(
+        operations=(
+            glci.waiter.PendingOperation(
+                key=image_ids[uploader],
+                fetcher=uploader.image_status_fetcher(),
+                timeout_seconds=3600,
+                backoff=glci.waiter.Backoff(initial_seconds=10),
+            ) for uploader in importing_uploaders
+        ),
+        fail_fast=False,
+    )
+
     published_images = []
-    for env_cfg in openstack_environments_cfgs:
-        uploader = OpenstackImageUploader(env_cfg)
-        image_id = uploader.upload_image_from_url(image_name, s3_image_url, image_meta)
-        uploader.wait_image_ready(image_id)
+    for uploader, result in zip(importing_uploaders, results):
+        if not result.ok:
+            errors[uploader] = result.error
+            continue
 
+        logger.info(
+            f'{image_name=} ready in {env_name(uploader)} after {result.elapsed_seconds:.0f}s'
+        )
         published_images.append(glci.model.OpenstackPublishedImage(
-            region_name=env_cfg.region,
-            image_id=image_id,
+            region_name=uploader.openstack_env.region,
+            image_id=result.key,
             image_name=image_name,
         ))
 
+    if errors:
+        for uploader, error in errors.items():
+            logger.error(f'publishing {image_name=} to {env_name(uploader)} failed: {error}')
+        failed_environments = sorted(env_name(uploader) for uploader in errors)
+        published_regions = [image.region_name for image in published_images]
+        raise RuntimeError(
+            f'publishing to {len(errors)} of {len(uploaders)} openstack environments failed: '
+            f'{failed_environments=} ({published_regions=})'
+        )
+
     published_image_set = glci.model.OpenstackPublishedImageSet(published_openstack_images=tuple(published_images))
     return dataclasses.replace(release, published_image_metadata=published_image_set)
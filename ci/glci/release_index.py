@@ -0,0 +1,418 @@
+'''
+a local, persistent index of the release manifests contained in the build-result bucket
+
+Many tools need to answer questions like "which manifests exist for a given epoch / commit /
+platform", or "which objects are referenced by any manifest". Instead of enumerating (and
+retrieving) all manifests from S3 each time, the index stores the few attributes required to answer
+those questions in a sqlite database. It is refreshed incrementally: only manifests that were added
+or changed (as per the ETags from listing the manifest prefix) are retrieved.
+'''
+import concurrent.futures
+import dataclasses
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import typing
+
+import botocore.client
+
+import glci.model
+import glci.util
+
+logger = logging.getLogger(__name__)
+
+# set to an empty value to disable the (default) index
+index_path_env_var = 'GLCI_RELEASE_INDEX'
+default_index_path = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+    'gardenlinux',
+    'release-index.sqlite3',
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class IndexedRelease:
+    s3_bucket: str
+    s3_key: str
+    etag: str
+    gardenlinux_epoch: int
+    build_committish: str
+    version: str
+    architecture: glci.model.Architecture
+    platform: str
+    modifiers: typing.Tuple[str, ...]
+    build_timestamp: str
+    published: bool
+
+    def release_identifier(self) -> glci.model.ReleaseIdentifier:
+        return glci.model.ReleaseIdentifier(
+            build_committish=self.build_committish,
+            version=self.version,
+            gardenlinux_epoch=self.gardenlinux_epoch,
+            architecture=self.architecture,
+            platform=self.platform,
+            modifiers=self.modifiers,
+        )
+
+
+@dataclasses.dataclass(frozen=True)
+class RefreshStats:
+    added: int
+    updated: int
+    removed: int
+    unchanged: int
+
+
+def _referenced_objects(
+    manifest: glci.model.OnlineReleaseManifest,
+) -> typing.Generator[glci.model.S3_ReleaseFile, None, None]:
+    '''
+    yields the objects referenced by the given manifest. `clean` determines referenced objects
+    using this function, too (indexed and enumerated manifests must agree).
+    '''
+    yield from manifest.paths
+    if isinstance(manifest.logs, glci.model.S3_ReleaseFile):
+        yield manifest.logs
+
+
+def _normalised_modifiers(platform: str, modifiers) -> typing.Tuple[str, ...]:
+    '''
+    normalises the given modifiers. Historic manifests may reference features that were since
+    removed or renamed; for those, the modifiers are used as given (sorted like normalised ones)
+    '''
+    try:
+        return glci.model.normalised_modifiers(platform=platform, modifiers=modifiers)
+    except ValueError as e:
+        logger.warning(f'cannot normalise {platform=} {modifiers=} (unknown feature: {e})')
+        return tuple(sorted(set(modifiers), key=str.upper))
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    # smallest string greater than all strings starting w/ prefix (allows for index range-scans)
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class ReleaseIndex:
+    '''
+    a local index of release manifests (see module docstring).
+
+    Manifests are keyed by bucket name and S3 key. Besides the attributes of the manifest's release
+    identifier, the build timestamp, whether images were published, and the (bucket, key) pairs of
+    all referenced objects are stored. Modifiers are stored normalised.
+
+    Instances may be shared between threads.
+    '''
+    def __init__(self, path: str=default_index_path):
+        if (dirname := os.path.dirname(path)):
+            os.makedirs(dirname, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        # the index can always be rebuilt from S3 - trade durability for speed
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=OFF')
+        self._conn.execute('PRAGMA foreign_keys=ON')
+        self._conn.executescript(
+            '''CREATE TABLE IF NOT EXISTS releases (
+                id INTEGER PRIMARY KEY,
+                bucket TEXT NOT NULL,
+                key TEXT NOT NULL,
+                etag TEXT NOT NULL,
+                gardenlinux_epoch INTEGER NOT NULL,
+                build_committish TEXT NOT NULL,
+                version TEXT NOT NULL,
+                architecture TEXT NOT NULL,
+                platform TEXT NOT NULL,
+                modifiers TEXT NOT NULL,
+                build_timestamp TEXT NOT NULL,
+                published INTEGER NOT NULL,
+                UNIQUE (bucket, key)
+            );
+            CREATE INDEX IF NOT EXISTS releases_by_epoch
+                ON releases (gardenlinux_epoch, build_committish);
+            CREATE INDEX IF NOT EXISTS releases_by_committish ON releases (build_committish);
+            CREATE INDEX IF NOT EXISTS releases_by_platform ON releases (platform);
+            CREATE TABLE IF NOT EXISTS release_objects (
+                release_id INTEGER NOT NULL REFERENCES releases (id) ON DELETE CASCADE,
+                bucket TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (release_id, bucket, key)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS release_objects_by_key ON release_objects (bucket, key);
+            '''
+        )
+        self._conn.commit()
+
+    def _etags(self, bucket_name: str, prefix: str) -> typing.Dict[str, str]:
+        with self._lock:
+            return dict(self._conn.execute(
+                'SELECT key, etag FROM releases WHERE bucket=? AND key>=? AND key<?',
+                (bucket_name, prefix, _prefix_upper_bound(prefix)),
+            ))
+
+    def _put(
+        self,
+        manifests_with_etags: typing.Sequence[
+            typing.Tuple[glci.model.OnlineReleaseManifest, str]
+        ],
+    ):
+        rows = []
+        for manifest, etag in manifests_with_etags:
+            modifiers = _normalised_modifiers(
+                platform=manifest.platform,
+                modifiers=manifest.modifiers,
+            )
+            rows.append((
+                (
+                    manifest.s3_bucket,
+                    manifest.s3_key,
+                    etag,
+                    int(manifest.gardenlinux_epoch),
+                    manifest.build_committish,
+                    manifest.version,
+                    glci.model.Architecture(manifest.architecture).value,
+                    manifest.platform,
+                    ','.join(modifiers),
+                    manifest.build_timestamp,
+                    int(manifest.published_image_metadata is not None),
+                ),
+                {(o.s3_bucket_name, o.s3_key) for o in _referenced_objects(manifest)},
+            ))
+
+        with self._lock, self._conn:
+            for release_row, objects in rows:
+                self._conn.execute(
+                    'DELETE FROM releases WHERE bucket=? AND key=?',
+                    release_row[:2],
+                )
+                release_id = self._conn.execute(
+                    '''INSERT INTO releases (
+                        bucket, key, etag, gardenlinux_epoch, build_committish, version,
+                        architecture, platform, modifiers, build_timestamp, published
+                    ) VALUES (?,?,?,?,?,?,?,?,?,?,?)''',
+                    release_row,
+                ).lastrowid
+                self._conn.executemany(
+                    'INSERT INTO release_objects (release_id, bucket, key) VALUES (?,?,?)',
+                    ((release_id, bucket, key) for bucket, key in objects),
+                )
+
+    def _remove(self, bucket_name: str, keys: typing.Iterable[str]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'DELETE FROM releases WHERE bucket=? AND key=?',
+                ((bucket_name, key) for key in keys),
+            )
+
+    def refresh(
+        self,
+        s3_client: 'botocore.client.S3',
+        bucket_name: str,
+        prefix: str=glci.model.ReleaseManifest.manifest_key_prefix,
+        max_workers: int=32,
+    ) -> RefreshStats:
+        '''
+        updates the index from the manifests found in the given bucket below the given prefix.
+
+        The prefix is listed once. Manifests are only retrieved if they are not indexed, yet, or
+        if their ETag changed. Indexed manifests that no longer exist are removed.
+        '''
+        indexed_etags = self._etags(bucket_name=bucket_name, prefix=prefix)
+        seen_keys = set()
+        added = updated = unchanged = 0
+
+        def retrieve(obj_dict: dict):
+            manifest = glci.util.release_manifest(
+                s3_client=s3_client,
+                bucket_name=bucket_name,
+                key=obj_dict['Key'],
+                etag=obj_dict['ETag'],
+                absent_ok=True,
+            )
+            return manifest, obj_dict['ETag']
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for res in glci.util._list_object_pages(
+                s3_client=s3_client,
+                bucket_name=bucket_name,
+                prefix=prefix,
+                executor=executor,
+            ):
+                outdated = []
+                for obj_dict in res['Contents']:
+                    key = obj_dict['Key']
+                    if key.endswith('/'):
+                        continue # directory marker
+                    seen_keys.add(key)
+
+                    if (indexed_etag := indexed_etags.get(key)) is None:
+                        added += 1
+                    elif indexed_etag != obj_dict['ETag']:
+                        updated += 1
+                    else:
+                        unchanged += 1
+                        continue
+                    outdated.append(obj_dict)
+
+                self._put(
+                    [
+                        (manifest, etag) for manifest, etag in executor.map(retrieve, outdated)
+                        if manifest # might have been removed in the meantime
+                    ]
+                )
+
+        removed_keys = indexed_etags.keys() - seen_keys
+        self._remove(bucket_name=bucket_name, keys=removed_keys)
+
+        stats = RefreshStats(
+            added=added,
+            updated=updated,
+            removed=len(removed_keys),
+            unchanged=unchanged,
+        )
+        logger.info(f'refreshed release index for {bucket_name=}: {stats}')
+        return stats
+
+    def releases(
+        self,
+        bucket_name: str=None,
+        s3_key: str=None,
+        gardenlinux_epoch: int=None,
+        build_committish: str=None,
+        version: str=None,
+        architecture: glci.model.Architecture=None,
+        platform: str=None,
+        modifiers: typing.Iterable[str]=None,
+        published: bool=None,
+    ) -> typing.Tuple[IndexedRelease, ...]:
+        '''
+        returns all indexed releases matching the given criteria (omitted criteria match all
+        releases). `build_committish` may be abbreviated (matched as prefix). `modifiers` are
+        normalised (requires `platform` to be passed as well)
+        '''
+        clauses = []
+        args = []
+
+        def add(clause: str, *clause_args):
+            clauses.append(clause)
+            args.extend(clause_args)
+
+        if bucket_name is not None:
+            add('bucket=?', bucket_name)
+        if s3_key is not None:
+            add('key=?', s3_key)
+        if gardenlinux_epoch is not None:
+            add('gardenlinux_epoch=?', int(gardenlinux_epoch))
+        if build_committish:
+            add(
+                'build_committish>=? AND build_committish<?',
+                build_committish,
+                _prefix_upper_bound(build_committish),
+            )
+        if version is not None:
+            add('version=?', version)
+        if architecture is not None:
+            add('architecture=?', glci.model.Architecture(architecture).value)
+        if platform is not None:
+            add('platform=?', platform)
+        if modifiers is not None:
+            if platform is None:
+                raise ValueError('platform must be passed if filtering by modifiers')
+            normalised = _normalised_modifiers(platform=platform, modifiers=modifiers)
+            add('modifiers=?', ','.join(normalised))
+        if published is not None:
+            add('published=?', int(published))
+
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+
+        with self._lock:
+            rows = self._conn.execute(
+                f'''SELECT bucket, key, etag, gardenlinux_epoch, build_committish, version,
+                    architecture, platform, modifiers, build_timestamp, published
+                    FROM releases {where} ORDER BY bucket, key''',
+                args,
+            ).fetchall()
+
+        return tuple(
+            IndexedRelease(
+                s3_bucket=bucket,
+                s3_key=key,
+                etag=etag,
+                gardenlinux_epoch=epoch,
+                build_committish=committish,
+                version=version,
+                architecture=glci.model.Architecture(architecture),
+                platform=platform,
+                modifiers=tuple(modifiers.split(',')) if modifiers else (),
+                build_timestamp=build_timestamp,
+                published=bool(published),
+            ) for (
+                bucket, key, etag, epoch, committish, version, architecture, platform, modifiers,
+                build_timestamp, published,
+            ) in rows
+        )
+
+    def release(
+        self,
+        bucket_name: str,
+        release_identifier: glci.model.ReleaseIdentifier,
+        prefix: str=glci.model.ReleaseManifest.manifest_key_prefix,
+    ) -> typing.Optional[IndexedRelease]:
+        '''
+        returns the indexed release w/ the given identifier (looked-up by its canonical manifest
+        key), or `None` if there is no such release
+        '''
+        key = f'{prefix}/{release_identifier.canonical_release_manifest_key_suffix()}'
+        normalised = glci.model.normalised_release_identifier(release_identifier)
+
+        for release in self.releases(bucket_name=bucket_name, s3_key=key):
+            if release.release_identifier() == normalised:
+                return release
+        return None
+
+    def referenced_object_keys(
+        self,
+        bucket_name: str,
+        chunk_size: int=10000,
+    ) -> typing.Generator[str, None, None]:
+        '''
+        yields the keys of all objects (in the given bucket) referenced by any indexed release,
+        in ascending order, and w/o duplicates
+        '''
+        last_key = ''
+        while True:
+            with self._lock:
+                keys = [
+                    key for (key,) in self._conn.execute(
+                        '''SELECT DISTINCT key FROM release_objects WHERE bucket=? AND key>?
+                        ORDER BY key LIMIT ?''',
+                        (bucket_name, last_key, chunk_size),
+                    )
+                ]
+            yield from keys
+
+            if len(keys) < chunk_size:
+                return
+            last_key = keys[-1]
+
+
+@functools.lru_cache
+def default_index() -> typing.Optional[ReleaseIndex]:
+    '''
+    returns the process-wide release index (or `None` if disabled or unavailable).
+
+    The index location may be overwritten using the `GLCI_RELEASE_INDEX` env var. Setting it to an
+    empty value disables the index.
+    '''
+    path = os.environ.get(index_path_env_var, default_index_path)
+    if not path:
+        return None
+
+    try:
+        return ReleaseIndex(path=path)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f'release index at {path=} is unavailable: {e}')
+        return None
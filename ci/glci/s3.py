@@ -1,7 +1,17 @@
+import collections
+import concurrent.futures
+import io
+import logging
 import os
+
+import botocore.config
+import botocore.exceptions
+
 import glci.model
 import glci.util
 
+logger = logging.getLogger(__name__)
+
 
 def _s3_session(aws_cfg_name: str):
     try:
@@ -12,16 +22,26 @@ def _s3_session(aws_cfg_name: str):
     return ccc.aws.session(aws_cfg_name)
 
 
-def s3_client_for_aws_cfg_name(aws_cfg_name: str):
-    return _s3_session(aws_cfg_name).client('s3')
+def s3_client_for_aws_cfg_name(
+    aws_cfg_name: str,
+    config: botocore.config.Config=None,
+):
+    return _s3_session(aws_cfg_name).client('s3', config=config)
 
 
 def s3_resource_for_aws_cfg_name(aws_cfg_name: str):
     return _s3_session(aws_cfg_name).resource('s3')
 
 
-def s3_client(cicd_cfg: glci.model.CicdCfg):
-    return s3_client_for_aws_cfg_name(cicd_cfg.build.aws_cfg_name)
+def s3_client(
+    cicd_cfg: glci.model.CicdCfg,
+    config: botocore.config.Config=None,
+):
+    '''
+    @param config: optional client config (e.g. to increase `max_pool_connections` for clients
+                   shared between many threads)
+    '''
+    return s3_client_for_aws_cfg_name(cicd_cfg.build.aws_cfg_name, config=config)
 
 
 def s3_resource(cicd_cfg: glci.model.CicdCfg):
@@ -75,3 +95,163 @@ def download_dir(
         os.makedirs(local_dest_dir, exist_ok=True)
 
         bucket.download_file(Key=s3_obj.key, Filename=local_dest_file_path)
+
+
+class ParallelRangeReader(io.RawIOBase):
+    '''
+    a read-only file-like object that streams an S3 object using concurrent ranged GETs.
+
+    Parts of `part_size` bytes are downloaded ahead of the current read position in parallel; at
+    most `max_buffer_bytes` of downloaded (but not yet consumed) or in-flight parts are held in
+    memory. No local disk is used.
+
+    Seeking is only supported within the current read position and the last `rewind_bytes` that
+    were read (which is e.g. needed by resumable uploads to re-send a failed chunk).
+    '''
+    def __init__(
+        self,
+        s3_client: 'botocore.client.S3',
+        bucket_name: str,
+        key: str,
+        part_size: int=8 * 1024 * 1024,
+        max_buffer_bytes: int=128 * 1024 * 1024,
+        rewind_bytes: int=0,
+        max_attempts: int=3,
+    ):
+        super().__init__()
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = part_size
+        self.rewind_bytes = rewind_bytes
+        self.max_attempts = max_attempts
+
+        head = s3_client.head_object(Bucket=bucket_name, Key=key)
+        self.size = head['ContentLength']
+        # ensure all parts are read from the same object version
+        self.etag = head['ETag']
+
+        self._parts_in_flight = max(1, max_buffer_bytes // part_size)
+        self._part_count = -(-self.size // part_size)  # ceil-div
+        self._next_part = 0
+        self._pending = collections.deque()
+        # (offset, data) of retrieved parts overlapping [pos - rewind_bytes, ...)
+        self._retrieved = collections.deque()
+        self._next_offset = 0  # offset of next pending part
+        self._pos = 0
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self._parts_in_flight,
+        )
+        self._schedule_parts()
+
+    def _download_part(self, part_idx: int) -> bytes:
+        start = part_idx * self.part_size
+        end = min(self.size, start + self.part_size) - 1
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return self.s3_client.get_object(
+                    Bucket=self.bucket_name,
+                    Key=self.key,
+                    Range=f'bytes={start}-{end}',
+                    IfMatch=self.etag,
+                )['Body'].read()
+            except (botocore.exceptions.BotoCoreError, OSError) as e:
+                if attempt == self.max_attempts:
+                    raise
+                logger.warning(f'failed to read {self.key=} {start=} {end=} ({e}) - will retry')
+
+    def _schedule_parts(self):
+        while self._next_part < self._part_count and len(self._pending) < self._parts_in_flight:
+            self._pending.append(self._executor.submit(self._download_part, self._next_part))
+            self._next_part += 1
+
+    def _part_at(self, pos: int):
+        for offset, data in self._retrieved:
+            if offset <= pos < offset + len(data):
+                return offset, data
+
+        if not self._pending or self._retrieved and pos < self._retrieved[0][0]:
+            raise io.UnsupportedOperation(f'cannot read at {pos=} (out of rewind range)')
+
+        # parts are retrieved strictly in order - next pending part must contain pos
+        data = self._pending.popleft().result()
+        offset = self._next_offset
+        self._next_offset += len(data)
+        self._retrieved.append((offset, data))
+        self._schedule_parts()
+
+        return offset, data
+
+    def _release_consumed_parts(self):
+        while self._retrieved:
+            offset, data = self._retrieved[0]
+            if offset + len(data) > self._pos - self.rewind_bytes:
+                break
+            self._retrieved.popleft()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset: int, whence: int=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        elif whence != io.SEEK_SET:
+            raise ValueError(whence)
+
+        retained_from = self._retrieved[0][0] if self._retrieved else self._pos
+        if offset != self._pos and not retained_from <= offset < self._pos:
+            raise io.UnsupportedOperation(f'cannot seek to {offset=} (out of rewind range)')
+
+        self._pos = offset
+        return self._pos
+
+    def readinto(self, buf) -> int:
+        if self._pos >= self.size:
+            return 0
+
+        offset, data = self._part_at(self._pos)
+        start = self._pos - offset
+        length = min(len(buf), len(data) - start)
+        buf[:length] = data[start:start + length]
+
+        self._pos += length
+        self._release_consumed_parts()
+
+        return length
+
+    def read(self, size: int=-1) -> bytes:
+        '''
+        reads up to `size` bytes (all remaining bytes if negative). Less bytes are only returned
+        if the end of the object was reached.
+        '''
+        if size is None or size < 0:
+            size = self.size - self._pos
+
+        buf = bytearray(min(size, max(0, self.size - self._pos)))
+        view = memoryview(buf)
+        read = 0
+        while read < len(buf):
+            if not (n := self.readinto(view[read:])):
+                break
+            read += n
+
+        return bytes(buf[:read])
+
+    def close(self):
+        if not self.closed:
+            for future in self._pending:
+                future.cancel()
+            self._executor.shutdown(wait=False)
+            self._pending.clear()
+            self._retrieved.clear()
+        super().close()
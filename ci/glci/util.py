@@ -15,6 +15,8 @@ import botocore.exceptions
 import dacite
 import yaml
 
+import glci.manifest_cache
+import glci.manifest_codec
 import glci.model
 import paths
 
@@ -69,7 +71,7 @@ def cicd_cfg(
         cfg = dacite.from_dict(
             data_class=CicdCfg,
             data=raw,
-            config=dacite.Config(cast=[typing.Tuple]),
+            config=dacite.Config(cast=[glci.model.AwsSnapshotUploadMethod, typing.Tuple]),
         )
         if cfg.name == cfg_name:
             return cfg
@@ -107,51 +109,90 @@ def flavour_set(
         raise RuntimeError(f'not found: {flavour_set_name=}')
 
 
-def release_manifest(
+def _manifest_document(
     s3_client: 'botocore.client.S3',
     bucket_name: str,
     key: str,
+    etag: str=None,
     absent_ok: bool=False,
-) -> glci.model.OnlineReleaseManifest:
+    manifest_cache: typing.Optional[glci.manifest_cache.ManifestCache]=None,
+) -> typing.Optional[dict]:
     '''
-    retrieves and deserialises a gardenlinux release manifest from the specified s3 object
-    (expects a YAML or JSON document)
+    retrieves and parses the given manifest document (expects a YAML or JSON document)
+
+    if a manifest cache is passed, the document is only downloaded if it is not cached, yet, or
+    if the remote object was changed. If `etag` is passed (e.g. from a listing), a matching cache
+    entry is used w/o any request to S3.
     '''
-    buf = io.BytesIO()
+    cached = None
+    if manifest_cache:
+        cached = manifest_cache.get(bucket_name=bucket_name, key=key)
+        if cached and etag and cached.etag == etag:
+            return cached.document
+
+    conditional_args = {'IfNoneMatch': cached.etag} if cached else {}
+
     try:
-        s3_client.download_fileobj(
+        res = s3_client.get_object(
             Bucket=bucket_name,
             Key=key,
-            Fileobj=buf,
+            **conditional_args,
         )
     except botocore.exceptions.ClientError as e:
-        if absent_ok and str(e.response['Error']['Code']) == '404':
-            return None
+        error_code = str(e.response['Error']['Code'])
+        if cached and error_code == '304':
+            return cached.document
+        if error_code in ('404', 'NoSuchKey'):
+            if cached:
+                manifest_cache.remove(bucket_name=bucket_name, key=key)
+            if absent_ok:
+                return None
         raise e
 
-    buf.seek(0)
-    parsed = yaml.safe_load(buf)
+    parsed = glci.manifest_codec.parse_document(res['Body'].read())
 
-    # patch-in transient attrs
-    parsed['s3_key'] = key
-    parsed['s3_bucket'] = bucket_name
-    if not 'base_image' in parsed:
-        parsed['base_image'] = None
-
-    manifest = dacite.from_dict(
-        data_class=glci.model.OnlineReleaseManifest,
-        data=parsed,
-        config=dacite.Config(
-            cast=[
-                glci.model.Architecture,
-                typing.Tuple,
-                glci.model.TestResultCode,
-                glci.model.AzureTransportState,
-            ],
-        ),
+    if manifest_cache:
+        manifest_cache.put(
+            bucket_name=bucket_name,
+            key=key,
+            etag=res['ETag'],
+            document=parsed,
+        )
+
+    return parsed
+
+
+def release_manifest(
+    s3_client: 'botocore.client.S3',
+    bucket_name: str,
+    key: str,
+    absent_ok: bool=False,
+    etag: str=None,
+    manifest_cache: typing.Optional[glci.manifest_cache.ManifestCache]=None,
+) -> glci.model.OnlineReleaseManifest:
+    '''
+    retrieves and deserialises a gardenlinux release manifest from the specified s3 object
+    (expects a YAML or JSON document)
+
+    if no `manifest_cache` is passed, the default one is used (see `glci.manifest_cache`)
+    '''
+    parsed = _manifest_document(
+        s3_client=s3_client,
+        bucket_name=bucket_name,
+        key=key,
+        etag=etag,
+        absent_ok=absent_ok,
+        manifest_cache=manifest_cache or glci.manifest_cache.default_cache(),
     )
+    if parsed is None:
+        return None
 
-    return manifest
+    # patch-in transient attrs
+    return glci.manifest_codec.release_manifest_from_dict(
+        parsed,
+        s3_key=key,
+        s3_bucket=bucket_name,
+    )
 
 
 def release_manifest_set(
@@ -159,39 +200,26 @@ def release_manifest_set(
     bucket_name: str,
     manifest_key: str,
     absent_ok: bool=False,
+    etag: str=None,
+    manifest_cache: typing.Optional[glci.manifest_cache.ManifestCache]=None,
 ) -> glci.model.OnlineReleaseManifest:
-    buf = io.BytesIO()
-    try:
-        s3_client.download_fileobj(
-            Bucket=bucket_name,
-            Key=manifest_key,
-            Fileobj=buf,
-        )
-    except botocore.exceptions.ClientError as e:
-        if absent_ok and str(e.response['Error']['Code']) == '404':
-            return None
-        raise e
-
-    buf.seek(0)
-    parsed = yaml.safe_load(buf)
-
-    parsed['s3_bucket'] = bucket_name
-    parsed['s3_key'] = manifest_key
+    parsed = _manifest_document(
+        s3_client=s3_client,
+        bucket_name=bucket_name,
+        key=manifest_key,
+        etag=etag,
+        absent_ok=absent_ok,
+        manifest_cache=manifest_cache or glci.manifest_cache.default_cache(),
+    )
+    if parsed is None:
+        return None
 
     logger.debug(manifest_key)
-    manifest = dacite.from_dict(
-        data_class=glci.model.OnlineReleaseManifestSet,
-        data=parsed,
-        config=dacite.Config(
-            cast=[
-                glci.model.Architecture,
-                typing.Tuple,
-                glci.model.TestResultCode,
-                glci.model.AzureTransportState,
-            ],
-        ),
+    return glci.manifest_codec.release_manifest_set_from_dict(
+        parsed,
+        s3_key=manifest_key,
+        s3_bucket=bucket_name,
     )
-    return manifest
 
 
 def _json_serialisable_manifest(object: typing.Any):
@@ -216,16 +244,19 @@ def upload_release_manifest(
     bucket_name: str,
     key: str,
     manifest: glci.model.ReleaseManifest,
+    manifest_format: glci.manifest_codec.ManifestFormat=glci.manifest_codec.ManifestFormat.YAML,
 ):
-    manifest = _json_serialisable_manifest(object=manifest)
-    manifest_bytes = yaml.safe_dump(dataclasses.asdict(manifest)).encode('utf-8')
+    manifest_bytes = glci.manifest_codec.dump_document(
+        glci.manifest_codec.release_manifest_dict(manifest),
+        manifest_format=manifest_format,
+    )
     manifest_fobj = io.BytesIO(initial_bytes=manifest_bytes)
     return s3_client.upload_fileobj(
         Fileobj=manifest_fobj,
         Bucket=bucket_name,
         Key=key,
         ExtraArgs={
-            'ContentType': 'text/yaml',
+            'ContentType': manifest_format.content_type(),
             'ContentEncoding': 'utf-8',
         },
     )
@@ -236,11 +267,12 @@ def upload_release_manifest_set(
     bucket_name: str,
     key: str,
     manifest_set: glci.model.ReleaseManifestSet,
+    manifest_format: glci.manifest_codec.ManifestFormat=glci.manifest_codec.ManifestFormat.YAML,
 ):
-    manifests = [_json_serialisable_manifest(m) for m in manifest_set.manifests]
-    manifest_set = dataclasses.replace(manifest_set, manifests=manifests)
-
-    manifest_set_bytes = yaml.safe_dump(dataclasses.asdict(manifest_set)).encode('utf-8')
+    manifest_set_bytes = glci.manifest_codec.dump_document(
+        glci.manifest_codec.release_manifest_set_dict(manifest_set),
+        manifest_format=manifest_format,
+    )
     manifest_set_fobj = io.BytesIO(initial_bytes=manifest_set_bytes)
 
     return s3_client.upload_fileobj(
@@ -248,12 +280,49 @@ def upload_release_manifest_set(
         Bucket=bucket_name,
         Key=key,
         ExtraArgs={
-            'ContentType': 'text/yaml',
+            'ContentType': manifest_format.content_type(),
             'ContentEncoding': 'utf-8',
         },
     )
 
 
+def _list_object_pages(
+    s3_client: 'botocore.client.S3',
+    bucket_name: str,
+    prefix: str,
+    executor: concurrent.futures.Executor,
+) -> typing.Generator[dict, None, None]:
+    '''
+    yields all (non-empty) `list_objects_v2` result pages for the given prefix.
+
+    The next page is requested (using the given executor) before the current one is yielded, so
+    listing overlaps with processing of the current page.
+    '''
+    def list_page(continuation_token: str=None):
+        ctoken_args = {'ContinuationToken': continuation_token} \
+                if continuation_token \
+                else {}
+
+        return s3_client.list_objects_v2(
+            Bucket=bucket_name,
+            Prefix=prefix,
+            **ctoken_args,
+        )
+
+    next_page = executor.submit(list_page)
+    while next_page:
+        res = next_page.result()
+        if res['KeyCount'] == 0:
+            return
+
+        if bool(res['IsTruncated']):
+            next_page = executor.submit(list_page, res.get('NextContinuationToken'))
+        else:
+            next_page = None
+
+        yield res
+
+
 def enumerate_releases(
     s3_client: 'botocore.client.S3',
     bucket_name: str,
@@ -266,33 +335,38 @@ def enumerate_releases(
         bucket_name=bucket_name,
     )
 
-    continuation_token = None
-    while True:
-        ctoken_args = {'ContinuationToken': continuation_token} \
-                if continuation_token \
-                else {}
+    def wrap_release_manifest(obj_dict):
+        return _release_manifest(key=obj_dict['Key'], etag=obj_dict.get('ETag'))
 
-        res = s3_client.list_objects_v2(
-            Bucket=bucket_name,
-            Prefix=prefix,
-            **ctoken_args,
-        )
-        if (key_count := res['KeyCount']) == 0:
-            return
-        is_truncated = bool(res['IsTruncated'])
-        continuation_token = res.get('NextContinuationToken')
+    for res in _list_object_pages(
+        s3_client=s3_client,
+        bucket_name=bucket_name,
+        prefix=prefix,
+        executor=executor,
+    ):
+        logger.info(f'found {res["KeyCount"]} release manifests')
+
+        yield from executor.map(wrap_release_manifest, res['Contents'])
 
-        logger.info(f'found {key_count} release manifests')
 
-        def wrap_release_manifest(key):
-            return _release_manifest(key=key)
+def _matches_release_identifier(
+    manifest: glci.model.OnlineReleaseManifest,
+    release_identifier: glci.model.ReleaseIdentifier,
+) -> bool:
+    normalised = glci.model.normalised_release_identifier
 
-        keys = [obj_dict['Key'] for obj_dict in res['Contents']]
+    if (found_ri := normalised(manifest.release_identifier())) \
+        == (searched_ri := normalised(release_identifier)):
+        return True
 
-        yield from executor.map(wrap_release_manifest, keys)
+    # warn about not matching expected contents from canonical name
+    logger.warning(f'{manifest.s3_key=} contained unexpected contents:')
+    logger.warning('this is the release-identifier we searched for:')
+    logger.warning(pprint.pformat(dataclasses.asdict(searched_ri)))
+    logger.warning('this is the release-identifier we found:')
+    logger.warning(pprint.pformat(dataclasses.asdict(found_ri)))
 
-        if not is_truncated:
-            return
+    return False
 
 
 def find_release(
@@ -301,7 +375,6 @@ def find_release(
     release_identifier: glci.model.ReleaseIdentifier,
     prefix: str=glci.model.ReleaseManifest.manifest_key_prefix,
 ) -> typing.Optional[glci.model.OnlineReleaseManifest]:
-    normalised = glci.model.normalised_release_identifier
     release_manifest_key = release_identifier.canonical_release_manifest_key()
 
     manifest = release_manifest(
@@ -314,18 +387,10 @@ def find_release(
     if not manifest:
         return None
 
-    if (found_ri := normalised(manifest.release_identifier())) \
-        == (searched_ri := normalised(release_identifier)):
+    if _matches_release_identifier(manifest=manifest, release_identifier=release_identifier):
         return manifest
-    else:
-        # warn about not matching expected contents from canonical name
-        logger.warning(f'{release_manifest_key=} contained unexpected contents:')
-        logger.warning('this is the release-identifier we searched for:')
-        logger.warning(pprint.pformat(dataclasses.asdict(searched_ri)))
-        logger.warning('this is the release-identifier we found:')
-        logger.warning(pprint.pformat(dataclasses.asdict(found_ri)))
 
-        return None
+    return None
 
 
 def find_releases(
@@ -336,10 +401,22 @@ def find_releases(
     version: str,
     gardenlinux_epoch: int,
     prefix: str=glci.model.ReleaseManifest.manifest_key_prefix,
+    max_workers: int=16,
 ) -> typing.Generator[glci.model.OnlineReleaseManifest, None, None]:
-    flavours = set(flavour_set.flavours())
+    '''
+    yields the existing release manifests for all flavours of the given flavour set.
+
+    Canonical manifest keys are calculated for all flavours upfront. Existing keys are then
+    determined using one listing per platform (of the longest common prefix of the platform's
+    keys, concurrently), and existing manifests are retrieved concurrently (the ETags from
+    listing allow for using cached manifests w/o any further request).
 
-    for flavour in flavours:
+    Canonical manifest keys do not contain the architecture, so flavours differing only in
+    architecture share one key (the manifest stored there is yielded if it matches any of them).
+    '''
+    release_identifiers = {} # {key: [release_identifier, ..]}
+    keys_by_platform = {} # {platform: [key, ..]}
+    for flavour in set(flavour_set.flavours()):
         release_identifier = glci.model.ReleaseIdentifier(
             build_committish=build_committish,
             version=version,
@@ -348,16 +425,58 @@ def find_releases(
             platform=flavour.platform,
             modifiers=flavour.modifiers,
         )
+        key = f'{prefix}/{release_identifier.canonical_release_manifest_key_suffix()}'
+        if not key in release_identifiers:
+            keys_by_platform.setdefault(flavour.platform, []).append(key)
+        release_identifiers.setdefault(key, []).append(release_identifier)
 
-        existing_release = find_release(
+    if not release_identifiers:
+        return
+
+    def find_existing_release(key: str):
+        manifest = release_manifest(
+            s3_client=s3_client,
+            bucket_name=bucket_name,
+            key=key,
+            etag=existing_etags[key],
+            absent_ok=True,
+        )
+        if manifest and any(
+            _matches_release_identifier(
+                manifest=manifest,
+                release_identifier=release_identifier,
+            ) for release_identifier in release_identifiers[key]
+        ):
+            return manifest
+        return None
+
+    def list_existing_etags(keys: typing.List[str]) -> dict:
+        existing_etags = {} # {key: etag}
+        for res in _list_object_pages(
             s3_client=s3_client,
             bucket_name=bucket_name,
-            release_identifier=release_identifier,
-            prefix=prefix,
+            prefix=os.path.commonprefix(keys),
+            executor=page_executor,
+        ):
+            for obj_dict in res['Contents']:
+                if (key := obj_dict['Key']) in release_identifiers:
+                    existing_etags[key] = obj_dict.get('ETag')
+        return existing_etags
+
+    # listings prefetch their next page using a separate pool (listings block on those)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor, \
+         concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as page_executor:
+        existing_etags = {} # {key: etag}
+        for etags in executor.map(list_existing_etags, keys_by_platform.values()):
+            existing_etags.update(etags)
+
+        logger.info(
+            f'found {len(existing_etags)} of {len(release_identifiers)} release manifests'
         )
 
-        if existing_release:
-            yield existing_release
+        for manifest in executor.map(find_existing_release, existing_etags):
+            if manifest:
+                yield manifest
 
 
 def release_set_manifest_name(
@@ -382,6 +501,28 @@ def release_set_manifest_name(
     return name
 
 
+def _is_directory_marker(
+    s3_client: 'botocore.client.S3',
+    bucket_name: str,
+    obj_dict: dict,
+) -> bool:
+    '''
+    determines whether the given listed object is a "directory" (as e.g. created by s3fs).
+
+    This is decided from listing data alone, if possible. Only empty objects w/o trailing slash
+    are ambiguous (and thus looked up using HEAD).
+    '''
+    if obj_dict['Key'].endswith('/'):
+        return True
+    if obj_dict.get('Size', 0) > 0:
+        return False
+
+    return s3_client.head_object(
+        Bucket=bucket_name,
+        Key=obj_dict['Key'],
+    )['ContentType'] == 'application/x-directory'
+
+
 def enumerate_release_sets(
     s3_client: 'botocore.client.S3',
     bucket_name: str,
@@ -394,40 +535,31 @@ def enumerate_release_sets(
         bucket_name=bucket_name,
     )
 
-    continuation_token = None
-    while True:
-        ctoken_args = {'ContinuationToken': continuation_token} \
-                if continuation_token \
-                else {}
+    def wrap_release_manifest_set(obj_dict):
+      return _release_manifest_set(
+          manifest_key=obj_dict['Key'],
+          etag=obj_dict.get('ETag'),
+      )
 
-        res = s3_client.list_objects_v2(
-            Bucket=bucket_name,
-            Prefix=prefix,
-            **ctoken_args,
-        )
-        if (key_count := res['KeyCount']) == 0:
-            return
-        is_truncated = bool(res['IsTruncated'])
-        continuation_token = res.get('NextContinuationToken')
-
-        logger.info(f'found {key_count} release manifests')
+    for res in _list_object_pages(
+        s3_client=s3_client,
+        bucket_name=bucket_name,
+        prefix=prefix,
+        executor=executor,
+    ):
+        logger.info(f'found {res["KeyCount"]} release manifests')
 
-        keys = [
-            key for obj_dict in res['Contents']
+        obj_dicts = [
+            obj_dict for obj_dict in res['Contents']
             # filter out directories
-            if s3_client.head_object(
-              Bucket=bucket_name,
-              Key=(key := obj_dict['Key']),
-            )['ContentType'] != 'application/x-directory'
+            if not _is_directory_marker(
+                s3_client=s3_client,
+                bucket_name=bucket_name,
+                obj_dict=obj_dict,
+            )
         ]
 
-        def wrap_release_manifest_set(key):
-          return _release_manifest_set(manifest_key=key)
-
-        yield from executor.map(wrap_release_manifest_set, keys)
-
-        if not is_truncated:
-            return
+        yield from executor.map(wrap_release_manifest_set, obj_dicts)
 
 
 def find_release_set(
@@ -0,0 +1,308 @@
+'''
+a shared engine for waiting on long-running (cloud) operations
+
+Operations are awaited on one asyncio event loop (instead of using one sleeping thread per
+operation). Status retrieval is delegated to `StatusFetcher`s, which are called from a (bounded)
+thread-pool, as the underlying cloud-sdks are blocking. Where an API allows querying the status of
+multiple operations at once, fetchers may declare a `max_batch_size`, in which case due polls are
+combined into one call.
+'''
+import asyncio
+import concurrent.futures
+import dataclasses
+import logging
+import random
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+Key = typing.Hashable
+Status = typing.Any
+
+
+class WaitFailedError(RuntimeError):
+    '''
+    raised if an operation reached a failure state
+    '''
+    def __init__(self, key: Key, status: Status):
+        self.key = key
+        self.status = status
+        super().__init__(f'{key=}: {status=}')
+
+
+class WaitTimeoutError(TimeoutError):
+    '''
+    raised if an operation did not reach a final state before its deadline
+    '''
+    def __init__(self, key: Key, status: Status, timeout_seconds: float):
+        self.key = key
+        self.status = status
+        self.timeout_seconds = timeout_seconds
+        super().__init__(f'{key=} did not finish within {timeout_seconds=} ({status=})')
+
+
+@dataclasses.dataclass(frozen=True)
+class Backoff:
+    '''
+    jittered exponential backoff: the n-th interval is `initial_seconds * factor ** n` (capped at
+    `max_seconds`), randomly shortened by up to `jitter` (fraction of the interval)
+    '''
+    initial_seconds: float = 5
+    max_seconds: float = 60
+    factor: float = 1.5
+    jitter: float = 0.2
+
+    def interval(self, attempt: int) -> float:
+        interval = min(self.max_seconds, self.initial_seconds * self.factor ** attempt)
+        return interval * (1 - random.uniform(0, self.jitter))
+
+
+@dataclasses.dataclass(frozen=True, eq=False) # fetchers are compared by identity
+class StatusFetcher:
+    '''
+    retrieves the status of (pending) operations
+
+    @param fetch: callable accepting a sequence of keys, returning {key: status}. Keys missing
+                  from the result are considered to still be pending
+    @param is_done: callable returning whether a status is the (successful) final one
+    @param is_failed: callable returning whether a status is a failure state
+    @param max_batch_size: max amount of keys to pass to `fetch` at once
+    '''
+    name: str
+    fetch: typing.Callable[[typing.Sequence[Key]], typing.Dict[Key, Status]]
+    is_done: typing.Callable[[Status], bool]
+    is_failed: typing.Callable[[Status], bool] = lambda status: False
+    max_batch_size: int = 1
+
+
+@dataclasses.dataclass(frozen=True)
+class PendingOperation:
+    key: Key
+    fetcher: StatusFetcher
+    timeout_seconds: typing.Optional[float] = None
+    backoff: Backoff = Backoff()
+
+
+@dataclasses.dataclass(frozen=True)
+class WaitResult:
+    '''
+    the final status of an awaited operation, plus timing metrics. If waiting was not done in
+    fail-fast mode, `error` is set for failed operations
+    '''
+    key: Key
+    fetcher_name: str
+    status: Status
+    polls: int
+    elapsed_seconds: float
+    error: typing.Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class _Batcher:
+    '''
+    combines concurrently due polls for one fetcher into (batched) calls to `fetch`
+    '''
+    def __init__(self, fetcher: StatusFetcher, executor: concurrent.futures.Executor):
+        self.fetcher = fetcher
+        self.executor = executor
+        self._queued = {} # {key: [future, ..]}
+        self._flush_scheduled = False
+        self._flushes = set()
+
+    def status(self, key: Key) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queued.setdefault(key, []).append(future)
+
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            # defer to let other operations that are due at the same time join the batch
+            loop.call_soon(self._schedule_flush)
+
+        return future
+
+    def _schedule_flush(self):
+        task = asyncio.ensure_future(self._flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self):
+        queued, self._queued = self._queued, {}
+        self._flush_scheduled = False
+
+        keys = list(queued)
+        batch_size = max(1, self.fetcher.max_batch_size)
+        batches = [keys[i:i + batch_size] for i in range(0, len(keys), batch_size)]
+
+        await asyncio.gather(*(self._fetch(batch, queued) for batch in batches))
+
+    async def _fetch(self, keys: typing.List[Key], queued: dict):
+        loop = asyncio.get_running_loop()
+        try:
+            statuses = await loop.run_in_executor(self.executor, self.fetcher.fetch, keys)
+        except Exception as e:
+            for key in keys:
+                for future in queued[key]:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        for key in keys:
+            for future in queued[key]:
+                if not future.done():
+                    future.set_result(statuses.get(key))
+
+
+async def _wait_for_operation(
+    operation: PendingOperation,
+    batcher: _Batcher,
+    fail_fast: bool=True,
+) -> WaitResult:
+    key = operation.key
+    fetcher = operation.fetcher
+    started = time.monotonic()
+    polls = 0
+    status = None
+
+    while True:
+        try:
+            status = await batcher.status(key)
+        except Exception as e:
+            if fail_fast:
+                raise
+            error = e
+        else:
+            error = None
+        polls += 1
+        elapsed_seconds = time.monotonic() - started
+
+        if not error and status is not None:
+            if fetcher.is_failed(status):
+                error = WaitFailedError(key=key, status=status)
+            elif fetcher.is_done(status):
+                logger.info(
+                    f'{key=} ({fetcher.name}) reached {status=} after '
+                    f'{elapsed_seconds:.0f}s ({polls=})'
+                )
+                return WaitResult(
+                    key=key,
+                    fetcher_name=fetcher.name,
+                    status=status,
+                    polls=polls,
+                    elapsed_seconds=elapsed_seconds,
+                )
+
+        timeout_seconds = operation.timeout_seconds
+        if not error and timeout_seconds is not None and timeout_seconds <= elapsed_seconds:
+            error = WaitTimeoutError(key=key, status=status, timeout_seconds=timeout_seconds)
+
+        if error:
+            if fail_fast:
+                raise error
+            logger.warning(f'{key=} ({fetcher.name}) failed after {elapsed_seconds:.0f}s: {error}')
+            return WaitResult(
+                key=key,
+                fetcher_name=fetcher.name,
+                status=status,
+                polls=polls,
+                elapsed_seconds=elapsed_seconds,
+                error=error,
+            )
+
+        interval = operation.backoff.interval(attempt=polls - 1)
+        if timeout_seconds is not None:
+            # poll one last time right at the deadline
+            interval = min(interval, timeout_seconds - elapsed_seconds)
+
+        logger.debug(f'{key=} ({fetcher.name}): {status=} - next poll in {interval:.0f}s')
+        await asyncio.sleep(interval)
+
+
+async def wait_async(
+    operations: typing.Iterable[PendingOperation],
+    max_workers: int=16,
+    fail_fast: bool=True,
+) -> typing.Tuple[WaitResult, ...]:
+    '''
+    waits until all of the given operations finished. Results are returned in the order the
+    operations were passed in.
+
+    If `fail_fast` is set, and any operation fails (or times out), all other waits are
+    cancelled, and the error is re-raised. Otherwise, all operations are awaited, and errors are
+    reported through `WaitResult.error`.
+    '''
+    operations = tuple(operations)
+    if not operations:
+        return ()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        batchers = {}
+        for operation in operations:
+            if not operation.fetcher in batchers:
+                batchers[operation.fetcher] = _Batcher(fetcher=operation.fetcher, executor=executor)
+
+        tasks = [
+            asyncio.ensure_future(
+                _wait_for_operation(
+                    operation=operation,
+                    batcher=batchers[operation.fetcher],
+                    fail_fast=fail_fast,
+                )
+            ) for operation in operations
+        ]
+        try:
+            return tuple(await asyncio.gather(*tasks))
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def wait(
+    operations: typing.Iterable[PendingOperation],
+    max_workers: int=16,
+    fail_fast: bool=True,
+) -> typing.Tuple[WaitResult, ...]:
+    '''
+    blocking variant of `wait_async` (runs a dedicated event loop)
+    '''
+    return asyncio.run(
+        wait_async(operations=operations, max_workers=max_workers, fail_fast=fail_fast)
+    )
+
+
+def wait_for(
+    key: Key,
+    fetcher: StatusFetcher,
+    timeout_seconds: float=None,
+    backoff: Backoff=Backoff(),
+) -> WaitResult:
+    '''
+    convenience function for waiting on a single operation
+    '''
+    return wait(
+        operations=(
+            PendingOperation(
+                key=key,
+                fetcher=fetcher,
+                timeout_seconds=timeout_seconds,
+                backoff=backoff,
+            ),
+        ),
+        max_workers=1,
+    )[0]
+
+
+def single_fetch(
+    fetch_one: typing.Callable[[Key], Status],
+) -> typing.Callable[[typing.Sequence[Key]], typing.Dict[Key, Status]]:
+    '''
+    adapts a callable retrieving the status of one operation to the `StatusFetcher.fetch` signature
+    '''
+    def fetch(keys: typing.Sequence[Key]):
+        return {key: fetch_one(key) for key in keys}
+
+    return fetch
@@ -1,9 +1,13 @@
+import concurrent.futures
 import contextlib
 import dataclasses
 import datetime
 import json
 import logging
 import os
+import subprocess
+import typing
+import xml.etree.ElementTree
 from string import Template
 
 from _pytest.config import ExitCode
@@ -53,6 +57,16 @@ class PyTestParamsPlugin:
         return self.params
 
 
+def pytest_main_from_params_file(params_file: str, pytest_args: typing.Sequence[str]):
+    '''
+    entry point of the pytest subprocesses started by `run_flavour_tests` (`pytest.main` cannot
+    be run repeatedly, let alone concurrently, in one process)
+    '''
+    with open(params_file) as f:
+        params = TestRunParameters(**json.load(f))
+    return pytest.main(list(pytest_args), plugins=[PyTestParamsPlugin(params)])
+
+
 @contextlib.contextmanager
 def pushd(new_dir):
     previous_dir = os.getcwd()
@@ -166,17 +180,266 @@ def run_tests(
             result = ExitCode.OK
 
     # Store result for later upload in manifest in file
-    test_results = glci.model.ReleaseTestResult(
+    _write_test_result(
+        outfile_name=os.path.join(repo_dir, 'test_results.json'),
         test_suite_cfg_name=pytest_cfg,
-        test_result=glci.model.TestResultCode.OK if result == ExitCode.OK else
-            glci.model.TestResultCode.FAILED,
+        ok=result == ExitCode.OK,
+    )
+
+    return result
+
+
+def _write_test_result(
+    outfile_name: str,
+    test_suite_cfg_name: str,
+    ok: bool,
+) -> glci.model.ReleaseTestResult:
+    test_results = glci.model.ReleaseTestResult(
+        test_suite_cfg_name=test_suite_cfg_name,
+        test_result=glci.model.TestResultCode.OK if ok else glci.model.TestResultCode.FAILED,
         test_timestamp=datetime.datetime.now().isoformat(),
     )
 
-    outfile_name = os.path.join(repo_dir, 'test_results.json')
     logger.info(f'Test results written to {outfile_name}')
-
     with open(outfile_name, 'w') as f:
         json.dump(dataclasses.asdict(glci.util._json_serialisable_manifest(test_results)), f)
 
-    return result
+    return test_results
+
+
+def _flavour_name(flavour: glci.model.GardenlinuxFlavour) -> str:
+    return f'{flavour.architecture.value}-{flavour.filename_prefix()}'
+
+
+def _merge_junit_reports(report_paths: typing.Iterable[str], outfile_name: str):
+    '''
+    merges the test suites from the given junit reports into one report. Missing reports (from
+    runs that failed before writing one) are ignored
+    '''
+    merged = xml.etree.ElementTree.Element('testsuites')
+    totals = {'tests': 0, 'failures': 0, 'errors': 0, 'skipped': 0}
+    duration = 0.0
+
+    for report_path in report_paths:
+        if not os.path.exists(report_path):
+            logger.warning(f'no junit report at {report_path}')
+            continue
+        root = xml.etree.ElementTree.parse(report_path).getroot()
+        for suite in ([root] if root.tag == 'testsuite' else root.findall('testsuite')):
+            for attr in totals:
+                totals[attr] += int(suite.get(attr, 0))
+            duration += float(suite.get('time', 0))
+            merged.append(suite)
+
+    for attr, value in totals.items():
+        merged.set(attr, str(value))
+    merged.set('time', f'{duration:.3f}')
+
+    xml.etree.ElementTree.ElementTree(merged).write(
+        outfile_name,
+        encoding='utf-8',
+        xml_declaration=True,
+    )
+
+
+def _run_target(
+    flavour: glci.model.GardenlinuxFlavour,
+    iaas: str,
+    image: typing.Optional[str],
+    params: TestRunParameters,
+    pytest_args: typing.Sequence[str],
+    target_index: int,
+    workers_per_target: int,
+    run_dir: str,
+    repo_dir: str,
+) -> int:
+    '''
+    runs the tests for one flavour on one fixture backend in a pytest subprocess. With
+    `workers_per_target` > 1, tests are sharded across xdist workers, each of which provisions
+    (and is bound to) its own target
+    '''
+    params_file = os.path.join(run_dir, f'{iaas}.params.json')
+    with open(params_file, 'w') as f:
+        json.dump(vars(params), f)
+
+    features = (flavour.platform,) + glci.model.normalised_modifiers(
+        platform=flavour.platform,
+        modifiers=flavour.modifiers,
+    )
+    args = [
+        *pytest_args,
+        f'--iaas={iaas}',
+        f'--features={",".join(features)}',
+        f'--target-index={target_index}',
+        f'--junitxml={os.path.join(run_dir, f"{iaas}.xml")}',
+        '-o', f'junit_suite_name={iaas}',
+        '-o', f'log_file={os.path.join(run_dir, f"{iaas}.log")}',
+        # concurrent runs would race on the (shared) cache directory
+        '-p', 'no:cacheprovider',
+    ]
+    if image:
+        args.append(f'--image={image}')
+    if workers_per_target > 1:
+        args.extend(('-n', str(workers_per_target)))
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in (
+            os.path.join(repo_dir, 'ci', 'steps'),
+            os.path.join(repo_dir, 'ci'),
+            env.get('PYTHONPATH'),
+        ) if p
+    )
+
+    name = _flavour_name(flavour)
+    logger.info(f'{name}: running tests on {iaas=} with pytest args: {args}')
+    with open(os.path.join(run_dir, f'{iaas}.out'), 'w') as output:
+        result = subprocess.run(
+            [
+                sys.executable, '-c',
+                'import sys, run_tests; '
+                'sys.exit(run_tests.pytest_main_from_params_file(sys.argv[1], sys.argv[2:]))',
+                params_file,
+                *args,
+            ],
+            cwd=os.path.join(repo_dir, 'tests'),
+            env=env,
+            stdout=output,
+            stderr=subprocess.STDOUT,
+        )
+    logger.info(f'{name}: tests on {iaas=} finished with {result.returncode=}')
+
+    return result.returncode
+
+
+def _flavour_images(
+    flavours: typing.Sequence[glci.model.GardenlinuxFlavour],
+    backends: typing.Dict[str, typing.Optional[str]],
+) -> typing.Dict[typing.Tuple[str, str], typing.Optional[str]]:
+    '''
+    renders the image templates, returning {(flavour name, iaas): image}. Raises ValueError if a
+    template yields the same image for different flavours (which would then be tested in place of
+    each other)
+    '''
+    images = {}
+    for iaas, template in backends.items():
+        tested_flavours = {}
+        for flavour in flavours:
+            name = _flavour_name(flavour)
+            if not template:
+                images[(name, iaas)] = None
+                continue
+            image = Template(template).substitute(
+                flavour=name,
+                architecture=flavour.architecture.value,
+                platform=flavour.platform,
+            )
+            if (other := tested_flavours.setdefault(image, name)) != name:
+                raise ValueError(
+                    f'{iaas=}: {template=} yields {image=} for flavours {other} and {name}'
+                )
+            images[(name, iaas)] = image
+
+    return images
+
+
+def run_flavour_tests(
+    flavour_set_name: str,
+    backends: typing.Dict[str, typing.Optional[str]],
+    repo_dir: str,
+    cicd_cfg_name: str=None,
+    gardenlinux_epoch: str=None,
+    build_targets: str='tests',
+    suite: str=None,
+    snapshot_timestamp: str=None,
+    version: str=None,
+    committish: str=None,
+    test_suite_cfg_name: str='default',
+    pytest_args: typing.Sequence[str]=(),
+    max_targets: int=4,
+    workers_per_target: int=1,
+    out_dir: str=None,
+) -> typing.Dict[str, glci.model.ReleaseTestResult]:
+    '''
+    tests all flavours of the given flavour set on each of the given fixture backends (e.g.
+    chroot, kvm, or manual as a stand-in for a cloud target), running the test sessions
+    concurrently.
+
+    @param backends: {iaas: image}, where image is a template (`$flavour`, `$architecture`,
+                     `$platform`) for the image to test, or None if the backend does not need one
+                     (targets are configured in tests/test_config.yaml, or the `--configfile`
+                     passed in `pytest_args`)
+    @param max_targets: max amount of targets provisioned at the same time
+    @param workers_per_target: amount of xdist workers (and thus targets) per test session, the
+                               tests of a session are sharded across them (requires pytest-xdist)
+
+    Results are written to `out_dir` (default: <repo_dir>/test_results): per flavour, one merged
+    junit report (<flavour>.xml) and one `ReleaseTestResult` (<flavour>.json, same format as
+    written by `run_tests`), which is OK only if the tests passed on all backends. Output of the
+    individual sessions is kept in <out_dir>/<flavour>/.
+    '''
+    flavours = tuple(glci.util.flavour_set(flavour_set_name=flavour_set_name).flavours())
+    out_dir = os.path.abspath(out_dir or os.path.join(repo_dir, 'test_results'))
+    repo_dir = os.path.abspath(repo_dir)
+    workers_per_target = max(1, workers_per_target)
+    max_sessions = max(1, max_targets // workers_per_target)
+
+    logger.info(
+        f'testing {len(flavours)} flavours of {flavour_set_name=} on {tuple(backends)} '
+        f'({max_sessions=}, {workers_per_target=})'
+    )
+
+    images = _flavour_images(flavours=flavours, backends=backends)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_sessions) as executor:
+        futures = {}
+        target_index = 0
+        for flavour in flavours:
+            name = _flavour_name(flavour)
+            run_dir = os.path.join(out_dir, name)
+            os.makedirs(run_dir, exist_ok=True)
+            params = TestRunParameters(
+                architecture=flavour.architecture.value,
+                cicd_cfg_name=cicd_cfg_name,
+                gardenlinux_epoch=gardenlinux_epoch,
+                modifiers=tuple(flavour.modifiers),
+                platform=flavour.platform,
+                build_targets=build_targets,
+                repo_dir=repo_dir,
+                suite=suite,
+                snapshot_timestamp=snapshot_timestamp,
+                version=version,
+                committish=committish,
+            )
+            for iaas in backends:
+                futures[(name, iaas)] = executor.submit(
+                    _run_target,
+                    flavour=flavour,
+                    iaas=iaas,
+                    image=images[(name, iaas)],
+                    params=params,
+                    pytest_args=pytest_args,
+                    # each session gets distinct targets (ports, keys), see tests/conftest.py
+                    target_index=target_index,
+                    workers_per_target=workers_per_target,
+                    run_dir=run_dir,
+                    repo_dir=repo_dir,
+                )
+                target_index += workers_per_target
+
+        results = {key: future.result() for key, future in futures.items()}
+
+    test_results = {}
+    for flavour in flavours:
+        name = _flavour_name(flavour)
+        _merge_junit_reports(
+            report_paths=(os.path.join(out_dir, name, f'{iaas}.xml') for iaas in backends),
+            outfile_name=os.path.join(out_dir, f'{name}.xml'),
+        )
+        test_results[name] = _write_test_result(
+            outfile_name=os.path.join(out_dir, f'{name}.json'),
+            test_suite_cfg_name=test_suite_cfg_name,
+            ok=all(results[(name, iaas)] == ExitCode.OK for iaas in backends),
+        )
+
+    return test_results
@@ -1,3 +1,4 @@
+import concurrent.futures
 import dataclasses
 import datetime
 import hashlib
@@ -5,6 +6,10 @@ import os
 import pprint
 import sys
 import logging
+import threading
+
+import botocore.config
+import botocore.exceptions
 
 import glci.model
 import glci.util
@@ -20,37 +25,186 @@ parsable_to_int = str
 logger = logging.getLogger(__name__)
 
 
+def _object_exists(
+    s3_client,
+    s3_bucket_name: str,
+    key: str,
+    size: int,
+) -> bool:
+    try:
+        head = s3_client.head_object(Bucket=s3_bucket_name, Key=key)
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+    return head['ContentLength'] == size
+
+
+def _upload_small_file(
+    full_path: str,
+    s3_client,
+    s3_bucket_name: str,
+) -> str:
+    '''
+    uploads the given file to `objects/<sha1-digest>`, unless an object of same size already
+    exists with that key (objects are content-addressed, so it must have been uploaded before,
+    e.g. by a previous run of the same build). The file is read into memory only once.
+    '''
+    with open(full_path, 'rb') as fobj:
+        data = fobj.read()
+
+    upload_key = os.path.join('objects', hashlib.sha1(data).hexdigest())
+
+    if _object_exists(
+        s3_client=s3_client,
+        s3_bucket_name=s3_bucket_name,
+        key=upload_key,
+        size=len(data),
+    ):
+        logger.info(f'{upload_key=} already exists - skipping upload of {full_path}')
+        return upload_key
+
+    # XXX todo: add content-type
+    s3_client.put_object(
+        Body=data,
+        Bucket=s3_bucket_name,
+        Key=upload_key,
+    )
+    logger.info(f'upload succeeded: {upload_key} ({full_path=}, size={len(data)})')
+    return upload_key
+
+
+def _file_sha1(full_path: str, chunk_size: int) -> str:
+    sha1 = hashlib.sha1()
+    with open(full_path, 'rb', buffering=0) as fobj:
+        while (data := fobj.read(chunk_size)):
+            sha1.update(data)
+    return sha1.hexdigest()
+
+
+def _upload_large_file(
+    full_path: str,
+    s3_client,
+    s3_bucket_name: str,
+    part_executor: concurrent.futures.Executor,
+    part_size: int,
+    max_parts_in_flight: int,
+) -> str:
+    '''
+    computes the given file's sha1-digest, and uploads it (as concurrent multipart upload) to
+    `objects/<sha1-digest>`, unless an object of same size already exists with that key. Thus,
+    files uploaded before (e.g. by a previous run of the same build) are only read locally.
+    '''
+    size = os.path.getsize(full_path)
+    upload_key = os.path.join('objects', _file_sha1(full_path=full_path, chunk_size=part_size))
+
+    if _object_exists(
+        s3_client=s3_client,
+        s3_bucket_name=s3_bucket_name,
+        key=upload_key,
+        size=size,
+    ):
+        logger.info(f'{upload_key=} already exists ({size=}) - skipping upload of {full_path}')
+        return upload_key
+
+    # XXX todo: add content-type
+    upload_id = s3_client.create_multipart_upload(
+        Bucket=s3_bucket_name,
+        Key=upload_key,
+    )['UploadId']
+
+    def upload_part(part_number: int, data: bytes) -> dict:
+        res = s3_client.upload_part(
+            Bucket=s3_bucket_name,
+            Key=upload_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        return {'PartNumber': part_number, 'ETag': res['ETag']}
+
+    in_flight = threading.BoundedSemaphore(max_parts_in_flight)
+    futures = []
+    try:
+        with open(full_path, 'rb', buffering=0) as fobj:
+            part_number = 1
+            while (data := fobj.read(part_size)):
+                # bound memory consumption (reading is typically faster than uploading)
+                in_flight.acquire()
+                future = part_executor.submit(upload_part, part_number, data)
+                future.add_done_callback(lambda _: in_flight.release())
+                futures.append(future)
+                part_number += 1
+
+        s3_client.complete_multipart_upload(
+            Bucket=s3_bucket_name,
+            Key=upload_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': [future.result() for future in futures]},
+        )
+    except:
+        for future in futures:
+            future.cancel()
+        s3_client.abort_multipart_upload(
+            Bucket=s3_bucket_name,
+            Key=upload_key,
+            UploadId=upload_id,
+        )
+        raise
+
+    logger.info(f'upload succeeded: {upload_key} ({full_path=}, {size=})')
+    return upload_key
+
+
 def upload_files(
     build_result_fname,
     version_str,
     s3_client,
     s3_bucket_name,
+    max_workers: int=4,
+    max_part_workers: int=16,
+    part_size: int=16 * 1024 * 1024,
+    max_parts_in_flight: int=8,
 ):
-    for dirpath, dirs, files in os.walk(build_result_fname):
-        for file in files:
-            full_path = os.path.join(dirpath, file)
-            fname = f'{version_str}-{file}'
-
-            with open(full_path, "rb") as fobj:
-                # calculate filehash (use as fname)
-                sha1 = hashlib.sha1()
-                while (chunk := fobj.read(2048)):
-                    sha1.update(chunk)
-                fobj.seek(0)
-                sha1_digest = sha1.hexdigest()
-                upload_key = os.path.join('objects', sha1_digest)
-
-                # XXX todo: add content-type
-                s3_client.upload_fileobj(
-                  Fileobj=fobj,
-                  Bucket=s3_bucket_name,
-                  Key=upload_key,
+    '''
+    uploads all files from the given build-result directory. Yields release files in
+    directory-walk order.
+
+    Up to `max_workers` files are processed concurrently. Files larger than `part_size` are
+    uploaded as multipart-uploads (see `_upload_large_file`), sharing a pool of `max_part_workers`
+    threads (thus the s3_client should allow for as many pooled connections).
+    '''
+    full_paths = [
+        os.path.join(dirpath, file)
+        for dirpath, dirs, files in os.walk(build_result_fname)
+        for file in files
+    ]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_part_workers) as part_executor, \
+         concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def upload_file(full_path: str) -> str:
+            if os.path.getsize(full_path) <= part_size:
+                return _upload_small_file(
+                    full_path=full_path,
+                    s3_client=s3_client,
+                    s3_bucket_name=s3_bucket_name,
                 )
+            return _upload_large_file(
+                full_path=full_path,
+                s3_client=s3_client,
+                s3_bucket_name=s3_bucket_name,
+                part_executor=part_executor,
+                part_size=part_size,
+                max_parts_in_flight=max_parts_in_flight,
+            )
 
-            logger.info(f'upload succeeded: {upload_key}')
+        upload_keys = executor.map(upload_file, full_paths)
+
+        for full_path, upload_key in zip(full_paths, upload_keys):
+            file = os.path.basename(full_path)
             yield glci.model.S3_ReleaseFile(
-                name=fname,
-                suffix=os.path.basename(full_path),
+                name=f'{version_str}-{file}',
+                suffix=file,
                 s3_key=upload_key,
                 s3_bucket_name=s3_bucket_name,
             )
@@ -89,7 +243,11 @@ def upload_results_step(
         sys.exit(1)
 
     cicd_cfg = glci.util.cicd_cfg(cfg_name=cicd_cfg_name)
-    s3_client = glci.s3.s3_client(cicd_cfg)
+    # shared by all concurrent (part-)uploads
+    s3_client = glci.s3.s3_client(
+        cicd_cfg,
+        config=botocore.config.Config(max_pool_connections=32),
+    )
     aws_cfg_name = cicd_cfg.build.aws_cfg_name
     s3_bucket_name = cicd_cfg.build.s3_bucket_name
     logger.info(f'uploading to s3 {aws_cfg_name=} {s3_bucket_name=}')
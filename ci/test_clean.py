@@ -0,0 +1,63 @@
+import glci.model
+import glci.release_index
+import glci.util
+
+import clean
+
+
+def _release_file(key: str, bucket_name: str='bkt') -> glci.model.S3_ReleaseFile:
+    return glci.model.S3_ReleaseFile(
+        name=key,
+        suffix=key,
+        s3_key=key,
+        s3_bucket_name=bucket_name,
+    )
+
+
+def _release_manifest(idx: int, logs) -> glci.model.OnlineReleaseManifest:
+    return glci.model.OnlineReleaseManifest(
+        build_committish=f'{idx:040x}',
+        version='27.0',
+        gardenlinux_epoch=27,
+        architecture=glci.model.Architecture.AMD64,
+        platform='aws',
+        modifiers=('base', 'cloud', 'gardener', 'server', '_nopkg', '_prod', '_readonly', '_slim'),
+        build_timestamp='2021-01-01T00:00:00',
+        base_image=None,
+        paths=(
+            _release_file(f'objects/{idx}-rootfs'),
+            _release_file('objects/shared'),
+            _release_file(f'objects/{idx}-foreign', bucket_name='other-bkt'),
+        ),
+        published_image_metadata=None,
+        s3_key=f'meta/singles/{idx}',
+        s3_bucket='bkt',
+        test_result=None,
+        logs=logs,
+    )
+
+
+def test_referenced_objects_agree_with_release_index(tmp_path, monkeypatch):
+    manifests = (
+        _release_manifest(0, logs=None),
+        _release_manifest(1, logs=_release_file('objects/1-logs')),
+        # legacy manifests reference logs by name only
+        _release_manifest(2, logs='build.log'),
+    )
+
+    monkeypatch.setattr(
+        glci.util,
+        'preconfigured',
+        lambda func, cicd_cfg: lambda prefix: iter(manifests),
+    )
+    enumerated_keys = {
+        o.s3_key for o in clean._enumerate_objects_from_single_release_manifests()
+        if o.s3_bucket_name == 'bkt'
+    }
+
+    index = glci.release_index.ReleaseIndex(path=str(tmp_path / 'release-index.sqlite3'))
+    index._put([(manifest, f'etag-{idx}') for idx, manifest in enumerate(manifests)])
+    indexed_keys = set(index.referenced_object_keys(bucket_name='bkt'))
+
+    assert enumerated_keys == indexed_keys
+    assert 'objects/1-logs' in indexed_keys
@@ -5,11 +5,13 @@ import json
 import logging
 import shutil
 import subprocess
-import time
+import typing
 
 import dacite
 import dateutil.parser
 
+import glci.waiter
+
 logger = logging.getLogger(__name__)
 
 
@@ -121,29 +123,36 @@ def wait_for_pipelinerun_status(
     timeout_seconds: int=60*45, # 45 minutes
     polling_interval_seconds: int=15,
 ):
-    start_time = time.time()
-
-    while (status := pipelinerun_status(name=name, namespace=namespace)) or True:
-        if not status is None:
-            reason = status.reason
-            if reason is target_status:
-                print(f'{target_status=} reached - build finished')
-                break
-        else:
-            reason = None
-
-        logger.debug(f'{reason=}')
+    def fetch_reason(name: str) -> typing.Optional[StatusReason]:
+        if (status := pipelinerun_status(name=name, namespace=namespace)) is None:
+            return None
+        logger.debug(f'{status.reason=}')
+        return status.reason
+
+    pending_reasons = (StatusReason.RUNNING, StatusReason.PIPELINE_RUN_STOPPING)
+
+    try:
+        glci.waiter.wait_for(
+            key=name,
+            fetcher=glci.waiter.StatusFetcher(
+                name=f'pipelineruns/{namespace}',
+                fetch=glci.waiter.single_fetch(fetch_reason),
+                is_done=lambda reason: reason is target_status,
+                is_failed=lambda reason: not reason in (target_status, *pending_reasons),
+            ),
+            timeout_seconds=timeout_seconds,
+            backoff=glci.waiter.Backoff(initial_seconds=polling_interval_seconds),
+        )
+    except glci.waiter.WaitTimeoutError:
+        raise RuntimeError(f'timeout exceeded: {timeout_seconds=}')
+    except glci.waiter.WaitFailedError as e:
+        reason = e.status
         if reason in (StatusReason.FAILED, StatusReason.PIPELINE_RUN_CANCELLED):
             logger.error(f'{reason=} - aborting')
             raise RuntimeError(reason)
-        elif reason in (StatusReason.RUNNING, StatusReason.PIPELINE_RUN_STOPPING, None):
-            passed_seconds = time.time() - start_time
-            if passed_seconds > timeout_seconds:
-                raise RuntimeError(f'timeout exceeded: {timeout_seconds=}')
-            time.sleep(polling_interval_seconds)
-        else:
-            raise NotImplementedError(reason)
+        raise NotImplementedError(reason)
 
+    print(f'{target_status=} reached - build finished')
     logger.info(f'pipelinerun {name=} reached {target_status=}')
 
 
@@ -10,6 +10,7 @@ import glci.util
 
 from typing import Iterator
 from helper.sshclient import RemoteClient
+from helper.facts import SystemFacts
 
 from os import path
 from dataclasses import dataclass
@@ -22,6 +23,7 @@ from integration.ali import ALI
 from integration.openstackccee import OpenStackCCEE
 from integration.chroot import CHROOT
 from integration.kvm import KVM
+from integration.manual import Manual
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -48,6 +50,19 @@ def pytest_addoption(parser: Parser):
         nargs="?",
         help="URI for the image to be tested (overwrites value in config.yaml)"
     )
+    parser.addoption(
+        "--features",
+        action="store",
+        help="Comma separated list of enabled features (overwrites value in config.yaml)"
+    )
+    parser.addoption(
+        "--target-index",
+        action="store",
+        type=int,
+        default=0,
+        help="Index of the target used by this test session, "
+             "when running several sessions concurrently"
+    )
 #    parser.addoption(
 #        "--debug",
 #        action="store_true",
@@ -55,6 +70,44 @@ def pytest_addoption(parser: Parser):
 #    )
 
 
+# default ports of the local fixture backends (see integration/chroot.py and
+# integration/kvm.py). The ports of concurrently running targets are offset by
+# TARGET_PORT_STRIDE * target index, the stride keeps chroot and kvm ports apart.
+LOCAL_TARGET_PORTS = {"chroot": 2222, "kvm": 2223}
+TARGET_PORT_STRIDE = 2
+
+
+def target_index(pytestconfig) -> int:
+    """Index of the target this test session (or xdist worker) is bound to"""
+    worker = os.getenv("PYTEST_XDIST_WORKER", "gw0")
+    return pytestconfig.getoption("target_index") + int(worker.removeprefix("gw"))
+
+
+def bind_to_target(config, iaas, index):
+    """Adjust the configuration of local targets, so that concurrently running
+    targets do not use the same port or (generated) SSH key. Manual targets
+    are picked from the configured hosts by index."""
+    if iaas == "manual":
+        hosts = config.get("hosts", [])
+        if index >= max(1, len(hosts)):
+            pytest.exit(f"no host for target {index}, configure one 'hosts' entry per "
+                        "concurrently running session", 1)
+        if not hosts:
+            return config
+        config = dict(config)
+        config["host"] = hosts[index]
+        return config
+    if index == 0 or not iaas in LOCAL_TARGET_PORTS:
+        return config
+    config = dict(config)
+    config["port"] = int(config.get("port", LOCAL_TARGET_PORTS[iaas])) + TARGET_PORT_STRIDE * index
+    ssh_config = dict(config["ssh"])
+    if ssh_config.get("ssh_key_generate") and "ssh_key_filepath" in ssh_config:
+        ssh_config["ssh_key_filepath"] = f"{ssh_config['ssh_key_filepath']}-{index}"
+    config["ssh"] = ssh_config
+    return config
+
+
 @pytest.fixture(scope="session")
 def pipeline(pytestconfig):
     if pytestconfig.getoption('pipeline'):
@@ -140,7 +193,12 @@ def testconfig(pipeline, iaas, pytestconfig):
         except OSError as err:
             pytest.exit(err, 1)
         if iaas in configoptions:
-            return configoptions[iaas]
+            config = configoptions[iaas]
+            if pytestconfig.getoption("image"):
+                # fixtures of local targets read the image from the config
+                config = dict(config)
+                config["image"] = pytestconfig.getoption("image")
+            return bind_to_target(config, iaas, target_index(pytestconfig))
         else:
             pytest.exit(f"Configuration section for {iaas} not found in {configfile}.", 1)
     else:
@@ -338,14 +396,17 @@ def pytest_collection_modifyitems(config, items):
     """Skip tests that belong to a feature that is not enabled in the test config"""
     skip = pytest.mark.skip(reason="test is not part of the enabled features")
     iaas = config.getoption("--iaas")
-    config_file = config.getoption("--configfile")
-    try:
-        with open(config_file) as f:
-            config_options = yaml.load(f, Loader=yaml.FullLoader)
-    except OSError as err:
-        logger.error(f"can not open config file {config_file}")
-        pytest.exit(err, 1)
-    features = config_options[iaas].get("features", "")
+    if config.getoption("--features") is not None:
+        features = config.getoption("--features").split(",")
+    else:
+        config_file = config.getoption("--configfile")
+        try:
+            with open(config_file) as f:
+                config_options = yaml.load(f, Loader=yaml.FullLoader)
+        except OSError as err:
+            logger.error(f"can not open config file {config_file}")
+            pytest.exit(err, 1)
+        features = config_options[iaas].get("features", "")
     for item in items:
         item_path = str(item.fspath)
         if "features" in item_path:
@@ -354,15 +415,19 @@ def pytest_collection_modifyitems(config, items):
                 item.add_marker(skip)
 
 
+@pytest.fixture(scope="session")
+def system_facts(client) -> SystemFacts:
+    """Facts (packages, users, ..) of the system under test, collected once"""
+    return SystemFacts.of(client)
+
+
 @pytest.fixture
-def features(client):
-    (exit_code, output, error) = client.execute_command("cat /etc/os-release", quiet=True)
+def features(system_facts):
+    exit_code = system_facts.exit_code("os-release")
     if exit_code != 0:
-        logger.error(error)
+        logger.error("could not read /etc/os-release")
         sys.exit(exit_code)
-    for line in output.split('\n'):
-        if line.startswith('GARDENLINUX_FEATURES'):
-            features = line.split('=')[1]
+    features = system_facts.os_release["GARDENLINUX_FEATURES"]
     current = (os.getenv('PYTEST_CURRENT_TEST')).split('/')
     yield features.split(','), current[0]
 
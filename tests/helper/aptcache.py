@@ -0,0 +1,161 @@
+""" Local caching apt mirror, served from the test host."""
+import http.server
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+
+class AptCache:
+    """Caching reverse proxy for apt repositories.
+
+    Repositories are accessed as http://<host>:<port>/<scheme>/<hostname>/<path>
+    (see `sources_rewrite_cmd`). Files are cached in a local directory, which
+    may be kept across test sessions:
+
+    - package files (pool/, by-hash/) are immutable and cached forever
+    - other index files (dists/) are cached for `max_index_age` seconds
+
+    If a repository is unreachable or fails, stale cached files are served.
+
+    The cache fetches any URL it is asked for, thus it only listens on the
+    loopback interface by default. This suffices for chroot (which shares the
+    network of the host) and KVM (qemu user networking maps 10.0.2.2 to the
+    host's 127.0.0.1).
+    """
+
+    def __init__(self, cache_dir: str = None, max_index_age: int = 86400,
+                 listen: str = "127.0.0.1", port: int = 0):
+        self.cache_dir = cache_dir or tempfile.mkdtemp(prefix="gl-int-apt-cache-")
+        self.max_index_age = max_index_age
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+        cache = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                cache._handle(self, send_body=True)
+
+            def do_HEAD(self):
+                cache._handle(self, send_body=False)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self.server = http.server.ThreadingHTTPServer((listen, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"apt cache serving {self.cache_dir} on port {self.port}")
+
+    @classmethod
+    def from_config(cls, config):
+        """Start an apt cache if configured (`apt_cache` section of the
+        test configuration), return None otherwise"""
+        if not "apt_cache" in config:
+            return None
+        apt_cache_config = config["apt_cache"] or {}
+        return cls(
+            cache_dir=apt_cache_config.get("dir"),
+            max_index_age=apt_cache_config.get("max_index_age", 86400),
+        )
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, host: str) -> str:
+        """URL of the cache as seen from the system under test, which reaches
+        the test host using the given host (name or IP)"""
+        return f"http://{host}:{self.port}"
+
+    def _is_index(self, path: str) -> bool:
+        return "/dists/" in path and not "/by-hash/" in path
+
+    def _lock(self, path: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def _fetch(self, upstream_url: str, cache_path: str):
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with urllib.request.urlopen(upstream_url, timeout=60) as response:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    shutil.copyfileobj(response, f)
+                os.replace(tmp_path, cache_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+
+    def _handle(self, request, send_body: bool):
+        # /<scheme>/<hostname>/<path>
+        parts = request.path.split("?", 1)[0].lstrip("/").split("/", 2)
+        if len(parts) < 3 or parts[0] not in ("http", "https") \
+                or ".." in parts[2].split("/"):
+            request.send_error(400)
+            return
+        scheme, hostname, path = parts
+        upstream_url = f"{scheme}://{hostname}/{path}"
+        cache_path = os.path.join(self.cache_dir, scheme, hostname, path)
+
+        with self._lock(cache_path):
+            cached = os.path.isfile(cache_path)
+            outdated = cached and self._is_index(path) and \
+                time.time() - os.path.getmtime(cache_path) > self.max_index_age
+            if not cached or outdated:
+                try:
+                    self._fetch(upstream_url, cache_path)
+                    logger.debug(f"cached {upstream_url}")
+                except urllib.error.HTTPError as e:
+                    if not cached or e.code == 404:
+                        if cached:
+                            os.remove(cache_path)
+                        request.send_error(e.code)
+                        return
+                    logger.warning(f"serving stale {upstream_url}: {e}")
+                except OSError as e:
+                    if not cached:
+                        logger.warning(f"could not fetch {upstream_url}: {e}")
+                        request.send_error(502)
+                        return
+                    logger.warning(f"serving stale {upstream_url}: {e}")
+
+            request.send_response(200)
+            request.send_header("Content-Length", str(os.path.getsize(cache_path)))
+            request.end_headers()
+            if send_body:
+                with open(cache_path, "rb") as f:
+                    shutil.copyfileobj(f, request.wfile)
+
+
+_SOURCES_REWRITE_SCRIPT = """
+d=/var/lib/gl-int-apt-cache
+mkdir -p $d/sources.list.d || exit 1
+rewrite() {{
+    if [ -e "$1" ]; then
+        sed -E 's#(https?)://#{url}/\\1/#' "$1" > "$2" || exit 1
+    fi
+}}
+rewrite /etc/apt/sources.list $d/sources.list
+for f in /etc/apt/sources.list.d/*; do
+    rewrite "$f" "$d/sources.list.d/${{f##*/}}"
+done
+printf 'Dir::Etc::SourceList "%s/sources.list";\\nDir::Etc::SourceParts "%s/sources.list.d";\\n' \\
+    $d $d > /etc/apt/apt.conf.d/00gl-int-apt-cache
+"""
+
+
+def sources_rewrite_cmd(url: str) -> str:
+    """Shell command configuring apt on the system under test to access all
+    repositories through the cache at the given URL. The original sources
+    lists are kept, rewritten copies are used instead."""
+    return _SOURCES_REWRITE_SCRIPT.format(url=url)
@@ -0,0 +1,197 @@
+""" Snapshot of system facts, collected once per session from the system under test."""
+import base64
+import io
+import logging
+import tarfile
+import threading
+import weakref
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+# commands whose output is collected (name: shell command)
+COMMANDS = {
+    "os-release": "cat /etc/os-release",
+    "dpkg": "dpkg -l",
+    "passwd": "cat /etc/passwd",
+    "getent-passwd": "getent passwd",
+    "shadow": "cat /etc/shadow",
+    "pam-common-password": "cat /etc/pam.d/common-password",
+    "kernel-config": "cat /boot/config-*",
+    # suid / sgid files, mode is needed to tell them apart
+    "suid-sgid-files": (
+        "find / -type f \\( -perm -4000 -o -perm -2000 \\) "
+        "-exec stat -c '%n,%u,%g,%a' {} \\;"
+    ),
+}
+
+# runs all commands (writing outputs and exit codes into a temporary
+# directory), and prints the result as a compressed (and base64 encoded) tar
+# archive. Collecting everything at once saves a roundtrip per command.
+_SCRIPT = """
+d=$(mktemp -d) || exit 1
+collect() {{
+    sh -c "$2" > "$d/$1" 2> /dev/null
+    echo $? > "$d/$1.rc"
+}}
+{collect}
+tar -cz -C "$d" . | base64 -w0
+rc=$?
+rm -rf "$d"
+exit $rc
+"""
+
+
+def _quote(s: str) -> str:
+    return "'" + s.replace("'", "'\"'\"'") + "'"
+
+
+class PasswdEntry(NamedTuple):
+    name: str
+    password: str
+    uid: int
+    gid: int
+    gecos: str
+    home: str
+    shell: str
+
+
+class ShadowEntry(NamedTuple):
+    name: str
+    password: str
+
+
+class SpecialFile(NamedTuple):
+    name: str
+    uid: int
+    gid: int
+    mode: int
+
+    def __str__(self):
+        """Same format as used for the sgid/suid whitelists (name,uid,gid)"""
+        return f"{self.name},{self.uid},{self.gid}"
+
+
+def _passwd_entries(output: str) -> tuple[list[PasswdEntry], list[str]]:
+    """Parse passwd lines leniently: return the parsed entries, and the
+    malformed lines (wrong field count, non-numeric ids) for the tests to
+    report"""
+    entries = []
+    malformed = []
+    for line in output.splitlines():
+        if line == '':
+            continue
+        fields = line.split(":")
+        if len(fields) != len(PasswdEntry._fields) \
+                or not fields[2].isdigit() or not fields[3].isdigit():
+            logger.warning(f"malformed passwd entry: {line}")
+            malformed.append(line)
+            continue
+        name, password, uid, gid, gecos, home, shell = fields
+        entries.append(PasswdEntry(
+            name, password, int(uid), int(gid), gecos, home, shell))
+    return entries, malformed
+
+
+class SystemFacts:
+    """System facts (users, packages, kernel config, ..) of the system under
+    test. All facts are collected using one remote command, when the facts
+    for a client are requested first (see `SystemFacts.of`). Tests changing
+    the system (e.g. by installing packages) are not reflected.
+
+    Raw outputs are available via `output` and `exit_code`, parsed views via
+    the other attributes.
+    """
+    _instances = weakref.WeakKeyDictionary()
+    _lock = threading.Lock()
+
+    @classmethod
+    def of(cls, client):
+        """Return the facts of the system the given client is connected to
+        (collected once per client)"""
+        with cls._lock:
+            if not client in cls._instances:
+                cls._instances[client] = cls.collect(client)
+            return cls._instances[client]
+
+    @classmethod
+    def collect(cls, client):
+        """Collect facts from the system the given client is connected to"""
+        script = _SCRIPT.format(collect="\n".join(
+            f"collect {name} {_quote(command)}"
+            for name, command in COMMANDS.items()
+        ))
+        (exit_code, output, error) = client.execute_command(
+            script, quiet=True)
+        assert exit_code == 0, f"no {error=} expected"
+
+        payload = base64.b64decode(output)
+        logger.info(f"collected system facts ({len(payload)} bytes)")
+
+        files = {}
+        with tarfile.open(fileobj=io.BytesIO(payload), mode="r:gz") as tar:
+            for member in tar.getmembers():
+                if member.isfile():
+                    name = member.name.removeprefix("./")
+                    files[name] = tar.extractfile(member).read().decode()
+
+        return cls(
+            outputs={name: files.get(name, '') for name in COMMANDS},
+            exit_codes={
+                name: int(files.get(f"{name}.rc", "1").strip() or 1)
+                for name in COMMANDS
+            },
+        )
+
+    def __init__(self, outputs: dict[str, str], exit_codes: dict[str, int]):
+        self.outputs = outputs
+        self.exit_codes = exit_codes
+
+        self.os_release = {}
+        for line in self.output("os-release").splitlines():
+            if "=" in line:
+                key, value = line.split("=", 1)
+                self.os_release[key] = value.strip('"')
+
+        self.features = [
+            f for f in self.os_release.get("GARDENLINUX_FEATURES", "").split(",")
+            if f
+        ]
+
+        # same format as returned by `helper.utils.get_package_list`
+        self.packages = []
+        for line in self.output("dpkg").split('\n'):
+            if not line.startswith('ii'):
+                continue
+            pkg = line.split('  ')
+            if len(pkg) > 1:
+                self.packages.append(pkg[1])
+        self.package_set = frozenset(self.packages)
+
+        self.passwd, self.malformed_passwd = _passwd_entries(
+            self.output("passwd"))
+        self.getent_passwd, self.malformed_getent_passwd = _passwd_entries(
+            self.output("getent-passwd"))
+        self.users_by_uid = {}
+        for entry in self.passwd:
+            self.users_by_uid.setdefault(entry.uid, []).append(entry.name)
+
+        self.shadow = [
+            ShadowEntry(*line.split(":")[:2])
+            for line in self.output("shadow").splitlines() if line != ''
+        ]
+
+        self.special_files = []
+        for line in self.output("suid-sgid-files").splitlines():
+            name, uid, gid, mode = line.rsplit(",", 3)
+            self.special_files.append(
+                SpecialFile(name, int(uid), int(gid), int(mode, 8)))
+        self.suid_files = [f for f in self.special_files if f.mode & 0o4000]
+        self.sgid_files = [f for f in self.special_files if f.mode & 0o2000]
+
+    def output(self, name: str) -> str:
+        return self.outputs[name]
+
+    def exit_code(self, name: str) -> int:
+        return self.exit_codes[name]
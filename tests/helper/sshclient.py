@@ -1,8 +1,10 @@
 """ Client to manage connections and run commands via ssh on a remote host."""
 import logging
+import select
 import time
 import pytest
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from os import path
 from binascii import hexlify
 
@@ -18,6 +20,8 @@ logger = logging.getLogger(__name__)
 class RemoteClient:
     """Client to interact with a remote host via SSH & SCP."""
 
+    recv_size = 65536
+
     @classmethod
     def generate_key_pair(
         cls,
@@ -68,6 +72,9 @@ class RemoteClient:
 
         self.passphrase = None
         self.remote_path = "/" 
+        # URL of a local apt cache reachable from the remote host (see
+        # helper.aptcache), set by fixtures providing one
+        self.apt_cache_url = None
 
         if 'passphrase' in sshconfig:
             self.passphrase = sshconfig['passphrase']
@@ -236,6 +243,47 @@ class RemoteClient:
             self.conn = self.__connect()
         self.scp.get(file)
 
+    def __run_on_channel(self, command: str, timeout: int) -> tuple[int, str, str]:
+        """
+        Run a command on a new channel of the (shared) transport.
+
+        Standard and error output are read while the command is running, so
+        large outputs never stall the command (by exhausting the channel's
+        window). Like for `SSHClient.exec_command`, the timeout applies to
+        opening the channel, not to the command's runtime.
+        """
+        channel = self.client.get_transport().open_session(timeout=timeout)
+        try:
+            channel.exec_command(command)
+            output, error = [], []
+            while True:
+                while channel.recv_ready():
+                    output.append(channel.recv(self.recv_size))
+                while channel.recv_stderr_ready():
+                    error.append(channel.recv_stderr(self.recv_size))
+                # exit status may arrive before all output was received
+                if channel.exit_status_ready() \
+                        and (channel.eof_received or channel.closed) \
+                        and not channel.recv_ready() \
+                        and not channel.recv_stderr_ready():
+                    break
+
+                # the channel becomes readable on either standard or error output
+                select.select([channel], [], [], 1)
+
+            exit_status = channel.recv_exit_status()
+        finally:
+            channel.close()
+
+        return exit_status, b"".join(output).decode(), b"".join(error).decode()
+
+    def __log_result(self, exit_status: int, output: str, error: str):
+        logger.info(f"{exit_status=}")
+        if len(error) > 0:
+            logger.info(error)
+        else:
+            logger.info(output)
+
     def execute_command(self, command: str, timeout: int = 30, quiet: bool = False) -> tuple[int, str, str]:
         """
         Execute commands on remote host
@@ -250,16 +298,46 @@ class RemoteClient:
         if not quiet:
             logger.info(f"$ {command.rstrip()}")
 
-        _, stdout, stderr = self.client.exec_command(command=command, timeout=timeout)
-        exit_status = stdout.channel.recv_exit_status()
+        exit_status, output, error = self.__run_on_channel(command, timeout)
         if not quiet:
-            logger.info(f"{exit_status=}")
+            self.__log_result(exit_status, output, error)
+
+        return exit_status, output, error
+
+    def execute_commands(
+        self,
+        commands: list[str],
+        timeout: int = 30,
+        quiet: bool = False,
+        max_sessions: int = 8,
+    ) -> list[tuple[int, str, str]]:
+        """
+        Execute multiple commands on remote host concurrently
+
+        All commands are run on separate channels of the one existing SSH
+        connection, so there is no additional connection setup, and round
+        trips overlap. The commands must not depend on each other.
+
+        :param commands: unix commands as strings.
+        :param timeout: timeout in seconds (for opening each channel).
+        :param max_sessions: max. amount of concurrent channels (sshd limits
+            the sessions per connection, see MaxSessions, default: 10).
+
+        :returns: the commands' exit status, standard and error output (in
+            the order the commands were passed)
+        """
+        if self.client is None:
+            self.client = self.__connect()
+
+        with ThreadPoolExecutor(max_workers=max_sessions) as executor:
+            results = list(executor.map(
+                lambda command: self.__run_on_channel(command, timeout),
+                commands,
+            ))
 
-        output, error = stdout.read().decode(), stderr.read().decode()
         if not quiet:
-            if len(error) > 0:
-                logger.info(error)
-            else:
-                logger.info(output)
+            for command, result in zip(commands, results):
+                logger.info(f"$ {command.rstrip()}")
+                self.__log_result(*result)
 
-        return exit_status, output, error
+        return results
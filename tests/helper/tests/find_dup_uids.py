@@ -1,6 +1,7 @@
 import logging
 
 from helper import utils
+from helper.facts import SystemFacts
 from helper.exception import NotPartOfFeatureError, TestFailed, DisabledBy
 
 logger = logging.getLogger(__name__)
@@ -49,29 +50,20 @@ class FindDupUIDs():
         if not hasattr(cls, 'instance'):
             cls.instance = super(FindDupUIDs, cls).__new__(cls)
 
-            # Call binary on remote and get content of file
-            (exit_code, output, error) = client.execute_command(
-                "cat /etc/passwd", quiet=True)
-
-            # Validate the output content
-            match = {} 
-            for line in output.split('\n'):
-                # Make sure to not split last empty newline
-                if line != '':
-                  line = line.split(":")
-                  uid = line[2]
-                  user = line[0]
-                  if not match.get(uid):
-                      match[uid] = [user]
-                  else:
-                      match[uid].append(user)
+            # Get parsed content of file (collected once from remote)
+            facts = SystemFacts.of(client)
 
             # Validate for each UID for multiple users
-            for key in match:
-                if len(match[key]) > 1:
-                    key = str(key)
-                    msg_err = f"UID {key} is used multiple times in /etc/passwd"
+            for uid, users in facts.users_by_uid.items():
+                if len(users) > 1:
+                    msg_err = f"UID {uid} is used multiple times in /etc/passwd"
                     logger.error(msg_err)
                     raise TestFailed(msg_err)
 
+            # UIDs of unparseable lines cannot be checked
+            if facts.malformed_passwd:
+                msg_err = f"Malformed entries in /etc/passwd \n {facts.malformed_passwd}"
+                logger.error(msg_err)
+                raise TestFailed(msg_err)
+
         return cls.instance
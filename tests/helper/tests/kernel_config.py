@@ -3,6 +3,7 @@ import re
 import string
 
 from helper import utils
+from helper.facts import SystemFacts
 from helper.exception import NotPartOfFeatureError, TestFailed, DisabledBy
 
 logger = logging.getLogger(__name__)
@@ -51,9 +52,10 @@ class KernelConfig():
         if not hasattr(cls, 'instance'):
             cls.instance = super(KernelConfig, cls).__new__(cls)
 
-            (exit_code, output, error) = client.execute_command(
-                "cat /boot/config-*", quiet=True)
-            assert exit_code == 0, f"no {error=} expected"
+            facts = SystemFacts.of(client)
+            assert facts.exit_code("kernel-config") == 0, \
+                "no error reading /boot/config-* expected"
+            output = facts.output("kernel-config")
 
             expected_config = utils.read_test_config(
                 enabled_features, 'kernel-config', '.txt',
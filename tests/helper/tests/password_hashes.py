@@ -1,6 +1,7 @@
 import logging
 
 from helper import utils
+from helper.facts import SystemFacts
 from helper.exception import NotPartOfFeatureError, TestFailed, DisabledBy
 
 logger = logging.getLogger(__name__)
@@ -49,9 +50,8 @@ class PasswordHashes():
         if not hasattr(cls, 'instance'):
             cls.instance = super(PasswordHashes, cls).__new__(cls)
 
-            # Call binary on remote and get content of file
-            (exit_code, output, error) = client.execute_command(
-                "cat /etc/pam.d/common-password", quiet=True)
+            # Get content of file (collected once from remote)
+            output = SystemFacts.of(client).output("pam-common-password")
 
             # Validate that the main part is present
             match_list = []
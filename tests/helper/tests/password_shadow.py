@@ -1,6 +1,7 @@
 import logging
 
 from helper import utils
+from helper.facts import SystemFacts
 from helper.exception import NotPartOfFeatureError, TestFailed, DisabledBy
 
 logger = logging.getLogger(__name__)
@@ -49,14 +50,21 @@ class PasswordShadow():
         if not hasattr(cls, 'instance'):
             cls.instance = super(PasswordShadow, cls).__new__(cls)
 
-            (exit_code, output, error) = client.execute_command(
-                "awk -F: '$2~/\\*/ { next; } $2~/!/ { next; } {print $0; exit 1}' /etc/shadow", quiet=True)
-            if exit_code != 0:
+            facts = SystemFacts.of(client)
+            if facts.exit_code("shadow") != 0:
+                raise TestFailed("Could not read /etc/shadow")
+
+            # locked ('*') or disabled ('!') entries only
+            if any(not '*' in entry.password and not '!' in entry.password
+                   for entry in facts.shadow):
                 raise TestFailed(f"No passwords should be set in /etc/shadow")
 
-            (exit_code, output, error) = client.execute_command(
-                "awk -F: '$2~/\\*/ { next; } $2~/x/ { next; } {print $0; exit 1}' /etc/passwd", quiet=True)
-            if exit_code != 0:
-                raise TestFailed(f"Malformed entries in /etc/passwd \n {output} {error}")
+            # passwords must be stored in /etc/shadow ('x'), or be locked
+            # unparseable lines (see `SystemFacts.malformed_passwd`), too
+            malformed = facts.malformed_passwd + [
+                entry for entry in facts.passwd
+                if not '*' in entry.password and not 'x' in entry.password]
+            if malformed:
+                raise TestFailed(f"Malformed entries in /etc/passwd \n {malformed}")
 
         return cls.instance
@@ -1,28 +1,17 @@
+from helper.facts import SystemFacts
+
+
 def sgid_suid_files(client, id_type, whitelist_files):
     """ Performing unit test for feature: Fedramp """
+    facts = SystemFacts.of(client)
     if id_type == 'sgid':
-        remote_files = _get_remote_files(client, "-2000")
+        remote_files = [str(f) for f in facts.sgid_files]
         _val_whitelist_files(remote_files, whitelist_files)
     if id_type == 'suid':
-        remote_files = _get_remote_files(client, "-4000")
+        remote_files = [str(f) for f in facts.suid_files]
         _val_whitelist_files(remote_files, whitelist_files)
 
 
-def _get_remote_files(client, perm):
-    """ Get remote files of given attribute """
-    files = []
-    cmd_find = f"find / -type f -perm {perm} -exec "
-    cmd_stat = "stat -c '%n,%u,%g' {} \\; 2> /dev/null"
-    cmd = cmd_find + cmd_stat
-    (exit_code, output, error) = client.execute_command(
-        cmd, quiet=True)
-
-    for line in output.split('\n'):
-        if line != '':
-            files.append(line)
-    return files
-
-
 def _val_whitelist_files(remote_files, whitelist_files):
     """ Validates that remotly found files are in whitelist """
     found_files = []
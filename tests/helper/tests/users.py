@@ -1,6 +1,7 @@
 import logging
 
 from helper import utils
+from helper.facts import SystemFacts
 from helper.exception import NotPartOfFeatureError, TestFailed, DisabledBy
 
 logger = logging.getLogger(__name__)
@@ -50,8 +51,7 @@ class TestUsers():
             cls.instance = super(TestUsers, cls).__new__(cls)
 
             # Get content from /etc/passwd
-            (exit_code, output, error) = client.execute_command(
-                "getent passwd", quiet=True)
+            output = SystemFacts.of(client).output("getent-passwd")
 
             for line in output.split('\n'):
                 # Ignore empty newline
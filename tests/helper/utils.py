@@ -1,20 +1,18 @@
 import os
 import re
 import string
+import threading
+import weakref
+
+from helper.aptcache import sources_rewrite_cmd
+from helper.facts import SystemFacts
 
 def get_package_list(client):
     """Return list with the installed packages.
     Needs the fixture client to connect into the image"""
-    (exit_code, output, error) = client.execute_command("dpkg -l", quiet=True)
-    assert exit_code == 0, f"no {error=} expected"
-    pkgslist = []
-    for line in output.split('\n'):
-        if not line.startswith('ii'):
-            continue
-        pkg = line.split('  ')
-        if len(pkg) > 1:
-            pkgslist.append(pkg[1])
-    return pkgslist
+    facts = SystemFacts.of(client)
+    assert facts.exit_code("dpkg") == 0, "no error from dpkg -l expected"
+    return list(facts.packages)
 
 
 def read_test_config(features, testname, suffix = ".list", filter_comments = True):
@@ -51,14 +49,28 @@ def disabled_by(features, testname):
 
 
 class AptUpdate():
+    """Run `apt-get update` on the remote system, once per client.
+    If the client has an apt cache configured (see `helper.aptcache`), apt is
+    pointed at it beforehand."""
+    _instances = weakref.WeakKeyDictionary()
+    _lock = threading.Lock()
+
     def __new__(cls, client):
-        if not hasattr(cls, 'instance'):
-            cls.instance = super(AptUpdate, cls).__new__(cls)
+        with cls._lock:
+            if client in cls._instances:
+                return cls._instances[client]
+
+            apt_cache_url = getattr(client, 'apt_cache_url', None)
+            if apt_cache_url:
+                (exit_code, output, error) = client.execute_command(
+                    sources_rewrite_cmd(apt_cache_url), quiet=True)
+                assert exit_code == 0, f"no {error=} expected"
 
-        (exit_code, output, error) = client.execute_command("apt-get update")
-        assert exit_code == 0, f"no {error=} expected"
+            (exit_code, output, error) = client.execute_command("apt-get update")
+            assert exit_code == 0, f"no {error=} expected"
 
-        return cls.instance
+            cls._instances[client] = super(AptUpdate, cls).__new__(cls)
+            return cls._instances[client]
 
 
 def get_file_perm(client, fname):
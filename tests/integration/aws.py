@@ -14,6 +14,8 @@ from helper.sshclient import RemoteClient
 from paramiko import RSAKey
 
 import glci.aws
+import glci.ebs
+import glci.model
 from glci.aws import response_ok
 
 logger = logging.getLogger(__name__)
@@ -434,16 +436,30 @@ class AWS:
             self._storage_bucket_name = None
 
 
-    def upload_image(self, image_url):
-        image_name = f"img-{self.test_name}"
-
-        if 'ami_id' in self.config:
-            ami_id = self.aws_get_ami(self.config['ami_id'])
-            self.logger.info(f"Using image with {ami_id=} for this test.")
-            return ami_id
-
-        o = urlparse(image_url)
+    def upload_snapshot_direct(self, o):
+        """Write the image straight into a new EBS snapshot (w/o S3 and VM Import)."""
+        self.logger.info(f"Uploading image {o.geturl()} directly into an EBS snapshot...")
+        ebs_client = self.session.client("ebs")
+        if o.scheme == "file":
+            with open(o.path, 'rb') as f:
+                return glci.ebs.upload_snapshot(
+                    ebs_client = ebs_client,
+                    ec2_client = self.ec2_client,
+                    fileobj = f,
+                    size = os.path.getsize(o.path),
+                    tags = self._tags,
+                )
+        elif o.scheme == "s3":
+            return glci.aws.upload_snapshot_from_s3(
+                session = self.session,
+                s3_bucket_name = o.netloc,
+                image_key = o.path.lstrip("/"),
+            )
+        else:
+            raise NotImplementedError("Only local image file uploads and S3 buckets are implemented.")
 
+    def import_snapshot(self, o, image_name):
+        """Import the image as snapshot using the VM Import service (from S3)."""
         if o.scheme == "file":
             if not self.aws_get_storage_bucket(self.config["bucket"]):
                 self.aws_create_storage_bucket(self.config["bucket"])
@@ -482,7 +498,7 @@ class AWS:
             image_key = image_key,
         )
         try:
-            self._snapshot_id = glci.aws.wait_for_snapshot_import(
+            return glci.aws.wait_for_snapshot_import(
                 ec2_client = self.ec2_client,
                 snapshot_task_id = snapshot_task_id,
             )
@@ -493,6 +509,24 @@ class AWS:
             self.cleanup_test_resources
             raise RuntimeError(f"Failed to import snapshot: {import_error}.")
 
+    def upload_image(self, image_url):
+        image_name = f"img-{self.test_name}"
+
+        if 'ami_id' in self.config:
+            ami_id = self.aws_get_ami(self.config['ami_id'])
+            self.logger.info(f"Using image with {ami_id=} for this test.")
+            return ami_id
+
+        o = urlparse(image_url)
+
+        snapshot_upload_method = glci.model.AwsSnapshotUploadMethod(
+            self.config.get('snapshot_upload', glci.model.AwsSnapshotUploadMethod.IMPORT.value)
+        )
+        if snapshot_upload_method is glci.model.AwsSnapshotUploadMethod.EBS_DIRECT:
+            self._snapshot_id = self.upload_snapshot_direct(o)
+        else:
+            self._snapshot_id = self.import_snapshot(o, image_name)
+
         self.ec2_client.create_tags(
             Resources = [self._snapshot_id],
             Tags = self._tags
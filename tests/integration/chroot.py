@@ -16,6 +16,7 @@ import shutil
 import socket
 from contextlib import closing
 from novaclient import client
+from helper.aptcache import AptCache
 from helper.sshclient import RemoteClient
 from . import util
 
@@ -45,17 +46,25 @@ class CHROOT:
         chroot = CHROOT(config)
         cls.chroot = chroot
 
+        apt_cache = AptCache.from_config(config)
+
         try:
             ssh = RemoteClient(
                 host=ip,
                 port=port,
                 sshconfig=config["ssh"],
             )
+            if apt_cache:
+                # the chroot shares the network with the host
+                ssh.apt_cache_url = apt_cache.url("127.0.0.1")
             ssh.wait_ssh()
+            chroot.check_sshd()
             yield ssh
         finally:
             if ssh is not None:
                 ssh.disconnect()
+            if apt_cache is not None:
+                apt_cache.close()
             if chroot is not None:
                 chroot.__del__()
 
@@ -130,8 +139,13 @@ class CHROOT:
             logger.info("Port for ssh connection defined: {port}".format(
               port=self.config["port"]))
 
-        # Check if sshd port can be used
-        self._port_val(self.config["ip"], self.config["port"])
+        # Check if sshd port can be used; concurrent chroot targets
+        # must not share a port or their clients end up on the same sshd
+        if self._port_val(self.config["ip"], int(self.config["port"])):
+            msg_err = "Port {port} is already in use by another target.".format(
+              port=self.config["port"])
+            logger.error(msg_err)
+            pytest.exit(msg_err, 1)
 
 
     def _unarchive_image(self):
@@ -246,15 +260,28 @@ class CHROOT:
         """ Start sshd inside the chroot """
         # Define vars to have it more readable
         gl_chroot_bin = "/gardenlinux/bin/garden-chroot"
-        chroot_cmd = "/usr/sbin/sshd -D -f /etc/ssh/sshd_config_integration_tests"
+        # -p overrides the Port from the shipped sshd config, so every
+        # target listens on the port it was bound to
+        chroot_cmd = "/usr/sbin/sshd -D -f /etc/ssh/sshd_config_integration_tests -p {port}".format(
+          port=self.config["port"])
         # Execute in Popen as background task
         # while we may perform our integration tests
         proc_exec = "{chroot_bin} {chroot_env} {chroot_cmd}".format(
           chroot_bin=gl_chroot_bin,
           chroot_env=rootfs,
           chroot_cmd=chroot_cmd)
-        p = subprocess.Popen([proc_exec], shell=True)
-        logger.info("Started SSHD in chroot environment.")
+        self.sshd = subprocess.Popen([proc_exec], shell=True)
+        logger.info("Started SSHD in chroot environment on tcp/{port}.".format(
+          port=self.config["port"]))
+
+
+    def check_sshd(self):
+        """ Make sure the sshd answering on our port is the one we started """
+        if self.sshd.poll() is not None:
+            msg_err = "SSHD in chroot exited with {rc}; tcp/{port} is served by another process.".format(
+              rc=self.sshd.returncode, port=self.config["port"])
+            logger.error(msg_err)
+            pytest.exit(msg_err, 1)
 
 
     def _create_dir(self, dir, mode):
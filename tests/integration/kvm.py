@@ -1,7 +1,13 @@
+import contextlib
+import fcntl
+import hashlib
 import logging
 import json
 import time
 import os
+import platform
+import signal
+import socket
 import subprocess
 import threading
 import tempfile
@@ -10,6 +16,7 @@ import paramiko
 import pytest
 import sys
 from novaclient import client
+from helper.aptcache import AptCache
 from helper.sshclient import RemoteClient
 from . import util
 
@@ -19,6 +26,9 @@ logger.setLevel(logging.DEBUG)
 
 BIN_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "bin")
 
+# name of the (internal qcow2) snapshot holding the state of a booted VM
+BOOT_SNAPSHOT_NAME = "gl-int-booted"
+
 class KVM:
     """Handle KVM flavour"""
 
@@ -39,18 +49,27 @@ class KVM:
         kvm = KVM(config)
         cls.kvm = kvm 
 
+        apt_cache = AptCache.from_config(config)
+
+        ssh = None
         try:
             ssh = RemoteClient(
                 host=ip,
                 sshconfig=config["ssh"],
                 port=port,
             )
+            if apt_cache:
+                # host as seen from the VM (qemu user networking)
+                ssh.apt_cache_url = apt_cache.url("10.0.2.2")
             ssh.wait_ssh()
+            kvm.after_boot(ssh)
             yield ssh
 
         finally:
             if ssh is not None:
                 ssh.disconnect()
+            if apt_cache is not None:
+                apt_cache.close()
             if kvm is not None:
                 kvm.__del__()
 
@@ -62,8 +81,14 @@ class KVM:
 
         # Define self.config
         self.config = config
+        # Path of the saved VM state, if used
+        self.boot_snapshot = None
+        # VM is restored from the saved state instead of booting
+        self.restored = False
         # Validate
         ssh_generate, arch = self._validate()
+        self.arch = arch
+        self.accel = self._accel(arch)
         # Create SSH
         if ssh_generate:
             self._generate_ssh_key()
@@ -108,7 +133,7 @@ class KVM:
             pytest.exit(msg_err, 1)
 
         # Validate if image is already running
-        pid = os.path.exists("/tmp/qemu.pid")
+        pid = os.path.exists(self._pidfile())
         if pid:
             logger.warning(("PID file is present. Probably a VM for integrationtest "+
                            "is already running. This may cause issues for SSH key injection."))
@@ -134,6 +159,12 @@ class KVM:
         else:
             logger.info("'keep_running' not defined. VM will be terminated after tests.")
 
+        # Validate if the booted VM state should be saved / restored
+        if self.config.get("boot_snapshot", False) and not self.config.get("overlay_cache"):
+            msg_err = "'boot_snapshot' requires 'overlay_cache' to be defined."
+            logger.error(msg_err)
+            pytest.exit(msg_err, 1)
+
         # Validate if SSH key should be generated (default)
         if self.config["ssh"]["ssh_key_generate"]:
             logger.info("'ssh_key_generate' is true. New random SSH keys will be generated.")
@@ -161,6 +192,18 @@ class KVM:
 
         return ssh_generate, arch
 
+    def _port(self):
+        return self.config.get("port", "2223")
+
+    def _snapshot_path(self):
+        """ Path of the overlay image, one per port to allow concurrent VMs """
+        image_name = os.path.basename(self.config["image"])
+        return "/tmp/{image_name}.{port}.snapshot.img".format(
+            image_name=image_name, port=self._port())
+
+    def _pidfile(self):
+        return "/tmp/qemu.{port}.pid".format(port=self._port())
+
     def _generate_ssh_key(self):
         """ Generate new SSH key for integration test """
         logger.info("Generating new SSH key for integration tests.")
@@ -170,117 +213,297 @@ class KVM:
         )
         logger.info("SSH key for integration tests generated.")
 
-    def _adjust_kvm(self):
-        """ Adjust KVM image and inject needed files """
-        logger.info("Adjusting KVM image. This will take some time for each command...")
-        image = self.config["image"]
-        image_name = os.path.basename(image)
-        ssh_key_path = self.config["ssh"]["ssh_key_filepath"]
-        ssh_key = os.path.basename(ssh_key_path)
-        authorized_keys_file = f"{ssh_key_path}.pub"
+    def _guestfish_script(self):
+        """ guestfish commands injecting the SSH key and the SSHD for the tests """
+        authorized_keys_file = "{ssh_key_path}.pub".format(
+            ssh_key_path=self.config["ssh"]["ssh_key_filepath"])
+        # Custom SSHD config for executing remote integration tests
+        # without changing the production sshd_config. This SSHD runs on
+        # port tcp/2222
         sshd_config_src_file = "integration/misc/sshd_config_integration_tests"
         sshd_config_dst_file = "/etc/ssh/sshd_config_integration_tests"
         sshd_systemd_src_file = "integration/misc/sshd-integration.test.service"
-        systemd_dst_path = "/etc/systemd/system/"
-
-        # Command list for adjustments
-        cmd_kvm_adj = []
-        # Create a snapshot image and inject SSH key
-        cmd_kvm_adj.append("qemu-img create -f qcow2 -F raw -b {image} /tmp/{image_name}.snapshot.img 2G".format(
-            image=image, image_name=image_name))
-        cmd_kvm_adj.append("guestfish -a /tmp/{image_name}.snapshot.img -i mkdir /root/.ssh".format(
-            image_name=image_name))
-        cmd_kvm_adj.append("virt-copy-in -a /tmp/{image_name}.snapshot.img {authorized_keys_file} /root/.ssh/".format(
-            image_name=image_name, authorized_keys_file=authorized_keys_file))
-        cmd_kvm_adj.append("guestfish -a /tmp/{image_name}.snapshot.img -i mv /root/.ssh/{ssh_key}.pub /root/.ssh/test_authorized_keys".format(
-            image_name=image_name, ssh_key=ssh_key))
-        cmd_kvm_adj.append("guestfish -a /tmp/{image_name}.snapshot.img -i chown 0 0 /root/.ssh".format(
-            image_name=image_name))
-        cmd_kvm_adj.append("guestfish -a /tmp/{image_name}.snapshot.img -i chown 0 0 /root/.ssh/test_authorized_keys".format(
-            image_name=image_name))
-        cmd_kvm_adj.append("guestfish -a /tmp/{image_name}.snapshot.img -i chmod 0700 /root/.ssh".format(
-            image_name=image_name))
-        cmd_kvm_adj.append("guestfish -a /tmp/{image_name}.snapshot.img -i chmod 0600 /root/.ssh/test_authorized_keys".format(
-            image_name=image_name))
-        cmd_kvm_adj.append("guestfish -a /tmp/{image_name}.snapshot.img -i write-append /etc/hosts.allow 'ALL: 10.\n'".format(
-            image_name=image_name))
-        # Copy custom SSHD config for executing remote integration tests
-        # without changing the production sshd_config. This SSHD runs on
-        # port tcp/2222
-        cmd_kvm_adj.append("virt-copy-in -a /tmp/{image_name}.snapshot.img {sshd_systemd_src_file} {systemd_dst_path}".format(
-          image_name=image_name, sshd_systemd_src_file=sshd_systemd_src_file, systemd_dst_path=systemd_dst_path))
-        cmd_kvm_adj.append("virt-copy-in -a /tmp/{image_name}.snapshot.img {sshd_config_src_file} /etc/ssh/".format(
-          image_name=image_name, sshd_config_src_file=sshd_config_src_file))
-        cmd_kvm_adj.append("guestfish -a /tmp/{image_name}.snapshot.img -i chown 0 0 {sshd_config_dst_file}".format(
-          image_name=image_name, sshd_config_dst_file=sshd_config_dst_file))
-        cmd_kvm_adj.append("guestfish -a /tmp/{image_name}.snapshot.img -i chmod 0644 {sshd_config_dst_file}".format(
-          image_name=image_name, sshd_config_dst_file=sshd_config_dst_file))
+        sshd_systemd_dst_file = "/etc/systemd/system/sshd-integration.test.service"
         # Create a symlink since Debian watches for type 'link'
-        cmd_kvm_adj.append(("guestfish -a /tmp/{image_name}.snapshot.img -i ln-s ".format(image_name=image_name) +
-          "{systemd_path}sshd-integration.test.service ".format(systemd_path=systemd_dst_path) +
-          "{systemd_path}multi-user.target.wants/sshd-integration.test.service".format(
-            systemd_path=systemd_dst_path)))
-
-        for i in cmd_kvm_adj:
-            logger.info("Running: {cmd}".format(cmd=i))
-            p = subprocess.run([i], shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            rc = p.returncode
-            if rc == 0:
-                logger.info("Succeeded: {cmd}".format(cmd=i))
+        sshd_systemd_link = "/etc/systemd/system/multi-user.target.wants/sshd-integration.test.service"
+
+        return "\n".join((
+            "mkdir-p /root/.ssh",
+            f'upload "{authorized_keys_file}" /root/.ssh/test_authorized_keys',
+            "chown 0 0 /root/.ssh",
+            "chown 0 0 /root/.ssh/test_authorized_keys",
+            "chmod 0700 /root/.ssh",
+            "chmod 0600 /root/.ssh/test_authorized_keys",
+            'write-append /etc/hosts.allow "ALL: 10.\\n"',
+            f'upload "{sshd_systemd_src_file}" {sshd_systemd_dst_file}',
+            f"chown 0 0 {sshd_systemd_dst_file}",
+            f"chmod 0644 {sshd_systemd_dst_file}",
+            f'upload "{sshd_config_src_file}" {sshd_config_dst_file}',
+            f"chown 0 0 {sshd_config_dst_file}",
+            f"chmod 0644 {sshd_config_dst_file}",
+            f"ln-sf {sshd_systemd_dst_file} {sshd_systemd_link}",
+            "",
+        ))
+
+    def _run(self, cmd, **kwargs):
+        """ Run a command, exit the test session if it fails """
+        logger.info("Running: {cmd}".format(cmd=" ".join(cmd)))
+        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, **kwargs)
+        if p.returncode == 0:
+            logger.info("Succeeded: {cmd}".format(cmd=cmd[0]))
+        else:
+            msg_err = "Failed: {cmd}: {output}".format(cmd=" ".join(cmd), output=p.stdout)
+            logger.error(msg_err)
+            pytest.exit(msg_err, 1)
+
+    def _create_overlay(self, backing_file, backing_format, overlay):
+        self._run(["qemu-img", "create", "-f", "qcow2", "-F", backing_format,
+                   "-b", backing_file, overlay, "2G"])
+
+    def _customize(self, overlay):
+        """ Apply all guest adjustments in one libguestfs session (instead of
+        launching the libguestfs appliance once per adjustment) """
+        self._run(["guestfish", "-a", overlay, "-i"], input=self._guestfish_script())
+
+    def _image_digest(self, image):
+        """ sha256 of the image, remembered (by path, size and mtime) in the
+        overlay cache to not read the whole image every session """
+        cache_dir = self.config["overlay_cache"]
+        stat = os.stat(image)
+        stat_key = "{path}:{size}:{mtime}".format(path=image, size=stat.st_size, mtime=stat.st_mtime_ns)
+        digests_file = os.path.join(cache_dir, "digests.json")
+        with self._cache_lock("digests"):
+            try:
+                with open(digests_file) as f:
+                    digests = json.load(f)
+            except (OSError, ValueError):
+                digests = {}
+            if not stat_key in digests:
+                logger.info("Calculating digest of {image}".format(image=image))
+                h = hashlib.sha256()
+                with open(image, "rb") as f:
+                    while chunk := f.read(1024 * 1024):
+                        h.update(chunk)
+                digests[stat_key] = h.hexdigest()
+                with open(digests_file + ".tmp", "w") as f:
+                    json.dump(digests, f)
+                os.replace(digests_file + ".tmp", digests_file)
+            return digests[stat_key]
+
+    def _cache_key(self, image, *extra):
+        """ Key of the cached customized overlay: changes if the image, the
+        injected files or the (given) VM options change """
+        h = hashlib.sha256()
+        h.update(self._image_digest(image).encode())
+        # the overlay references its backing file by path
+        h.update(image.encode())
+        h.update(self._guestfish_script().encode())
+        for path in (
+            "{ssh_key_path}.pub".format(ssh_key_path=self.config["ssh"]["ssh_key_filepath"]),
+            "integration/misc/sshd_config_integration_tests",
+            "integration/misc/sshd-integration.test.service",
+        ):
+            with open(path, "rb") as f:
+                h.update(f.read())
+        for value in extra:
+            h.update(str(value).encode())
+        return h.hexdigest()[:32]
+
+    @contextlib.contextmanager
+    def _cache_lock(self, name):
+        """ Serialize concurrent test sessions preparing the same cache entry """
+        with open(os.path.join(self.config["overlay_cache"], f"{name}.lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _adjust_kvm(self):
+        """ Create the overlay image the VM runs on and inject needed files """
+        image = os.path.realpath(self.config["image"])
+        image_format = "qcow2" if image.endswith(".qcow2") else "raw"
+        snapshot = self._snapshot_path()
+        cache_dir = self.config.get("overlay_cache")
+
+        if not cache_dir:
+            logger.info("Adjusting KVM image.")
+            self._create_overlay(image, image_format, snapshot)
+            self._customize(snapshot)
+            return
+
+        # The customized overlay is prepared once per image, each session
+        # runs on a (thin) overlay on top of it.
+        os.makedirs(cache_dir, exist_ok=True)
+        key = self._cache_key(image)
+        base = os.path.join(cache_dir, f"{key}.qcow2")
+        with self._cache_lock(key):
+            if os.path.exists(base):
+                logger.info("Using cached adjusted KVM image {base}".format(base=base))
+                # mark as used, see _prune_overlay_cache
+                os.utime(base)
             else:
-                logger.error("Failed: {cmd}".format(cmd=i))
+                logger.info("Adjusting KVM image, caching it as {base}".format(base=base))
+                self._create_overlay(image, image_format, f"{base}.tmp")
+                self._customize(f"{base}.tmp")
+                os.replace(f"{base}.tmp", base)
 
-    def _start_kvm(self, arch):
-        """ Start VM in KVM for defined arch """
-        logger.info("Starting VM in KVM.")
-        image = self.config["image"]
-        image_name = os.path.basename(image)
-        port = self.config["port"]
+        if self.config.get("boot_snapshot", False):
+            # A copy of the VM state saved after the first boot (including
+            # its overlay) is restored instead of booting.
+            boot_key = self._cache_key(image, *self._vm_args())
+            self.boot_snapshot = os.path.join(cache_dir, f"{boot_key}.booted.qcow2")
+            self._prune_overlay_cache(keep=(key, boot_key))
+            if os.path.exists(self.boot_snapshot):
+                logger.info("Restoring VM from {boot_snapshot}".format(boot_snapshot=self.boot_snapshot))
+                os.utime(self.boot_snapshot)
+                self._run(["cp", "--reflink=auto", self.boot_snapshot, snapshot])
+                self.restored = True
+                return
+        else:
+            self._prune_overlay_cache(keep=(key,))
 
+        self._create_overlay(base, "qcow2", snapshot)
+
+    def _prune_overlay_cache(self, keep):
+        """ Remove cached overlays and saved VM states (besides the ones with
+        the given keys) that were not used for `overlay_cache_max_age` days """
+        cache_dir = self.config["overlay_cache"]
+        max_age = float(self.config.get("overlay_cache_max_age", 7)) * 86400
+        now = time.time()
+        for name in os.listdir(cache_dir):
+            if name.split(".")[0] in keep or not name.endswith((".qcow2", ".lock")) \
+                    or name == "digests.lock":
+                continue
+            path = os.path.join(cache_dir, name)
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    logger.info("Removing unused {path}".format(path=path))
+                    os.remove(path)
+            except FileNotFoundError:
+                # removed by a concurrent session
+                pass
+
+    def _accel(self, arch):
+        """ Use KVM acceleration if available for the target arch """
+        accel = self.config.get("accel", "auto")
+        if accel == "auto":
+            host_arch = {"x86_64": "amd64", "aarch64": "arm64"}.get(platform.machine())
+            if host_arch == arch and os.access("/dev/kvm", os.R_OK | os.W_OK):
+                accel = "kvm"
+            else:
+                accel = "tcg"
+        logger.info("Using {accel} acceleration.".format(accel=accel))
+        return accel
+
+    def _vm_args(self):
+        """ Machine options, a saved VM state can only be restored by a VM
+        started with the same ones """
+        arch = self.arch
+        accel = self.accel
         if arch == "amd64":
-            cmd_kvm = "qemu-system-x86_64 \
-              -display none \
-              -daemonize \
-              -pidfile /tmp/qemu.pid \
-              -m 1024M \
-              -device virtio-net-pci,netdev=net0,mac=02:9f:ec:22:f8:89 \
-              -netdev user,id=net0,hostfwd=tcp::{port}-:2222,hostname=garden \
-              /tmp/{image_name}.snapshot.img".format(port=port, image_name=image_name)
-            logger.info(cmd_kvm)
-            p = subprocess.Popen([cmd_kvm], shell=True)
-            logger.info("VM starting as amd64 in KVM.")
+            args = ["qemu-system-x86_64"]
+            if accel == "kvm":
+                args += ["-enable-kvm", "-cpu", "host"]
         elif arch == "arm64":
-            cmd_kvm = "qemu-system-aarch64 \
-              -display none \
-              -daemonize \
-              -cpu cortex-a72 \
-              -machine virt \
-              -bios /usr/share/qemu-efi-aarch64/QEMU_EFI.fd \
-              -pidfile /tmp/qemu.pid \
-              -m 1024M \
-              -device virtio-net-pci,netdev=net0,mac=02:9f:ec:22:f8:89 \
-              -netdev user,id=net0,hostfwd=tcp::{port}-:2222,hostname=garden \
-              /tmp/{image_name}.snapshot.img".format(port=port, image_name=image_name)
-            logger.info(cmd_kvm)
-            p = subprocess.Popen([cmd_kvm], shell=True)
-            logger.info("VM starting as arm64 in KVM.")
+            args = ["qemu-system-aarch64", "-machine", "virt",
+                    "-bios", "/usr/share/qemu-efi-aarch64/QEMU_EFI.fd"]
+            if accel == "kvm":
+                args += ["-enable-kvm", "-cpu", "host"]
+            else:
+                args += ["-cpu", "cortex-a72"]
         else:
-            logger.error("Unsupported architecture.")
+            msg_err = "Unsupported architecture."
+            logger.error(msg_err)
+            pytest.exit(msg_err, 1)
+        args += ["-m", str(self.config.get("memory", "1024M"))]
+        if "cpus" in self.config:
+            args += ["-smp", str(self.config["cpus"])]
+        return args
+
+    def _qmp_path(self):
+        return "/tmp/qemu.{port}.qmp".format(port=self._port())
+
+    def _start_kvm(self, arch):
+        """ Start VM in KVM for defined arch """
+        logger.info("Starting VM in KVM.")
+        port = self._port()
+        cmd_kvm = self._vm_args() + [
+            "-display", "none",
+            "-daemonize",
+            "-pidfile", self._pidfile(),
+            "-device", "virtio-net-pci,netdev=net0,mac=02:9f:ec:22:f8:89",
+            "-netdev", "user,id=net0,hostfwd=tcp::{port}-:2222,hostname=garden".format(port=port),
+            # the overlay is thrown away after the tests, no need to sync writes
+            "-drive", "file={snapshot},format=qcow2,if=virtio,cache=unsafe,discard=unmap".format(
+                snapshot=self._snapshot_path()),
+        ]
+        if self.boot_snapshot:
+            cmd_kvm += ["-qmp", "unix:{path},server=on,wait=off".format(path=self._qmp_path())]
+        if self.restored:
+            cmd_kvm += ["-loadvm", BOOT_SNAPSHOT_NAME]
+        self._run(cmd_kvm)
+        logger.info("VM started as {arch} in KVM.".format(arch=arch))
+
+    def _qmp(self, *commands):
+        """ Execute QEMU monitor (HMP) commands via QMP, return once done """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(self._qmp_path())
+            f = s.makefile("rw")
+
+            def execute(cmd, **arguments):
+                f.write(json.dumps({"execute": cmd, "arguments": arguments}) + "\n")
+                f.flush()
+                while True:
+                    response = json.loads(f.readline())
+                    if "error" in response:
+                        raise RuntimeError(f"{cmd}: {response['error']}")
+                    if "return" in response:
+                        return response["return"]
+
+            json.loads(f.readline()) # greeting
+            execute("qmp_capabilities")
+            for command in commands:
+                output = execute("human-monitor-command", **{"command-line": command})
+                if output:
+                    logger.info(f"{command}: {output}")
+
+    def after_boot(self, ssh):
+        """ Called once SSH is ready: save the VM state for later sessions,
+        or adjust the restored VM """
+        if self.restored:
+            # the clock of the guest stopped when its state was saved
+            ssh.execute_command("date -s @{now}".format(now=int(time.time())), quiet=True)
+        elif self.boot_snapshot:
+            logger.info("Saving VM state to {boot_snapshot}".format(boot_snapshot=self.boot_snapshot))
+            tmp_path = "{boot_snapshot}.{pid}.tmp".format(boot_snapshot=self.boot_snapshot, pid=os.getpid())
+            self._qmp("stop")
+            try:
+                self._qmp(f"savevm {BOOT_SNAPSHOT_NAME}")
+                self._run(["cp", "--reflink=auto", self._snapshot_path(), tmp_path])
+                os.replace(tmp_path, self.boot_snapshot)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                self._qmp("cont")
 
     def _stop_kvm(self):
         """ Stop VM and remove injected file """
         logger.info("Stopping VM and cleaning up")
-        image = self.config["image"]
-        image_name = os.path.basename(image)
-        p = subprocess.run("pkill qemu", shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        rc = p.returncode
-        if rc == 0:
+        snapshot = self._snapshot_path()
+        pidfile = self._pidfile()
+        try:
+            with open(pidfile) as f:
+                os.kill(int(f.read().strip()), signal.SIGTERM)
             logger.info("Succeeded stopping qemu")
-            if os.path.exists("/tmp/{image_name}.snapshot.img".format(image_name=image_name)):
-                os.remove("/tmp/{image_name}.snapshot.img".format(image_name=image_name))
-            else:
-                logger.info("/tmp/{image_name}.snapshot.img does not exist".format(image_name=image_name))
-            if os.path.exists("/tmp/qemu.pid"):
-                os.remove("/tmp/qemu.pid")
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed stopping qemu: {e}")
+            return
+        if os.path.exists(snapshot):
+            os.remove(snapshot)
         else:
-            logger.error("Failed stopping qemu")
+            logger.info("{snapshot} does not exist".format(snapshot=snapshot))
+        if os.path.exists(pidfile):
+            os.remove(pidfile)
+        if os.path.exists(self._qmp_path()):
+            os.remove(self._qmp_path())